@@ -0,0 +1,81 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from utils import ApiClient, iter_pages, page_to_record_batch, decode_csv_page
+from benchmarks.synthetic import SyntheticRows
+from benchmarks.soda_stub import SodaStub
+
+# Compares decoding the pages of trips from the JSON responses with parsing the CSV
+# responses straight into Arrow columns, on their own and fetched through the local SODA stub:
+#
+#   python -m benchmarks.bench_decode --rows 1000000
+
+
+def timed(function, bodies):
+    started = time.perf_counter()
+    for body in bodies:
+        function(body)
+    return time.perf_counter() - started
+
+
+def json_to_record_batch(body):
+    return page_to_record_batch(json.loads(body))
+
+
+def json_to_dataframe(body):
+    # the DataFrame path of fetch_all_data and calculate_trip_length
+    df = pd.DataFrame(json.loads(body))
+    df['tpep_pickup_datetime'] = pd.to_datetime(df['tpep_pickup_datetime'])
+    df['tpep_dropoff_datetime'] = pd.to_datetime(df['tpep_dropoff_datetime'])
+    return df
+
+
+def fetch(url, client, start_date, end_date, limit):
+    started = time.perf_counter()
+    rows = sum(page_to_record_batch(page).num_rows for page in iter_pages(start_date, end_date, limit, url, client=client))
+    return rows, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON against CSV decoding of the fetched trips.')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--page-size', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every decoder, the fastest one counts')
+    args = parser.parse_args()
+
+    trips = SyntheticRows.generate(args.rows)
+    pages = [trips[i:i + args.page_size] for i in range(0, args.rows, args.page_size)]
+    params = {'$select': 'tpep_pickup_datetime, tpep_dropoff_datetime'}
+    json_bodies = [json.dumps(page).encode() for page in pages]
+    csv_bodies = [SodaStub.to_csv(page, params) for page in pages]
+    del pages
+    print(f"{args.rows} synthetic trips in {len(json_bodies)} pages of {args.page_size}")
+    print(f"body per trip: JSON {sum(map(len, json_bodies)) / args.rows:.0f} bytes, CSV {sum(map(len, csv_bodies)) / args.rows:.0f} bytes")
+
+    decoders = [
+        ('JSON -> pd.DataFrame + to_datetime', json_to_dataframe, json_bodies),
+        ('JSON -> page_to_record_batch', json_to_record_batch, json_bodies),
+        ('CSV -> decode_csv_page', decode_csv_page, csv_bodies),
+    ]
+    results = {}
+    for name, decoder, bodies in decoders:
+        results[name] = min(timed(decoder, bodies) for _ in range(args.repeat)) / args.rows
+        print(f"{name:<36} {results[name] * 1e9:8.0f} ns per trip")
+    print(f"decode_csv_page is {results['JSON -> page_to_record_batch'] / results['CSV -> decode_csv_page']:.1f}x faster than the JSON path")
+    assert page_to_record_batch(decode_csv_page(csv_bodies[0])).equals(json_to_record_batch(json_bodies[0]))
+
+    # end to end, every page through HTTP with gzip, decoding and conversion
+    last = np.datetime_as_string(trips.pickups_ns[-1], unit='D')
+    start_date, end_date = '2023-01-01T00:00:00.000', f"{last}T23:59:59.000"
+    with SodaStub(trips, pickups=trips.pickups) as stub:
+        for page_format in ('json', 'csv'):
+            client = ApiClient(page_format=page_format)
+            rows, seconds = fetch(stub.url, client, start_date, end_date, args.page_size)
+            client.close()
+            print(f"fetched {rows} trips as {page_format.upper()} through the stub in {seconds:.2f} s, "
+                  f"{seconds / rows * 1e9:.0f} ns per trip, {client.stats.bytes_received / rows:.1f} bytes per trip on the wire")
+
+if __name__ == '__main__':
+    main()
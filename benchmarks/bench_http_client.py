@@ -0,0 +1,64 @@
+import argparse
+import time
+from urllib.parse import urlencode
+from utils import ApiClient, FetchStats, create_params, make_api_request
+
+# Compares a new connection per page (bare requests.get) with the pooled, gzip negotiating ApiClient
+# against the local SODA stub.
+#
+#   python -m benchmarks.bench_http_client --pages 50 --limit 5000
+
+START_DATE = '2023-01-01T00:00:00.000'
+END_DATE = '2023-12-31T23:59:59.000'
+
+
+def fetch_pages(pages, limit, base_url, get):
+    """
+    Fetches a number of pages one after the other.
+
+    Args:
+        pages (int): Number of pages
+        limit (int): Records per page
+        base_url (str): Base URL of the stub endpoint
+        get (callable): Sends one request and returns the decoded page
+
+    Returns:
+        float: Wall time in seconds
+    """
+
+    started = time.perf_counter()
+    for page in range(pages):
+        get(f"{base_url}?{urlencode(create_params(START_DATE, END_DATE, limit, page * limit))}")
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='New connection per page versus the pooled ApiClient.')
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=5000)
+    args = parser.parse_args()
+
+    from benchmarks.soda_stub import SodaStub, make_rows
+
+    rows = make_rows('2023-01-01', periods=args.pages * args.limit, freq='10s')
+    with SodaStub(rows) as stub:
+        # requests.get asks for gzip by default too, the difference is the connection per page
+        bare_stats = FetchStats()
+        bare_seconds = fetch_pages(args.pages, args.limit, stub.url, lambda url: make_api_request(url, stats=bare_stats))
+        bare_connections = stub.connections
+
+        client = ApiClient()
+        pooled_seconds = fetch_pages(args.pages, args.limit, stub.url, client.get)
+        client.close()
+        pooled_connections = stub.connections - bare_connections
+
+    for name, seconds, connections, stats in [('requests.get', bare_seconds, bare_connections, bare_stats),
+                                               ('ApiClient', pooled_seconds, pooled_connections, client.stats)]:
+        summary = stats.summary()
+        print(f"{name:<13} {seconds:6.2f} s  connections {connections:<4} "
+              f"received {summary['bytes_received'] / 2**20:7.1f} MB  decoded {summary['bytes_decoded'] / 2**20:7.1f} MB  "
+              f"latency p50 {summary['latency_ms_p50']} ms  p95 {summary['latency_ms_p95']} ms")
+
+
+if __name__ == '__main__':
+    main()
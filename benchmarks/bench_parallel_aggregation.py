@@ -0,0 +1,40 @@
+import argparse
+import os
+import tempfile
+import time
+from utils import summarize_dataset
+from benchmarks.synthetic import write_synthetic_dataset
+
+# Times the aggregation of a multi-year synthetic trip dataset with an increasing number of worker processes.
+#
+#   python -m benchmarks.bench_parallel_aggregation --years 3 --trips-per-day 50000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling of the parallel aggregation with the number of workers.')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--trips-per-day', type=int, default=50_000)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, 'taxi_trips')
+        rows = 365 * args.years * args.trips_per_day
+        first_day, last_day = write_synthetic_dataset(root, rows, start='2021-01-01', trips_per_day=args.trips_per_day)
+        print(f"{rows} synthetic trips from {first_day} to {last_day}, {os.cpu_count()} CPUs")
+
+        baseline = None
+        expected = summarize_dataset(root)
+        workers = 1
+        while workers <= args.max_workers:
+            started = time.perf_counter()
+            result = summarize_dataset(root, workers=workers)
+            seconds = time.perf_counter() - started
+            baseline = baseline or seconds
+            assert result.equals(expected)
+            print(f"workers={workers:<3} {seconds:8.2f} s  speedup {baseline / seconds:5.2f}x")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils import partition_path, write_trip_file, read_parquet_file, summarize_dataset
+from benchmarks.synthetic import synthetic_batches
+
+# Compares the previous layout of the trip dataset, one snappy file with nanosecond
+# timestamps per fetched page, with the files of write_trip_file: sorted, delta and
+# dictionary encoded, zstd compressed and in row groups with tight statistics.
+#
+#   python -m benchmarks.bench_storage --rows 10000000
+
+
+def day_directory(root, batch):
+    day_dir = partition_path(root, np.datetime64(batch.column(0)[0].as_py().date(), 'D'))
+    os.makedirs(day_dir, exist_ok=True)
+    return day_dir
+
+
+def write_previous_layout(root, batch, page_size):
+    day_dir = day_directory(root, batch)
+    for number, offset in enumerate(range(0, batch.num_rows, page_size)):
+        pq.write_table(pa.Table.from_batches([batch.slice(offset, page_size)]), os.path.join(day_dir, f"part-{number:05d}.parquet"))
+
+
+def write_stored_layout(root, batch, page_size):
+    write_trip_file(batch, os.path.join(day_directory(root, batch), 'part-00000.parquet'))
+
+
+def size_mb(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files) / 1e6
+
+
+def fastest(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+    return min(seconds), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Size and read times of the previous and the tuned Parquet layout.')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--page-size', type=int, default=50_000, help='trips per file of the previous layout')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every read, the fastest one counts')
+    args = parser.parse_args()
+
+    layouts = [('previous', write_previous_layout), ('write_trip_file', write_stored_layout)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, writer in layouts:
+            root = os.path.join(tmp_dir, name)
+            started = time.perf_counter()
+            for batch in synthetic_batches(args.rows):
+                writer(root, batch, args.page_size)
+            print(f"{name}: written in {time.perf_counter() - started:.2f} s, {size_mb(root):.1f} MB, "
+                  f"{size_mb(root) * 1e6 / args.rows:.2f} bytes per trip")
+
+        reads = [
+            ('full scan', None, None),
+            ('one day', '2023-01-05T00:00:00.000', '2023-01-05T23:59:59.000'),
+            ('6 hours of one day', '2023-01-05T06:00:00.000', '2023-01-05T11:59:59.000'),
+            ('one week', '2023-01-02T00:00:00.000', '2023-01-08T23:59:59.000'),
+        ]
+        for description, start_date, end_date in reads:
+            counts = []
+            for name, _ in layouts:
+                seconds, trips = fastest(lambda: read_parquet_file(os.path.join(tmp_dir, name), start_date, end_date), args.repeat)
+                counts.append(len(trips))
+                del trips
+                print(f"read_parquet_file {description:<20} {name:<16} {seconds:7.3f} s")
+            assert counts[0] == counts[1]
+
+        summaries = []
+        for name, _ in layouts:
+            seconds, summary = fastest(lambda: summarize_dataset(os.path.join(tmp_dir, name)), args.repeat)
+            summaries.append(summary)
+            print(f"summarize_dataset {'all days':<20} {name:<16} {seconds:7.3f} s")
+        assert summaries[0].equals(summaries[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Compares the peak memory of the list based ingest (fetch_all_data, one DataFrame,
+# one to_parquet call) with the streaming ingest (iter_pages into write_pages_to_dataset)
+# on a synthetic multi-month feed served by the local SODA stub.
+#
+#   python -m benchmarks.bench_streaming_ingest --months 3
+
+START_DATE = '2023-01-01T00:00:00.000'
+
+
+def run_ingest(mode, url, end_date, limit, file_path):
+    """
+    Runs one ingest mode in the current process and reports its cost.
+
+    Args:
+        mode (str): 'list' for the list based ingest, 'stream' for the streaming one
+        url (str): Base URL of the stub endpoint
+        end_date (str): End date of the fetched range
+        limit (int): Records per page
+        file_path (str): Parquet file to write, the root of the dataset when streaming
+
+    Returns:
+        dict: Rows written, wall time and peak RSS in MB
+    """
+
+    import pandas as pd
+    from utils import fetch_all_data, iter_pages, write_pages_to_dataset, read_memory
+
+    started = time.perf_counter()
+    if mode == 'list':
+        result = fetch_all_data(START_DATE, end_date, limit, url)
+        trips = pd.DataFrame(result)
+        trips['tpep_pickup_datetime'] = pd.to_datetime(trips['tpep_pickup_datetime'])
+        trips['tpep_dropoff_datetime'] = pd.to_datetime(trips['tpep_dropoff_datetime'])
+        trips.to_parquet(file_path, engine='pyarrow')
+        rows = len(trips)
+    else:
+        rows = write_pages_to_dataset(iter_pages(START_DATE, end_date, limit, url), file_path)
+    return {
+        'mode': mode,
+        'rows': rows,
+        'seconds': round(time.perf_counter() - started, 2),
+        'peak_rss_mb': round(read_memory()[1] / 1024 / 1024, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peak memory of the list based and the streaming ingest.')
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--freq', default='15s', help='time between two synthetic pickups')
+    parser.add_argument('--limit', type=int, default=50000)
+    parser.add_argument('--run', choices=['list', 'stream'], help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--end-date', help=argparse.SUPPRESS)
+    parser.add_argument('--file-path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_ingest(args.run, args.url, args.end_date, args.limit, args.file_path)))
+        return
+
+    import pandas as pd
+    from benchmarks.soda_stub import SodaStub, make_rows
+
+    end = pd.Timestamp(START_DATE) + pd.DateOffset(months=args.months) - pd.Timedelta(seconds=1)
+    periods = int((end - pd.Timestamp(START_DATE)) / pd.Timedelta(args.freq)) + 1
+    rows = make_rows(START_DATE, periods=periods, freq=args.freq)
+    print(f"Serving {len(rows)} synthetic trips over {args.months} months")
+
+    # every mode runs in a fresh interpreter so that the peak RSS only covers that mode
+    with SodaStub(rows) as stub, tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ('list', 'stream'):
+            completed = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_streaming_ingest', '--run', mode,
+                 '--url', stub.url, '--end-date', end.strftime('%Y-%m-%dT%H:%M:%S.000'),
+                 '--limit', str(args.limit), '--file-path', os.path.join(tmp_dir, f'{mode}.parquet')],
+                capture_output=True, text=True, check=True
+            )
+            print(completed.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from utils import calculate_trip_length, aggregate_daily_trips, summarize_daily_trips
+
+# Compares the trip length and daily aggregation hot path with the implementation it replaced.
+#
+#   python -m benchmarks.bench_trip_length --rows 10000000
+
+
+def previous_calculate_trip_length(df):
+    df['tpep_pickup_datetime'] = pd.to_datetime(df['tpep_pickup_datetime'])
+    df['tpep_dropoff_datetime'] = pd.to_datetime(df['tpep_dropoff_datetime'])
+    df['trip_length'] = (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']).dt.total_seconds() / 60
+    return df
+
+
+def previous_aggregate_daily_trips(df):
+    daily_summary = df.groupby(df['tpep_pickup_datetime'].dt.date)['trip_length'].sum().reset_index()
+    daily_summary['daily_trip_time (in hours)'] = (daily_summary['trip_length'] / 60).round(1)
+    daily_summary.drop('trip_length', axis=1, inplace=True)
+    daily_summary['tpep_pickup_datetime'] = pd.to_datetime(daily_summary['tpep_pickup_datetime'])
+    return daily_summary
+
+
+def synthetic_trips(rows, seed=0):
+    """
+    Creates trips picked up uniformly over 2023 with durations of up to two hours.
+
+    Args:
+        rows (int): Number of trips
+        seed (int): Seed of the random generator
+
+    Returns:
+        pandas.DataFrame: Pickup and dropoff timestamps as datetime64
+    """
+
+    rng = np.random.default_rng(seed)
+    pickups = np.sort(np.datetime64('2023-01-01', 'ns') + rng.integers(0, 365 * 86_400, rows).astype('timedelta64[s]'))
+    dropoffs = pickups + rng.integers(0, 7_200, rows).astype('timedelta64[s]')
+    return pd.DataFrame({'tpep_pickup_datetime': pickups, 'tpep_dropoff_datetime': dropoffs})
+
+
+def measure(name, function, make_input, repeat=3):
+    """
+    Reports the best wall time of a function and the memory it allocates on top of its input.
+
+    The timed runs go without tracemalloc, which slows NumPy allocations down, and
+    the peak memory is taken from one extra traced run.
+
+    Args:
+        name (str): Label of the measurement
+        function (callable): Function taking the trips DataFrame
+        make_input (callable): Returns a fresh input for every run
+        repeat (int): Number of timed runs
+
+    Returns:
+        object: Result of the last run
+    """
+
+    timings = []
+    for _ in range(repeat):
+        df = make_input()
+        started = time.perf_counter()
+        result = function(df)
+        timings.append(time.perf_counter() - started)
+    df = make_input()
+    tracemalloc.start()
+    function(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<45} {min(timings):8.2f} s {peak / 2**20:10.1f} MB peak")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trip length and daily aggregation before and after vectorization.')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    trips = synthetic_trips(args.rows)
+    print(f"{args.rows} synthetic trips, {trips.memory_usage().sum() / 2**20:.0f} MB")
+
+    before = measure('before: calculate_trip_length', previous_calculate_trip_length, trips.copy)
+    after = measure('after:  calculate_trip_length', calculate_trip_length, lambda: trips)
+    pd.testing.assert_series_equal(before['trip_length'], after['trip_length'])
+
+    daily_before = measure('before: aggregate_daily_trips', previous_aggregate_daily_trips, lambda: before)
+    daily_after = measure('after:  aggregate_daily_trips', aggregate_daily_trips, lambda: after)
+    pd.testing.assert_frame_equal(daily_before, daily_after)
+
+    measure('after:  summarize_daily_trips (int32 seconds)', summarize_daily_trips, lambda: trips)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from utils import export_trip_store, trip_store_files, read_parquet_file, summarize_dataset, read_memory, reset_peak_memory
+from benchmarks.synthetic import write_synthetic_dataset
+from benchmarks.suite import MB
+
+# Compares reading the Parquet trip dataset with reading the memory-mapped Arrow IPC trip
+# store, for windows of a few hours to the whole history, and the start of the data-handler
+# verification: loading the dataset with pandas against mapping the store and the footers.
+# Also times the export of every day and of the last one, the export after a tail run.
+#
+#   python -m benchmarks.bench_trip_store --rows 10000000
+#
+# The files are in the page cache after writing them, so the times are the ones of repeated analyses.
+
+VERIFY_WITH_PANDAS = """
+import sys
+import pandas as pd
+print(len(pd.read_parquet(sys.argv[1])))
+"""
+
+VERIFY_WITH_MEMORY_MAP = """
+import os
+import sys
+import pyarrow as pa
+import pyarrow.dataset as ds
+rows = 0
+for name in os.listdir(sys.argv[2]):
+    reader = pa.ipc.open_file(pa.memory_map(os.path.join(sys.argv[2], name), "r"))
+    rows += sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+assert rows == ds.dataset(sys.argv[1], format="parquet", partitioning="hive").count_rows()
+print(rows)
+"""
+
+
+def measured(function, repeat):
+    seconds, increase = [], 0.0
+    for _ in range(repeat):
+        reset_peak_memory()
+        rss_before = read_memory()[0] / MB
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+        increase = max(increase, read_memory()[1] / MB - rss_before)
+        del result
+    return min(seconds), increase
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parquet dataset against the memory-mapped trip store.')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every read, the fastest one counts')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root, store = os.path.join(tmp_dir, 'taxi_trips'), os.path.join(tmp_dir, 'taxi_trips.arrow')
+        first_day, last_day = write_synthetic_dataset(root, args.rows)
+        started = time.perf_counter()
+        export_trip_store(root, store)
+        size = sum(os.path.getsize(path) for path in trip_store_files(store))
+        print(f"export_trip_store of {args.rows} trips in {time.perf_counter() - started:.2f} s, {size / 1e6:.0f} MB")
+        started = time.perf_counter()
+        export_trip_store(root, store, [str(last_day)])
+        print(f"export_trip_store of the last day in {time.perf_counter() - started:.3f} s")
+
+        day = first_day + 4
+        reads = [
+            ('6 hours', f"{day}T06:00:00.000", f"{day}T11:59:59.000"),
+            ('one day', f"{day}T00:00:00.000", f"{day}T23:59:59.000"),
+            ('one week', f"{day}T00:00:00.000", f"{day + 6}T23:59:59.000"),
+            ('everything', f"{first_day}T00:00:00.000", f"{last_day}T23:59:59.000"),
+        ]
+        print(f"{'':<36} {'Parquet dataset':>24} {'trip store':>24}")
+        for function in (read_parquet_file, summarize_dataset):
+            for description, start_date, end_date in reads:
+                line = f"{function.__name__ + ' ' + description:<36}"
+                for path in (root, store):
+                    seconds, increase = measured(lambda: function(path, start_date, end_date), args.repeat)
+                    line += f" {seconds:8.3f} s {increase:7.0f} MB RSS"
+                print(line)
+
+        for name, script in (('pandas', VERIFY_WITH_PANDAS), ('memory map', VERIFY_WITH_MEMORY_MAP)):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', script, root, store], capture_output=True, text=True, check=True).stdout
+            print(f"verification with {name:<10} {time.perf_counter() - started:6.2f} s for {int(output)} rows, interpreter start included")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils import TRIP_SCHEMA, TripValidator, page_to_record_batch
+
+# Times the validation of the fetched trips next to the decoding, conversion and storage stages around it.
+#
+#   python -m benchmarks.bench_validation --rows 10000000
+
+
+def synthetic_pages(rows, page_size, junk=0.01, seed=0):
+    """
+    Creates a month of trips in pickup order, split into pages, with a share of invalid trips.
+
+    Args:
+        rows (int): Number of trips
+        page_size (int): Number of trips per page
+        junk (float): Share of trips broken by one of the validation rules
+        seed (int): Seed of the random generator
+
+    Returns:
+        list: Record batches following TRIP_SCHEMA
+    """
+
+    rng = np.random.default_rng(seed)
+    pickups = np.sort(np.datetime64('2023-01-01', 'ns') + rng.integers(0, 31 * 86_400, rows).astype('timedelta64[s]'))
+    durations = rng.integers(60, 3_600, rows).astype('timedelta64[s]')
+    broken = rng.random(rows) < junk
+    kind = rng.integers(0, 3, rows)
+    durations[broken & (kind == 0)] *= -1
+    durations[broken & (kind == 1)] += np.timedelta64(3 * 86_400, 's')
+    dropoffs = pickups + durations
+    # the third kind repeats the trip before it
+    repeated = np.flatnonzero(broken & (kind == 2))
+    repeated = repeated[repeated > 0]
+    pickups[repeated], dropoffs[repeated] = pickups[repeated - 1], dropoffs[repeated - 1]
+    return [
+        pa.RecordBatch.from_arrays([pa.array(pickups[i:i + page_size]), pa.array(dropoffs[i:i + page_size])], schema=TRIP_SCHEMA)
+        for i in range(0, rows, page_size)
+    ]
+
+
+def timed(function, pages):
+    started = time.perf_counter()
+    for page in pages:
+        function(page)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overhead of the trip validation on the ingest.')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--page-size', type=int, default=50_000)
+    parser.add_argument('--decode-rows', type=int, default=1_000_000, help='trips of the sample decoded from JSON')
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.rows, args.page_size)
+    print(f"{args.rows} synthetic trips in {len(pages)} pages of {args.page_size}")
+
+    # the API responses of a sample, decoding all of them would take minutes
+    sample = pages[:max(1, args.decode_rows // args.page_size)]
+    sample_rows = sum(batch.num_rows for batch in sample)
+    bodies = [
+        json.dumps([
+            {'tpep_pickup_datetime': p, 'tpep_dropoff_datetime': d}
+            for p, d in zip(np.datetime_as_string(batch.column(0).to_numpy(), unit='ms'),
+                            np.datetime_as_string(batch.column(1).to_numpy(), unit='ms'))
+        ]).encode()
+        for batch in sample
+    ]
+    started = time.perf_counter()
+    records = [json.loads(body) for body in bodies]
+    decode = (time.perf_counter() - started) / sample_rows
+    convert = timed(page_to_record_batch, records) / sample_rows
+
+    validator = TripValidator('2023-01-01T00:00:00.000', '2023-01-31T23:59:59.000')
+    validate = timed(validator.validate, pages) / args.rows
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with pq.ParquetWriter(os.path.join(tmp_dir, 'trips.parquet'), TRIP_SCHEMA) as writer:
+            write = timed(writer.write_batch, pages) / args.rows
+
+    for name, seconds in [('decode JSON', decode), ('page_to_record_batch', convert), ('validate', validate), ('write parquet', write)]:
+        print(f"{name:<22} {seconds * 1e9:8.0f} ns per trip")
+    print(f"validation adds {validate / (decode + convert + write):.1%} to decoding, converting and writing the trips")
+    print(f"rejected: {validator.summary()['rejected']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import bisect
+import gzip
+import json
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# A local stand-in for the SODA endpoint of the yellow taxi dataset.
+# It only understands the query shapes built by utils.py, which is enough to
+# exercise the fetching code end to end without network access.
+
+WHERE_PATTERN = re.compile(r"tpep_pickup_datetime >= '([^']+)' AND tpep_pickup_datetime <= '([^']+)'")
+KEYSET_PATTERN = re.compile(r"tpep_pickup_datetime > '([^']+)' OR \(tpep_pickup_datetime = '\1' AND :id > '([^']+)'\)")
+
+
+def make_rows(start, periods, freq='min', trip_minutes=10):
+    """
+    Creates synthetic raw API rows ordered by pickup time.
+
+    Args:
+        start (str): First pickup timestamp
+        periods (int): Number of rows
+        freq (str): Pandas frequency string between two pickups
+        trip_minutes (int): Length of every trip in minutes
+
+    Returns:
+        list: Rows shaped like the records returned by the API
+    """
+
+    import pandas as pd
+
+    pickups = pd.date_range(start=start, periods=periods, freq=freq)
+    dropoffs = pickups + pd.Timedelta(minutes=trip_minutes)
+    fmt = '%Y-%m-%dT%H:%M:%S.000'
+    return [
+        {'tpep_pickup_datetime': p, 'tpep_dropoff_datetime': d}
+        for p, d in zip(pickups.strftime(fmt), dropoffs.strftime(fmt))
+    ]
+
+
+class RowKeys:
+    """
+    Keyset order of the stub rows, the pickup time and ':id' of a row by its position.
+
+    Args:
+        pickups (sequence): Pickup timestamp strings in row order
+    """
+
+    def __init__(self, pickups):
+        self.pickups = pickups
+
+    def __len__(self):
+        return len(self.pickups)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.pickups[i], f"row-{i:08d}"
+
+
+class SodaStub:
+    """
+    Serves a fixed list of rows over HTTP on a free local port.
+
+    Every row gets a row identifier ':id' increasing with its position, like the
+    system field of a SODA dataset, which is returned when it is selected.
+
+    Args:
+        rows (sequence): Raw API rows ordered by pickup time, any sequence supporting
+            len and slicing, so large synthetic data can be formatted on demand
+        latency (float): Seconds every request sleeps before answering
+        pickups (sequence, optional): Pickup timestamp strings of the rows, taken from the rows by default
+    """
+
+    def __init__(self, rows, latency=0.0, pickups=None):
+        self.rows = rows
+        self.pickups = pickups if pickups is not None else [r['tpep_pickup_datetime'] for r in rows]
+        self.keys = RowKeys(self.pickups)
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/resource/4b4i-vvec.json"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def query(self, params):
+        """
+        Answers a parsed SODA query.
+
+        Args:
+            params (dict): Query parameters, one value per key
+
+        Returns:
+            list: JSON serializable response rows
+        """
+
+        first, last = 0, len(self.rows)
+        match = WHERE_PATTERN.search(params.get('$where', ''))
+        if match:
+            low, high = match.groups()
+            first, last = bisect.bisect_left(self.pickups, low), bisect.bisect_right(self.pickups, high)
+        match = KEYSET_PATTERN.search(params.get('$where', ''))
+        if match:
+            first = max(first, bisect.bisect_right(self.keys, match.groups()))
+        if params.get('$select', '').startswith('count(*)'):
+            return [{'count': str(last - first)}]
+        offset = int(params.get('$offset', 0))
+        limit = int(params.get('$limit', 1000))
+        if '$group' in params:
+            rows = self.rows[first:last]
+            if 'tpep_dropoff_datetime IS NOT NULL' in params.get('$where', ''):
+                rows = [r for r in rows if r.get('tpep_dropoff_datetime') is not None]
+            page = self.group(rows)[offset:offset + limit]
+        else:
+            page = self.rows[first + offset:min(last, first + offset + limit)]
+        if ':id' in params.get('$select', ''):
+            keys = self.keys[first + offset:first + offset + limit]
+            page = [dict(r, **{':id': row_id}) for r, (_, row_id) in zip(page, keys)]
+        return page
+
+    @staticmethod
+    def to_csv(rows, params):
+        """
+        Formats response rows like the CSV endpoint, a header of the selected fields and every value quoted.
+
+        Args:
+            rows (list): Response rows from query
+            params (dict): Query parameters, one value per key
+
+        Returns:
+            bytes: CSV body
+        """
+
+        names = [name.strip() for name in params['$select'].split(',')]
+        lines = [','.join(f'"{name}"' for name in names)]
+        lines += [','.join(f'"{row[name]}"' if name in row else '' for name in names) for row in rows]
+        return ('\n'.join(lines) + '\n').encode()
+
+    @staticmethod
+    def group(rows):
+        """
+        Answers the daily aggregate query of utils.create_aggregate_params.
+
+        Args:
+            rows (list): Raw API rows matching the filter
+
+        Returns:
+            list: One row per pickup day and dropoff day, without the dropoff fields for trips without a dropoff like SODA
+        """
+
+        def seconds_of_day(timestamp):
+            hh, mm, ss = timestamp[11:19].split(':')
+            return int(hh) * 3600 + int(mm) * 60 + int(ss)
+
+        groups = {}
+        for r in rows:
+            pickup, dropoff = r['tpep_pickup_datetime'], r.get('tpep_dropoff_datetime')
+            key = (pickup[:10] + 'T00:00:00.000', dropoff and dropoff[:10] + 'T00:00:00.000')
+            count, pickup_seconds, dropoff_seconds = groups.get(key, (0, 0, 0))
+            groups[key] = (count + 1, pickup_seconds + seconds_of_day(pickup), dropoff_seconds + (seconds_of_day(dropoff) if dropoff else 0))
+        rows = []
+        for (pickup_day, dropoff_day), (count, pickup_seconds, dropoff_seconds) in sorted(groups.items(), key=lambda g: (g[0][0], g[0][1] or '')):
+            row = {'pickup_day': pickup_day, 'trip_count': str(count), 'pickup_seconds': str(pickup_seconds)}
+            if dropoff_day is not None:
+                row.update(dropoff_day=dropoff_day, dropoff_seconds=str(dropoff_seconds))
+            rows.append(row)
+        return rows
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections alive, one handler serves all requests of a connection
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # headers and body are written separately, without this the body of a
+                # kept-alive connection waits for the delayed ACK of the headers
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path.endswith('.csv'):
+                    body, content_type = stub.to_csv(stub.query(params), params), 'text/csv'
+                else:
+                    body, content_type = json.dumps(stub.query(params)).encode(), 'application/json'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=6)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
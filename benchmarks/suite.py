@@ -0,0 +1,192 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from utils import ApiClient, iter_pages, page_to_record_batch, write_pages_to_dataset, read_parquet_file
+from utils import summarize_dataset, process_taxi_data, update_daily_summary, read_daily_summary, rolling_statistics
+from utils import read_memory, reset_peak_memory
+from benchmarks.synthetic import SyntheticRows, write_synthetic_dataset
+from benchmarks.soda_stub import SodaStub
+
+# Times and memory-profiles the stages of the pipeline on synthetic trips and writes the
+# results as JSON, one file per run, so that runs of different commits can be compared:
+#
+#   python -m benchmarks.suite --rows 1000000 10000000 100000000
+#   python -m benchmarks.suite --compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+#
+# Fetching goes through the local SODA stub and the in-memory stages hold every trip,
+# so they run on the first --fetch-rows and --in-memory-rows trips of larger sizes.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+MB = 1024 * 1024
+
+
+def run_stage(results, name, rows, function, **extra):
+    """
+    Runs one stage of the pipeline and records its wall time and memory.
+
+    Args:
+        results (list): Stage results of the run, the new one is appended
+        name (str): Name of the stage
+        rows (int): Number of trips the stage processes
+        function (callable): The stage, called without arguments
+        **extra: Further values recorded with the stage
+
+    Returns:
+        object: Result of the stage
+    """
+
+    # without a reset the peak is the one of the whole run so far
+    peak_reset = reset_peak_memory()
+    rss_before = read_memory()[0] / MB
+    started = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - started
+    peak = read_memory()[1] / MB
+    results.append({
+        'stage': name, 'rows': rows, 'seconds': round(seconds, 4), 'rows_per_second': round(rows / seconds) if seconds else None,
+        'rss_before_mb': round(rss_before, 1), 'peak_rss_mb': round(peak, 1), 'peak_rss_increase_mb': round(peak - rss_before, 1),
+        'peak_reset': peak_reset, **extra,
+    })
+    print(f"{rows:>11} {name:<22} {seconds:9.2f} s {peak - rss_before:9.0f} MB above {rss_before:6.0f} MB")
+    return result
+
+
+def run_size(rows, fetch_rows, in_memory_rows, workers, limit, tmp_dir):
+    """
+    Runs all stages for one number of trips.
+
+    Returns:
+        list: Stage results
+    """
+
+    results = []
+    root = os.path.join(tmp_dir, f"trips_{rows}")
+    first_day, last_day = run_stage(results, 'generate', rows, lambda: write_synthetic_dataset(root, rows))
+    start_date, end_date = f"{first_day}T00:00:00.000", f"{last_day}T23:59:59.000"
+
+    fetch_rows = min(rows, fetch_rows)
+    served = SyntheticRows.generate(fetch_rows)
+    client = ApiClient(pool_size=workers)
+    with SodaStub(served, pickups=served.pickups) as stub:
+        pages = run_stage(results, 'fetch', fetch_rows,
+                          lambda: list(iter_pages(start_date, end_date, limit, stub.url, workers, client=client)),
+                          workers=workers, page_size=limit)
+    client.close()
+    results[-1]['http'] = client.stats.summary()
+    del served
+
+    run_stage(results, 'convert', fetch_rows, lambda: [page_to_record_batch(page) for page in pages])
+    fetched_root = os.path.join(tmp_dir, f"fetched_{rows}")
+    run_stage(results, 'write_parquet', fetch_rows, lambda: write_pages_to_dataset(pages, fetched_root))
+    del pages
+
+    partials = run_stage(results, 'aggregate', rows, lambda: summarize_dataset(root, start_date, end_date))
+
+    in_memory_rows = min(rows, in_memory_rows)
+    days = np.datetime64(first_day) + np.arange((last_day - first_day).astype('int64') + 1)
+    counts = partials.set_index('tpep_pickup_datetime')['trip_count'].reindex(days.astype('datetime64[ns]'), fill_value=0)
+    last_in_memory = counts.index[min(np.searchsorted(counts.cumsum().to_numpy(), in_memory_rows), len(counts) - 1)]
+    window_end = f"{last_in_memory.date()}T23:59:59.000"
+    trips = run_stage(results, 'read_parquet', int(counts[:last_in_memory].sum()),
+                      lambda: read_parquet_file(root, start_date, window_end))
+    run_stage(results, 'aggregate_in_memory', len(trips), lambda: process_taxi_data(trips))
+    del trips
+
+    empty = read_daily_summary(os.path.join(tmp_dir, 'missing.parquet'))
+    summary = run_stage(results, 'update_daily_summary', rows, lambda: update_daily_summary(empty, partials), days=len(partials))
+    run_stage(results, 'rolling_statistics', rows, lambda: rolling_statistics(summary), days=len(summary))
+    return results
+
+
+def environment():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'pyarrow': pa.__version__},
+    }
+
+
+def compare(before_path, after_path, threshold=0.1):
+    """
+    Prints the change of every stage between two result files and flags regressions.
+
+    Args:
+        before_path (str): Results of the baseline run
+        after_path (str): Results of the new run
+        threshold (float): Relative slowdown or memory growth reported as a regression
+
+    Returns:
+        int: Number of regressions
+    """
+
+    with open(before_path) as f:
+        before = {(size['rows'], r['stage']): r for size in json.load(f)['sizes'] for r in size['stages']}
+    with open(after_path) as f:
+        after = json.load(f)
+    regressions = 0
+    print(f"{'rows':>11} {'stage':<22} {'seconds':>19} {'peak increase MB':>21}")
+    for size in after['sizes']:
+        for stage in size['stages']:
+            base = before.get((size['rows'], stage['stage']))
+            if base is None:
+                continue
+            time_ratio = stage['seconds'] / base['seconds'] if base['seconds'] else 1.0
+            memory_growth = stage['peak_rss_increase_mb'] - base['peak_rss_increase_mb']
+            regressed = (time_ratio > 1 + threshold and stage['seconds'] - base['seconds'] > 0.05) or memory_growth > max(10.0, threshold * base['peak_rss_increase_mb'])
+            regressions += regressed
+            print(f"{size['rows']:>11} {stage['stage']:<22} {base['seconds']:8.2f} -> {stage['seconds']:8.2f}"
+                  f" {base['peak_rss_increase_mb']:9.0f} -> {stage['peak_rss_increase_mb']:9.0f}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory of the pipeline stages on synthetic trips.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--fetch-rows', type=int, default=1_000_000, help='trips served by the stub at most')
+    parser.add_argument('--in-memory-rows', type=int, default=10_000_000, help='trips loaded as a DataFrame at most')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--limit', type=int, default=50_000)
+    parser.add_argument('--output', help=f"result file, a new one in {RESULTS_DIR} by default")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files instead')
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare) else 0)
+
+    run = {'environment': environment(), 'sizes': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in args.rows:
+            stages = run_size(rows, args.fetch_rows, args.in_memory_rows, args.workers, args.limit, tmp_dir)
+            run['sizes'].append({'rows': rows, 'stages': stages})
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = (run['environment']['commit'] or 'unknown')[:10]
+        output = os.path.join(RESULTS_DIR, f"{run['environment']['timestamp'].replace(':', '')}_{commit}.json")
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
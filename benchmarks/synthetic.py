@@ -0,0 +1,169 @@
+import os
+import numpy as np
+import pyarrow as pa
+from utils import TRIP_SCHEMA, partition_path, write_trip_file
+
+# Synthetic yellow taxi trips with realistic pickup and duration distributions,
+# shared by the benchmarks. About 100k trips per day like the 2023 data, so
+# 1M trips cover 10 days and 100M trips almost three years.
+
+TRIPS_PER_DAY = 100_000
+
+# Relative pickups per hour of the day, quiet before dawn and busiest in the evening rush.
+HOURLY_PROFILE = np.array([
+    2.8, 1.9, 1.3, 0.9, 0.7, 0.8, 1.8, 3.2, 4.2, 4.4, 4.5, 4.7,
+    5.0, 5.1, 5.4, 5.6, 5.7, 6.2, 6.6, 6.3, 5.6, 5.3, 4.9, 3.9,
+])
+
+# Relative pickups per day of the week, Monday first.
+WEEKLY_PROFILE = np.array([0.88, 0.97, 1.03, 1.06, 1.07, 1.05, 0.94])
+
+
+def synthetic_day(day, trips, rng, junk=0.0):
+    """
+    Creates the trips picked up on one day.
+
+    Pickup hours follow HOURLY_PROFILE and are uniform within the hour. Trip
+    durations are log-normal with a median of 11 minutes and a long tail,
+    clipped to one minute to three hours. A share of the trips can be broken
+    the way real records are: dropoffs before the pickup, multi-day trips and
+    repeated records.
+
+    Args:
+        day (numpy.datetime64): Pickup day
+        trips (int): Number of trips
+        rng (numpy.random.Generator): Random generator
+        junk (float): Share of broken trips
+
+    Returns:
+        tuple: (pickups, dropoffs) as datetime64[ns] arrays in pickup order
+    """
+
+    hours = rng.choice(24, size=trips, p=HOURLY_PROFILE / HOURLY_PROFILE.sum())
+    seconds = hours * 3_600 + rng.integers(0, 3_600, trips)
+    pickups = np.sort(day.astype('datetime64[ns]') + seconds.astype('timedelta64[s]'))
+    durations = np.clip(rng.lognormal(np.log(660), 0.65, trips), 60, 3 * 3_600).astype('int64')
+    if junk:
+        broken = np.flatnonzero(rng.random(trips) < junk)
+        kind = rng.integers(0, 3, len(broken))
+        durations[broken[kind == 0]] *= -1
+        durations[broken[kind == 1]] += 2 * 86_400
+        repeated = broken[(kind == 2) & (broken > 0)]
+        pickups[repeated] = pickups[repeated - 1]
+        durations[repeated] = durations[repeated - 1]
+    return pickups, pickups + durations.astype('timedelta64[s]')
+
+
+def synthetic_batches(rows, start='2023-01-01', trips_per_day=TRIPS_PER_DAY, junk=0.0, seed=0):
+    """
+    Yields synthetic trips day by day, so that any number of them can be generated in bounded memory.
+
+    Args:
+        rows (int): Total number of trips
+        start (str): First pickup day
+        trips_per_day (int): Average number of trips per day, scaled by WEEKLY_PROFILE
+        junk (float): Share of broken trips, see synthetic_day
+        seed (int): Seed of the random generator
+
+    Yields:
+        pyarrow.RecordBatch: Trips of one day following TRIP_SCHEMA
+    """
+
+    rng = np.random.default_rng(seed)
+    day = np.datetime64(start, 'D')
+    remaining = rows
+    while remaining > 0:
+        weekday = (day.astype('int64') + 3) % 7  # 1970-01-01 was a Thursday
+        trips = min(remaining, int(trips_per_day * WEEKLY_PROFILE[weekday]))
+        pickups, dropoffs = synthetic_day(day, trips, rng, junk)
+        yield pa.RecordBatch.from_arrays([pa.array(pickups), pa.array(dropoffs)], schema=TRIP_SCHEMA)
+        remaining -= trips
+        day += 1
+
+
+def write_synthetic_dataset(root, rows, **kwargs):
+    """
+    Writes synthetic trips as a date-partitioned dataset with one file per day, see write_trip_file.
+
+    Args:
+        root (str): Root directory of the dataset
+        rows (int): Total number of trips
+        **kwargs: Passed on to synthetic_batches
+
+    Returns:
+        tuple: (first pickup day, last pickup day) as numpy.datetime64
+    """
+
+    days = []
+    for batch in synthetic_batches(rows, **kwargs):
+        day = batch.column(0)[0].as_py().date()
+        day_dir = partition_path(root, np.datetime64(day, 'D'))
+        os.makedirs(day_dir, exist_ok=True)
+        write_trip_file(batch, os.path.join(day_dir, 'part-00000.parquet'))
+        days.append(np.datetime64(day, 'D'))
+    return days[0], days[-1]
+
+
+class SyntheticRows:
+    """
+    Synthetic trips formatted like the API records on demand, for the SODA stub.
+
+    Only the timestamps are held, as int64 arrays. The records of a page are
+    formatted when the page is sliced out, so a stub can serve millions of
+    trips without holding millions of dicts.
+
+    Args:
+        pickups (numpy.ndarray): Pickup timestamps as datetime64 in pickup order
+        dropoffs (numpy.ndarray): Dropoff timestamps as datetime64
+    """
+
+    def __init__(self, pickups, dropoffs):
+        self.pickups_ns = np.asarray(pickups, dtype='datetime64[ns]')
+        self.dropoffs_ns = np.asarray(dropoffs, dtype='datetime64[ns]')
+        self.pickups = FormattedTimestamps(self.pickups_ns)
+
+    @classmethod
+    def generate(cls, rows, **kwargs):
+        """
+        Creates the rows from synthetic_batches.
+
+        Args:
+            rows (int): Total number of trips
+            **kwargs: Passed on to synthetic_batches
+
+        Returns:
+            SyntheticRows: The generated trips
+        """
+
+        batches = list(synthetic_batches(rows, **kwargs))
+        return cls(np.concatenate([b.column(0).to_numpy() for b in batches]),
+                   np.concatenate([b.column(1).to_numpy() for b in batches]))
+
+    def __len__(self):
+        return len(self.pickups_ns)
+
+    def __getitem__(self, i):
+        if not isinstance(i, slice):
+            return self[i:i + 1][0]
+        pickups = FormattedTimestamps(self.pickups_ns[i])[:]
+        dropoffs = FormattedTimestamps(self.dropoffs_ns[i])[:]
+        return [{'tpep_pickup_datetime': p, 'tpep_dropoff_datetime': d} for p, d in zip(pickups, dropoffs)]
+
+
+class FormattedTimestamps:
+    """
+    Timestamps formatted like the API does, '2023-01-01T00:00:00.000', by position.
+
+    Args:
+        timestamps (numpy.ndarray): datetime64 timestamps
+    """
+
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, i):
+        formatted = np.datetime_as_string(self.timestamps[i], unit='ms')
+        return formatted.tolist() if isinstance(i, slice) else str(formatted)
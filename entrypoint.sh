@@ -1,8 +1,7 @@
 #!/bin/bash
 
-# Run the tasks
-python task1.py
-python task2.py
+# Run the pipeline over the configured date ranges
+python pipeline.py
 
 # Signal completion
-touch /app/data/processing_complete
\ No newline at end of file
+touch /app/data/processing_complete
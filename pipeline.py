@@ -0,0 +1,413 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import yaml
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from utils import ApiClient, ResponseCache, StageMetrics, TripValidator, ingest_range, measure, summarize_dataset, fetch_daily_aggregates
+from utils import trip_length_statistics, rolling_statistics, update_daily_summary, read_daily_summary, write_daily_summary, export_trip_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Timestamps of the date ranges are formatted like the ones of the API, which are local New York times.
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.000'
+TIMEZONE = 'America/New_York'
+
+def flag(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+def load_settings(config_path='config.yaml'):
+    """
+    Reads the configuration and applies the overrides of the environment variables.
+
+    Args:
+        config_path (str): Path of the YAML configuration
+
+    Returns:
+        dict: Settings of the pipeline
+    """
+
+    logger.info(f"Loading the configuration from {config_path}")
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    api, processing, pipeline = config['api'], config.get('processing', {}), config.get('pipeline', {})
+    workers = int(os.getenv('WORKERS', api.get('workers', 1)))
+    cache, validation, metrics = (dict(config.get(section, {})) for section in ('cache', 'validation', 'metrics'))
+    cache['enabled'] = flag('CACHE', cache.get('enabled', False))
+    validation['enabled'] = flag('VALIDATION', validation.get('enabled', False))
+    metrics['enabled'] = flag('METRICS', metrics.get('enabled', False))
+    # start_date_1/end_date_1, start_date_2/end_date_2, ... in the order of their numbers
+    date_ranges = config.get('date_ranges', {})
+    numbers = sorted(int(key[len('start_date_'):]) for key in date_ranges if re.fullmatch(r'start_date_\d+', key))
+    return {
+        'base_url': os.getenv('BASE_URL', api['base_url']),
+        'limit': int(os.getenv('LIMIT', api['limit'])),
+        'workers': workers,
+        'mode': os.getenv('MODE', api.get('mode', 'raw')),
+        'pagination': os.getenv('PAGINATION', api.get('pagination', 'offset')),
+        'page_format': os.getenv('PAGE_FORMAT', api.get('page_format', 'json')),
+        'pool_size': int(os.getenv('POOL_SIZE', api.get('pool_size', max(10, workers)))),
+        'timeout': tuple(api.get('timeout', [10, 120])),
+        'batch_size': int(os.getenv('BATCH_SIZE', processing.get('batch_size', 1000000))),
+        'processes': int(os.getenv('PROCESSES', processing.get('workers', 1))),
+        'rolling_windows': processing.get('rolling_windows', ['7D', '30D', '45D', '90D']),
+        'chunk_days': int(os.getenv('CHUNK_DAYS', pipeline.get('chunk_days', 7))),
+        'interval_minutes': float(os.getenv('INTERVAL_MINUTES', pipeline.get('interval_minutes', 0))),
+        'trips_path': pipeline.get('trips_path', './data/taxi_trips'),
+        'store_path': pipeline.get('store_path'),
+        'summary_path': pipeline.get('summary_path', './data/daily_summary.parquet'),
+        'rejects_directory': pipeline.get('rejects_directory', './data/rejects'),
+        'cache': cache,
+        'validation': validation,
+        'metrics': metrics,
+        'date_ranges': [(date_ranges[f"start_date_{n}"], date_ranges[f"end_date_{n}"]) for n in numbers],
+    }
+
+def create_client(settings, metrics=None):
+    """
+    Creates the API client of a run, with the response cache if it is enabled.
+
+    Args:
+        settings (dict): Settings from load_settings
+        metrics (StageMetrics, optional): Measures the requests
+
+    Returns:
+        ApiClient: Client shared by all requests of the run
+    """
+
+    cache = None
+    if settings['cache']['enabled']:
+        ttl_days, max_size_mb = settings['cache'].get('ttl_days'), settings['cache'].get('max_size_mb')
+        cache = ResponseCache(
+            settings['cache'].get('directory', './data/cache'),
+            ttl_seconds=ttl_days * 86400 if ttl_days else None,
+            max_bytes=max_size_mb * 1024 * 1024 if max_size_mb else None,
+            closed_after_days=settings['cache'].get('closed_after_days', 7),
+        )
+    return ApiClient(settings['pool_size'], settings['timeout'], cache, metrics, settings['page_format'])
+
+def create_validator(settings, start_date, end_date):
+    validation = settings['validation']
+    if not validation.get('enabled', False):
+        return None
+    rejects_path = os.path.join(settings['rejects_directory'], f"pickup_{start_date[:10]}_{end_date[:10]}.parquet")
+    return TripValidator(
+        start_date, end_date,
+        min_trip_seconds=validation.get('min_trip_seconds', 0),
+        max_trip_seconds=validation.get('max_trip_seconds', 86400),
+        deduplicate=validation.get('deduplicate', True),
+        rejects_path=rejects_path if validation.get('quarantine', True) else None,
+    )
+
+def split_range(start_date, end_date, days):
+    """
+    Splits a date range at day boundaries into chunks of at most 'days' days.
+
+    Args:
+        start_date (str): Start date of the range
+        end_date (str): End date of the range, inclusive
+        days (int): Number of days per chunk
+
+    Returns:
+        list: (start date, end date) of every chunk
+    """
+
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    chunks = []
+    while start <= end:
+        stop = min(start.normalize() + pd.Timedelta(days=days) - pd.Timedelta(seconds=1), end)
+        chunks.append((start.strftime(TIMESTAMP_FORMAT), stop.strftime(TIMESTAMP_FORMAT)))
+        start = stop.floor('s') + pd.Timedelta(seconds=1)
+    return chunks
+
+def whole_days(start_date, end_date):
+    """
+    Widens a date range to the whole days it touches.
+
+    The ingest replaces whole day partitions, so a range starting or ending
+    within a day would drop the trips of that day outside the range.
+
+    Args:
+        start_date (str): Start date of the range
+        end_date (str): End date of the range, inclusive
+
+    Returns:
+        tuple: (midnight of the first day, last second of the last day)
+    """
+
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1, seconds=-1)
+    return start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT)
+
+def tail_range(summary, since, until=None):
+    """
+    Finds the date range of a tail run, from the last day in the daily summary up to now.
+
+    The last day is fetched again since it may have been incomplete; its
+    partition and its row in the summary are replaced, so it isn't counted twice.
+
+    Args:
+        summary (pandas.DataFrame): Daily summary, e.g. from read_daily_summary
+        since (str): Start date if the summary is still empty
+        until (str, optional): End date of the range, the current New York time by default
+
+    Returns:
+        tuple: (start date, end date)
+    """
+
+    start = since if summary.empty else summary['tpep_pickup_datetime'].max().strftime(TIMESTAMP_FORMAT)
+    end = until or pd.Timestamp.now(tz=TIMEZONE).tz_localize(None).strftime(TIMESTAMP_FORMAT)
+    return start, end
+
+def run_state_path(settings):
+    return os.path.join(settings['trips_path'], '_pipeline_run.json')
+
+def read_run_state(settings):
+    """
+    Reads the progress of an interrupted raw mode run.
+
+    Args:
+        settings (dict): Settings from load_settings
+
+    Returns:
+        dict: The date ranges of the run and the number of chunks folded into the summary, None if no run was interrupted
+    """
+
+    try:
+        with open(run_state_path(settings)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_run_state(settings, state):
+    path = run_state_path(settings)
+    os.makedirs(settings['trips_path'], exist_ok=True)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+def fetch_range(settings, client, start_date, end_date, metrics=None, lock=None):
+    """
+    Fetches one chunk, runs in the background while the chunk before is processed.
+
+    Args:
+        settings (dict): Settings from load_settings
+        client (ApiClient): Client shared by all requests of the run
+        start_date (str): Start date of the chunk
+        end_date (str): End date of the chunk
+        metrics (StageMetrics, optional): Measures the stages
+        lock (threading.Lock, optional): Held while the fetched days are published
+
+    Returns:
+        pandas.DataFrame: Per-day partials computed by the API in aggregate mode, None otherwise
+    """
+
+    if settings['mode'] == 'aggregate':
+        logger.info(f"Fetching the daily trip counts and summed trip durations of {start_date} - {end_date} computed by the API.")
+        with measure(metrics, 'fetch_aggregates') as stage:
+            new_days = fetch_daily_aggregates(start_date, end_date, settings['limit'], settings['base_url'], client)
+            stage.rows = len(new_days)
+        return new_days
+
+    logger.info(f"Ingesting the trips of {start_date} - {end_date} into the date-partitioned dataset.")
+    validator = create_validator(settings, start_date, end_date)
+    try:
+        with measure(metrics, 'ingest') as stage:
+            result = ingest_range(start_date, end_date, settings['limit'], settings['base_url'], settings['trips_path'],
+                                  settings['workers'], client, settings['pagination'], validator, metrics, lock)
+            stage.rows = result
+    finally:
+        if validator is not None:
+            validator.close()
+            logger.info(f"Validated records: {validator.summary()}")
+    logger.info(f"Total records fetched: {result}")
+    return None
+
+def process_range(settings, start_date, end_date, fetched, summary, metrics=None, lock=None):
+    """
+    Aggregates one fetched chunk and folds its days into the daily summary.
+
+    Args:
+        settings (dict): Settings from load_settings
+        start_date (str): Start date of the chunk
+        end_date (str): End date of the chunk
+        fetched (pandas.DataFrame): Result of fetch_range
+        summary (pandas.DataFrame): Daily summary before the chunk
+        metrics (StageMetrics, optional): Measures the stages
+        lock (threading.Lock, optional): Held while the stored trips are scanned
+
+    Returns:
+        pandas.DataFrame: Updated daily summary, also written to the summary path
+    """
+
+    new_days = fetched
+    if new_days is None:
+        with lock or nullcontext(), measure(metrics, 'aggregate') as stage:
+            new_days = summarize_dataset(settings['trips_path'], start_date, end_date, settings['batch_size'], settings['processes'])
+            stage.rows = int(new_days['trip_count'].sum())
+    with measure(metrics, 'update_summary') as stage:
+        summary = update_daily_summary(summary, new_days)
+        write_daily_summary(summary, settings['summary_path'])
+        stage.rows, stage.bytes_written = len(new_days), os.path.getsize(settings['summary_path'])
+    logger.info(f"Folded {len(new_days)} days of {start_date} - {end_date} into the daily summary at: {settings['summary_path']}")
+    return summary
+
+def run(settings, ranges, client, metrics=None):
+    """
+    Fetches, aggregates and summarizes date ranges in one process.
+
+    The ranges are widened to whole days, see whole_days, and split into
+    chunks of settings['chunk_days'] days. While a
+    chunk is aggregated and folded into the daily summary, the next one is
+    already fetched in a background thread, so the network bound fetching
+    overlaps the CPU bound aggregation. Only one chunk is fetched at a time,
+    since all of them share the staging directory of the dataset, and a lock
+    keeps it from publishing its days while the dataset is scanned. The summary
+    is written after every chunk, so an interrupted run keeps the chunks done.
+
+    In raw mode the number of chunks folded into the summary is recorded in
+    the root of the dataset. A run of the same ranges after an interrupted one
+    skips those chunks and starts with the interrupted chunk, whose ingest
+    resumes after its last committed page, see ingest_range.
+
+    Args:
+        settings (dict): Settings from load_settings
+        ranges (list): (start date, end date) of every date range
+        client (ApiClient): Client shared by all requests of the run
+        metrics (StageMetrics, optional): Measures the stages
+
+    Returns:
+        pandas.DataFrame: Updated daily summary
+    """
+
+    widened = [whole_days(start_date, end_date) for start_date, end_date in ranges]
+    if widened != [tuple(r) for r in ranges]:
+        logger.info(f"Widened the date ranges to whole days: {widened}")
+    ranges = widened
+    chunks = [chunk for start_date, end_date in ranges for chunk in split_range(start_date, end_date, settings['chunk_days'])]
+    summary = read_daily_summary(settings['summary_path'])
+    if not chunks:
+        return summary
+    logger.info(f"Running {settings['mode']} mode over {len(chunks)} chunks of up to {settings['chunk_days']} days")
+    if settings['mode'] == 'aggregate' and settings['validation'].get('enabled', False):
+        # SoQL can't subtract timestamps, so the duration bounds and the deduplication can't be pushed into the query
+        logger.warning("Aggregate mode doesn't validate the trips, the API sums all of them: the daily summary keeps "
+                       "the trips raw mode would reject, only the ones without a dropoff are left out")
+    raw = settings['mode'] == 'raw'
+    state = read_run_state(settings) if raw else None
+    done = 0
+    if state is not None and state['ranges'] == [list(r) for r in ranges]:
+        done = state['done']
+        logger.info(f"Resuming the interrupted run after {done} of {len(chunks)} chunks")
+    if raw:
+        write_run_state(settings, {'ranges': ranges, 'done': done})
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=1) as fetcher:
+        pending = fetcher.submit(fetch_range, settings, client, *chunks[done], metrics, lock) if done < len(chunks) else None
+        for i in range(done, len(chunks)):
+            fetched = pending.result()
+            if i + 1 < len(chunks):
+                pending = fetcher.submit(fetch_range, settings, client, *chunks[i + 1], metrics, lock)
+            summary = process_range(settings, *chunks[i], fetched, summary, metrics, lock)
+            if raw:
+                write_run_state(settings, {'ranges': ranges, 'done': i + 1})
+    if raw:
+        os.remove(run_state_path(settings))
+
+    for start_date, end_date in ranges:
+        with measure(metrics, 'statistics') as stage:
+            statistics = trip_length_statistics(summary, start_date, end_date)
+            stage.rows = len(summary)
+        logger.info(f"Average trip length of {start_date} - {end_date}: {statistics['mean_minutes']:.1f} minutes over {statistics['trip_count']} trips")
+        logger.info(f"Median trip length: {statistics['median_minutes']:.1f} minutes, 95th percentile: {statistics['p95_minutes']:.1f} minutes")
+    first_day = pd.Timestamp(min(start_date for start_date, _ in ranges)).normalize()
+    logger.info(f"Calculating the rolling statistics of the daily trip times over {', '.join(settings['rolling_windows'])} calendar windows.")
+    with measure(metrics, 'statistics') as stage:
+        statistics = rolling_statistics(summary, settings['rolling_windows'])
+        stage.rows = len(summary)
+    logger.info(statistics[statistics['tpep_pickup_datetime'] >= first_day])
+    return summary
+
+def run_once(settings, ranges, metrics=None, task='pipeline'):
+    """
+    Runs the pipeline over date ranges with a client of its own and exports the metrics.
+
+    In raw mode the days of the ranges are exported to the trip store afterwards,
+    if a store path is configured, see export_trip_store.
+
+    Args:
+        settings (dict): Settings from load_settings
+        ranges (list): (start date, end date) of every date range
+        metrics (StageMetrics, optional): Measures the stages, kept across the runs of a polling pipeline
+        task (str): Name of the metrics textfile
+
+    Returns:
+        pandas.DataFrame: Updated daily summary
+    """
+
+    logger.info(f"BASE_URL: {settings['base_url']}, LIMIT: {settings['limit']}, WORKERS: {settings['workers']}, MODE: {settings['mode']}, PAGINATION: {settings['pagination']}, PAGE_FORMAT: {settings['page_format']}, RANGES: {ranges}")
+    client = create_client(settings, metrics)
+    try:
+        summary = run(settings, ranges, client, metrics)
+        if settings['mode'] == 'raw' and settings['store_path'] and os.path.isdir(settings['trips_path']):
+            days = [day for start_date, end_date in ranges for day in pd.date_range(*whole_days(start_date, end_date)).strftime('%Y-%m-%d')]
+            export_trip_store(settings['trips_path'], settings['store_path'], days, metrics)
+    finally:
+        client.close()
+        logger.info(f"API requests: {client.stats.summary()}")
+        if client.cache is not None:
+            logger.info(f"Response cache: {client.cache.summary()}")
+        if metrics is not None:
+            metrics.log()
+            if settings['metrics'].get('textfile_directory'):
+                metrics.write_textfile(os.path.join(settings['metrics']['textfile_directory'], f"{task}.prom"))
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fetches NYC yellow taxi trips and keeps the daily trip length summary up to date.')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--range', nargs=2, action='append', metavar=('START', 'END'), dest='ranges',
+                        help='date range to fetch, e.g. 2023-01-01T00:00:00.000 2023-01-31T23:59:59.000, '
+                             'repeatable, the date_ranges of the configuration by default')
+    parser.add_argument('--tail', action='store_true', help='fetch from the last day in the daily summary up to now')
+    parser.add_argument('--since', help='start of the first tail run while the daily summary is empty, '
+                                        'the start of the first configured date range by default')
+    parser.add_argument('--until', help='end of the tail runs instead of now')
+    parser.add_argument('--interval', type=float, help='minutes between two tail runs, overrides pipeline.interval_minutes, 0 runs once')
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.config)
+    interval = settings['interval_minutes'] if args.interval is None else args.interval
+    if args.tail and args.ranges:
+        parser.error('--tail and --range exclude each other')
+    if interval and not args.tail:
+        parser.error('polling on an interval needs --tail')
+    since = args.since or (settings['date_ranges'][0][0] if settings['date_ranges'] else None)
+    if args.tail and since is None:
+        parser.error('--since is needed without configured date ranges')
+    metrics = StageMetrics({'task': 'pipeline'}) if settings['metrics']['enabled'] else None
+
+    while True:
+        state = read_run_state(settings) if settings['mode'] == 'raw' else None
+        if args.tail and state is not None:
+            # the summary already moved on, so the tail range wouldn't match the chunks of the interrupted run
+            ranges = [tuple(r) for r in state['ranges']]
+            logger.info(f"Finishing the interrupted run of {ranges} first")
+        elif args.tail:
+            ranges = [tail_range(read_daily_summary(settings['summary_path']), since, args.until)]
+        else:
+            ranges = [tuple(r) for r in args.ranges] if args.ranges else settings['date_ranges']
+        run_once(settings, ranges, metrics)
+        if not interval:
+            break
+        logger.info(f"Polling for new trips again in {interval:g} minutes")
+        time.sleep(interval * 60)
+
+if __name__ == "__main__":
+    main()
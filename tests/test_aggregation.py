@@ -0,0 +1,255 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from utils import summarize_daily_trips, update_daily_summary, read_daily_summary, write_daily_summary
+from utils import summarize_dataset, read_parquet_file, write_pages_to_dataset, rolling_statistics
+from utils import merge_daily_partials, trip_length_statistics
+
+def make_trips(start, days, trips_per_day=24, seed=0):
+    """Creates random trips on consecutive days with durations between 1 and 90 minutes."""
+    rng = np.random.default_rng(seed)
+    day_starts = np.repeat(pd.date_range(start, periods=days, freq='D').to_numpy(), trips_per_day)
+    pickups = day_starts + rng.integers(0, 86_400, len(day_starts)).astype('timedelta64[s]')
+    dropoffs = pickups + rng.integers(60, 5_400, len(day_starts)).astype('timedelta64[s]')
+    return pd.DataFrame({'tpep_pickup_datetime': pickups, 'tpep_dropoff_datetime': dropoffs})
+
+def to_pages(trips, size=500):
+    """Formats trips like the API records, in pages of the given size."""
+    fmt = '%Y-%m-%dT%H:%M:%S.000'
+    rows = [
+        {'tpep_pickup_datetime': p, 'tpep_dropoff_datetime': d}
+        for p, d in zip(trips['tpep_pickup_datetime'].dt.strftime(fmt), trips['tpep_dropoff_datetime'].dt.strftime(fmt))
+    ]
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def calendar_rolling_average(summary, window):
+    """Brute-force calendar window mean used as a reference."""
+    days = summary['tpep_pickup_datetime']
+    hours = summary['daily_trip_time (in hours)']
+    return [round(hours[(days > day - pd.Timedelta(days=window)) & (days <= day)].mean(), 1) for day in days]
+
+# These tests cover the persisted daily summary that is updated incrementally by every ingest.
+class TestDailySummary(unittest.TestCase):
+
+    def setUp(self):
+        trips = make_trips('2023-01-01', days=150)
+        # leave a gap of ten days without any trips
+        self.trips = trips[~trips['tpep_pickup_datetime'].between('2023-03-01', '2023-03-10 23:59:59')]
+        self.empty = read_daily_summary('/nonexistent/daily_summary.parquet')
+
+    def test_summarize_daily_trips(self):
+        df = pd.DataFrame({
+            'tpep_pickup_datetime': pd.to_datetime(['2023-01-01 12:00:00', '2023-01-01 13:00:00', '2023-01-02 12:00:00']),
+            'tpep_dropoff_datetime': pd.to_datetime(['2023-01-01 12:30:00', '2023-01-01 14:00:00', '2023-01-02 12:45:00'])
+        })
+        expected = pd.DataFrame({
+            'tpep_pickup_datetime': pd.to_datetime(['2023-01-01', '2023-01-02']),
+            'trip_seconds': [5400, 2700],
+            'trip_count': [2, 1],
+            'trip_seconds_min': [1800.0, 2700.0],
+            'trip_seconds_max': [3600.0, 2700.0]
+        })
+        partials = summarize_daily_trips(df)
+        pd.testing.assert_frame_equal(partials[expected.columns], expected)
+        self.assertEqual([sketch.sum() for sketch in partials['trip_seconds_sketch']], [2, 1])
+
+    def test_trips_with_a_missing_timestamp_are_not_counted(self):
+        df = pd.DataFrame({
+            'tpep_pickup_datetime': pd.to_datetime(['2023-01-01 12:00:00', None, '2023-01-02 12:00:00', '2023-01-02 13:00:00']),
+            'tpep_dropoff_datetime': pd.to_datetime(['2023-01-01 12:30:00', '2023-01-01 13:00:00', None, '2023-01-02 13:10:00'])
+        })
+        partials = summarize_daily_trips(df)
+        self.assertEqual(partials['tpep_pickup_datetime'].tolist(), [pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-02')])
+        self.assertEqual(partials['trip_seconds'].tolist(), [1800, 600])
+        self.assertEqual(partials['trip_count'].tolist(), [1, 1])
+
+    def test_incremental_updates_match_full_recompute(self):
+        full = update_daily_summary(self.empty, summarize_daily_trips(self.trips))
+
+        incremental = self.empty
+        pickup = self.trips['tpep_pickup_datetime']
+        # ingest in uneven portions, re-fetching some days and going back in time once
+        for start, end in [('2023-01-01', '2023-01-20'), ('2023-02-15', '2023-03-31'), ('2023-01-15', '2023-02-20'),
+                           ('2023-04-01', '2023-04-01'), ('2023-04-01', '2023-05-30')]:
+            portion = self.trips[(pickup >= start) & (pickup < pd.Timestamp(end) + pd.Timedelta(days=1))]
+            incremental = update_daily_summary(incremental, summarize_daily_trips(portion))
+
+        pd.testing.assert_frame_equal(incremental, full)
+        self.assertEqual(len(full), 140)
+        self.assertEqual(full['rolling_average'].tolist(), calendar_rolling_average(full, 45))
+
+    def test_only_the_following_window_is_recomputed(self):
+        pickup = self.trips['tpep_pickup_datetime']
+        summary = update_daily_summary(self.empty, summarize_daily_trips(self.trips))
+        summary.loc[summary['tpep_pickup_datetime'] == '2023-05-01', 'rolling_average'] = -1.0
+
+        new_day = self.trips[pickup.dt.floor('D') == '2023-03-15']
+        updated = update_daily_summary(summary, summarize_daily_trips(new_day))
+        # May 1st is more than 44 days after March 15th, so it keeps the stored value
+        self.assertEqual(updated.loc[updated['tpep_pickup_datetime'] == '2023-05-01', 'rolling_average'].item(), -1.0)
+        pd.testing.assert_frame_equal(updated[updated['tpep_pickup_datetime'] != '2023-05-01'],
+                                      summary[summary['tpep_pickup_datetime'] != '2023-05-01'])
+
+    def test_write_and_read_daily_summary(self):
+        summary = update_daily_summary(self.empty, summarize_daily_trips(self.trips))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'daily_summary.parquet')
+            write_daily_summary(summary, file_path)
+            pd.testing.assert_frame_equal(read_daily_summary(file_path), summary)
+
+
+# These tests compare the batch by batch aggregation with the in-memory one.
+class TestOutOfCoreAggregation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.root = os.path.join(cls.tmp_dir.name, 'taxi_trips')
+        trips = make_trips('2023-01-01', days=90, trips_per_day=50, seed=2).sort_values('tpep_pickup_datetime')
+        write_pages_to_dataset(to_pages(trips), cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_summarize_dataset_matches_in_memory_path(self):
+        in_memory = summarize_daily_trips(read_parquet_file(self.root))
+        for batch_size in (7, 100, 1_000_000):
+            pd.testing.assert_frame_equal(summarize_dataset(self.root, batch_size=batch_size), in_memory)
+
+        empty = read_daily_summary('/nonexistent/daily_summary.parquet')
+        pd.testing.assert_frame_equal(update_daily_summary(empty, summarize_dataset(self.root, batch_size=100)),
+                                      update_daily_summary(empty, in_memory))
+
+    def test_summarize_dataset_date_range(self):
+        start_date, end_date = '2023-02-01T00:00:00.000', '2023-02-28T23:59:59.000'
+        in_memory = summarize_daily_trips(read_parquet_file(self.root, start_date, end_date))
+        pd.testing.assert_frame_equal(summarize_dataset(self.root, start_date, end_date, batch_size=64), in_memory)
+        self.assertEqual(len(in_memory), 28)
+
+    def test_parallel_summary_matches_sequential(self):
+        start_date, end_date = '2023-01-10T12:00:00.000', '2023-03-10T23:59:59.000'
+        sequential = summarize_dataset(self.root, start_date, end_date)
+        parallel = summarize_dataset(self.root, start_date, end_date, workers=2)
+        pd.testing.assert_frame_equal(parallel, sequential)
+
+    def test_summarize_dataset_with_a_missing_dropoff(self):
+        root = os.path.join(self.tmp_dir.name, 'missing_dropoff')
+        pages = to_pages(make_trips('2023-01-01', days=2, trips_per_day=10, seed=3))
+        pages[0][4]['tpep_dropoff_datetime'] = None
+        write_pages_to_dataset(pages, root)
+        partials = summarize_dataset(root)
+        self.assertEqual(partials['trip_count'].tolist(), [9, 10])
+        pd.testing.assert_frame_equal(partials, summarize_daily_trips(read_parquet_file(root)))
+
+    def test_summarize_dataset_without_trips(self):
+        partials = summarize_dataset(self.root, '2024-01-01T00:00:00.000', '2024-01-31T23:59:59.000')
+        self.assertTrue(partials.empty)
+        self.assertEqual(list(partials.columns), ['tpep_pickup_datetime', 'trip_seconds', 'trip_count', 'trip_seconds_min', 'trip_seconds_max', 'trip_seconds_sketch'])
+
+class TestTripLengthStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.trips = make_trips('2023-01-01', days=60, trips_per_day=200, seed=5)
+        self.seconds = (self.trips['tpep_dropoff_datetime'] - self.trips['tpep_pickup_datetime']).dt.total_seconds()
+
+    def test_statistics_of_a_range(self):
+        statistics = trip_length_statistics(summarize_daily_trips(self.trips), '2023-01-10T00:00:00.000', '2023-02-09T23:59:59.000')
+        in_range = self.trips['tpep_pickup_datetime'].between('2023-01-10', '2023-02-09 23:59:59')
+        minutes = self.seconds[in_range] / 60
+        self.assertEqual(statistics['trip_count'], in_range.sum())
+        # the mean over all trips is exact, the quantiles are within the 1% accuracy of the sketch
+        self.assertAlmostEqual(statistics['mean_minutes'], minutes.mean())
+        self.assertAlmostEqual(statistics['median_minutes'], minutes.median(), delta=minutes.median() * 0.011)
+        self.assertAlmostEqual(statistics['p95_minutes'], minutes.quantile(0.95), delta=minutes.quantile(0.95) * 0.011)
+        self.assertEqual(statistics['min_minutes'], minutes.min())
+        self.assertEqual(statistics['max_minutes'], minutes.max())
+
+    def test_partials_merge_across_chunks(self):
+        chunks = [self.trips.iloc[i:i + 777] for i in range(0, len(self.trips), 777)]
+        merged = merge_daily_partials([summarize_daily_trips(chunk) for chunk in chunks[::-1]])
+        pd.testing.assert_frame_equal(merged, summarize_daily_trips(self.trips))
+
+    def test_summary_keeps_the_sketches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'daily_summary.parquet')
+            empty = read_daily_summary(file_path)
+            write_daily_summary(update_daily_summary(empty, summarize_daily_trips(self.trips)), file_path)
+            summary = read_daily_summary(file_path)
+        self.assertEqual(trip_length_statistics(summary), trip_length_statistics(summarize_daily_trips(self.trips)))
+
+    def test_summary_written_before_the_sketches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'daily_summary.parquet')
+            summary = update_daily_summary(read_daily_summary(file_path), summarize_daily_trips(self.trips))
+            summary[['tpep_pickup_datetime', 'trip_seconds', 'trip_count', 'daily_trip_time (in hours)', 'rolling_average']].to_parquet(file_path)
+            statistics = trip_length_statistics(read_daily_summary(file_path))
+        self.assertAlmostEqual(statistics['mean_minutes'], self.seconds.mean() / 60)
+        self.assertTrue(np.isnan(statistics['median_minutes']))
+        self.assertTrue(np.isnan(statistics['max_minutes']))
+
+
+class TestRollingStatistics(unittest.TestCase):
+
+    def setUp(self):
+        trips = make_trips('2023-01-01', days=120, seed=3)
+        # leave gaps of a few days without any trips
+        trips = trips[~trips['tpep_pickup_datetime'].between('2023-02-03', '2023-02-06 23:59:59')]
+        trips = trips[~trips['tpep_pickup_datetime'].between('2023-03-20', '2023-03-20 23:59:59')]
+        self.trips = trips
+        empty = read_daily_summary('/nonexistent/daily_summary.parquet')
+        self.summary = update_daily_summary(empty, summarize_daily_trips(trips))
+
+    def test_windows_match_brute_force_calendar_windows(self):
+        statistics = rolling_statistics(self.summary, ['7D', '45D'])
+        days = self.summary['tpep_pickup_datetime']
+        tenths = np.rint(self.summary['daily_trip_time (in hours)'] * 10)
+        for window, length in (('7D', 7), ('45D', 45)):
+            expected = {'mean': [], 'median_trip_minutes': [], 'p95_trip_minutes': [], 'trip_count': []}
+            for day in days:
+                in_window = (days > day - pd.Timedelta(days=length)) & (days <= day)
+                expected['mean'].append(np.round(tenths[in_window].mean()) / 10)
+                # the quantiles of the trips in the window, from the merged sketches of its days
+                merged = trip_length_statistics(self.summary, day - pd.Timedelta(days=length - 1), day)
+                expected['median_trip_minutes'].append(np.round(merged['median_minutes'] * 10) / 10)
+                expected['p95_trip_minutes'].append(np.round(merged['p95_minutes'] * 10) / 10)
+                expected['trip_count'].append(self.summary['trip_count'][in_window].sum())
+            for stat, values in expected.items():
+                np.testing.assert_allclose(statistics[f"rolling_{stat}_{window}"], values, err_msg=f"{stat} {window}")
+        # the 45 day mean is the rolling average kept in the daily summary
+        np.testing.assert_allclose(statistics['rolling_mean_45D'], self.summary['rolling_average'])
+
+    def test_quantiles_are_the_ones_of_the_trip_durations(self):
+        statistics = rolling_statistics(self.summary, ['30D']).set_index('tpep_pickup_datetime')
+        pickup = self.trips['tpep_pickup_datetime']
+        minutes = (self.trips['tpep_dropoff_datetime'] - pickup).dt.total_seconds() / 60
+        for day in pd.to_datetime(['2023-01-31', '2023-03-01', '2023-04-30']):
+            in_window = (pickup >= day - pd.Timedelta(days=29)) & (pickup < day + pd.Timedelta(days=1))
+            for name, q in (('median', 0.5), ('p95', 0.95)):
+                self.assertAlmostEqual(statistics.loc[day, f"rolling_{name}_trip_minutes_30D"],
+                                       minutes[in_window].quantile(q), delta=minutes[in_window].quantile(q) * 0.03)
+
+    def test_days_only_summed_by_the_api_have_unknown_quantiles(self):
+        summary = self.summary.copy()
+        summary.loc[10, 'trip_seconds_sketch'] = None
+        statistics = rolling_statistics(summary, ['7D'])
+        unknown = statistics['rolling_median_trip_minutes_7D'].isna()
+        self.assertEqual(unknown[unknown].index.tolist(), list(range(10, 17)))
+        self.assertEqual(statistics['rolling_trip_count_7D'].tolist(), rolling_statistics(self.summary, ['7D'])['rolling_trip_count_7D'].tolist())
+
+    def test_closed_both_includes_the_first_day(self):
+        statistics = rolling_statistics(self.summary, ['2D'], closed='both')
+        self.assertEqual(statistics['rolling_trip_count_2D'].tolist()[:3], [24, 48, 72])
+
+    def test_columns(self):
+        statistics = rolling_statistics(self.summary[['tpep_pickup_datetime', 'daily_trip_time (in hours)']], ['30D'])
+        self.assertEqual(list(statistics.columns), ['tpep_pickup_datetime', 'rolling_mean_30D'])
+        self.assertEqual(list(rolling_statistics(self.summary, ['30D']).columns),
+                         ['tpep_pickup_datetime', 'rolling_mean_30D', 'rolling_median_trip_minutes_30D',
+                          'rolling_p95_trip_minutes_30D', 'rolling_trip_count_30D'])
+        self.assertEqual(len(statistics), len(self.summary))
+
+if __name__ == '__main__':
+    unittest.main()
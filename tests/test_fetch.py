@@ -0,0 +1,367 @@
+import os
+import tempfile
+import time
+import unittest
+import pandas as pd
+import pyarrow as pa
+import numpy as np
+from unittest.mock import patch
+from utils import count_records, fetch_all_data, iter_pages, iter_pages_by_key, page_to_record_batch, TRIP_SCHEMA
+from utils import fetch_daily_aggregates, aggregates_to_daily_trips, summarize_daily_trips, update_daily_summary, read_daily_summary
+from utils import ApiClient, ResponseCache, make_api_request, decode_csv_page, ingest_range, read_parquet_file
+from benchmarks.soda_stub import SodaStub, make_rows
+
+# These tests run the fetching code against a local stub of the SODA endpoint.
+class TestConcurrentFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = make_rows('2023-01-01', periods=2000)
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-31T23:59:59.000'
+
+    def test_count_records(self):
+        with SodaStub(self.rows) as stub:
+            self.assertEqual(count_records(self.start_date, self.end_date, stub.url), 2000)
+            self.assertEqual(count_records(self.start_date, '2023-01-01T00:09:00.000', stub.url), 10)
+
+    def test_concurrent_fetch_matches_sequential_and_is_faster(self):
+        # 20 pages with 50 ms of server latency each
+        with SodaStub(self.rows, latency=0.05) as stub:
+            started = time.perf_counter()
+            sequential = fetch_all_data(self.start_date, self.end_date, 100, stub.url)
+            sequential_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            concurrent = fetch_all_data(self.start_date, self.end_date, 100, stub.url, workers=8)
+            concurrent_time = time.perf_counter() - started
+
+        self.assertEqual(concurrent, sequential)
+        self.assertEqual(concurrent, self.rows)
+        # the sequential loop waits for 21 round trips, the pool for about 4
+        self.assertLess(concurrent_time, sequential_time / 2)
+
+    def test_concurrent_fetch_with_partial_last_page(self):
+        with SodaStub(self.rows[:250]) as stub:
+            result = fetch_all_data(self.start_date, self.end_date, 100, stub.url, workers=4)
+        self.assertEqual(result, self.rows[:250])
+
+
+class TestApiClient(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = make_rows('2023-01-01', periods=1000)
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-31T23:59:59.000'
+
+    def test_session_reuses_one_connection(self):
+        with SodaStub(self.rows) as stub:
+            client = ApiClient()
+            pages = list(iter_pages(self.start_date, self.end_date, 100, stub.url, client=client))
+            client.close()
+            self.assertEqual(stub.requests, 11)
+            self.assertEqual(stub.connections, 1)
+
+    def test_clients_created_for_a_call_are_closed(self):
+        with SodaStub(self.rows) as stub, patch('utils.ApiClient.close', autospec=True) as close:
+            count_records(self.start_date, self.end_date, stub.url)
+            fetch_all_data(self.start_date, self.end_date, 100, stub.url)
+            fetch_all_data(self.start_date, self.end_date, 100, stub.url, workers=4)
+            list(iter_pages_by_key(self.start_date, self.end_date, 100, stub.url))
+            self.assertEqual(close.call_count, 4)
+            # also when the pages aren't consumed to the end
+            pages = iter_pages(self.start_date, self.end_date, 100, stub.url, workers=4)
+            next(pages)
+            pages.close()
+            self.assertEqual(close.call_count, 5)
+            # the client of the caller stays open
+            client = ApiClient()
+            count_records(self.start_date, self.end_date, stub.url, client)
+            list(iter_pages(self.start_date, self.end_date, 100, stub.url, client=client))
+            self.assertEqual(close.call_count, 5)
+
+    def test_without_session_every_request_connects(self):
+        with SodaStub(self.rows) as stub:
+            for offset in range(0, 300, 100):
+                make_api_request(f"{stub.url}?$limit=100&$offset={offset}")
+            self.assertEqual(stub.connections, 3)
+
+    def test_stats_count_compressed_bytes_and_latency(self):
+        with SodaStub(self.rows, latency=0.01) as stub:
+            client = ApiClient(pool_size=4, timeout=(1, 5))
+            result = fetch_all_data(self.start_date, self.end_date, 100, stub.url, workers=4, client=client)
+            client.close()
+            self.assertLessEqual(stub.connections, 4)
+
+        self.assertEqual(result, self.rows)
+        summary = client.stats.summary()
+        # 10 pages and the count query
+        self.assertEqual(summary['requests'], 11)
+        self.assertLess(summary['bytes_received'] * 5, summary['bytes_decoded'])
+        self.assertGreaterEqual(summary['latency_ms_p50'], 10)
+        self.assertLessEqual(summary['latency_ms_p50'], summary['latency_ms_p95'])
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = make_rows('2023-01-01', periods=1000)
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-31T23:59:59.000'
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def fetch(self, stub, cache, end_date=None, workers=2):
+        client = ApiClient(cache=cache)
+        result = fetch_all_data(self.start_date, end_date or self.end_date, 100, stub.url, workers, client=client)
+        client.close()
+        return result
+
+    def test_second_run_is_served_from_cache(self):
+        cache = ResponseCache(self.cache_dir)
+        with SodaStub(self.rows) as stub:
+            first = self.fetch(stub, cache)
+            requests = stub.requests
+            second = self.fetch(stub, cache)
+            self.assertEqual(stub.requests, requests)
+        self.assertEqual(first, self.rows)
+        self.assertEqual(second, self.rows)
+        # 10 pages and the count query, each missed once and hit once
+        self.assertEqual(cache.summary(), {'hits': 11, 'misses': 11, 'evictions': 0})
+
+    def test_open_range_is_not_cached(self):
+        cache = ResponseCache(self.cache_dir, closed_after_days=7)
+        end_date = (pd.Timestamp.now() - pd.Timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S.000')
+        with SodaStub(self.rows) as stub:
+            self.fetch(stub, cache, end_date)
+            requests = stub.requests
+            self.assertEqual(self.fetch(stub, cache, end_date), self.rows)
+            self.assertEqual(stub.requests, requests * 2)
+        self.assertEqual(cache.summary()['misses'], 0)
+
+    def test_expired_entries_are_fetched_again(self):
+        cache = ResponseCache(self.cache_dir, ttl_seconds=60)
+        key = cache.key('http://example', {'$limit': 1})
+        cache.put(key, self.rows[:2])
+        self.assertEqual(cache.get(key), self.rows[:2])
+        old = time.time() - 120
+        os.utime(cache.path(key), (old, old))
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(os.path.exists(cache.path(key)))
+
+    def test_cache_keeps_missing_fields_missing(self):
+        cache = ResponseCache(self.cache_dir)
+        data = [{'tpep_pickup_datetime': '2023-01-01T00:00:00.000'}, self.rows[1]]
+        cache.put('00', data)
+        self.assertEqual(cache.get('00'), data)
+        cache.put('01', [])
+        self.assertEqual(cache.get('01'), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResponseCache(self.cache_dir)
+        for i in range(3):
+            cache.put(f"{i:02d}", self.rows)
+            os.utime(cache.path(f"{i:02d}"), (1000 + i, 1000 + i))
+        cache.get('00')  # the oldest entry becomes the most recently used
+        cache.max_bytes = os.path.getsize(cache.path('00')) * 2
+        cache.evict()
+        self.assertTrue(os.path.exists(cache.path('00')))
+        self.assertFalse(os.path.exists(cache.path('01')))
+        self.assertTrue(os.path.exists(cache.path('02')))
+        self.assertEqual(cache.summary()['evictions'], 1)
+
+    def test_the_cache_directory_is_only_listed_to_evict(self):
+        cache = ResponseCache(self.cache_dir, max_bytes=10**9)
+        with patch('utils.os.scandir', wraps=os.scandir) as scandir:
+            for i in range(20):
+                cache.put(f"00{i:02d}", self.rows)
+                os.utime(cache.path(f"00{i:02d}"), (1000 + i, 1000 + i))
+        # the size of the entries is scanned once, the cache directory and the subdirectory '00'
+        self.assertEqual(scandir.call_count, 2)
+
+        cache.max_bytes = os.path.getsize(cache.path('0000')) * 30
+        with patch('utils.os.scandir', wraps=os.scandir) as scandir:
+            for i in range(20, 60):
+                cache.put(f"00{i:02d}", self.rows)
+                os.utime(cache.path(f"00{i:02d}"), (1000 + i, 1000 + i))
+        # the 31st entry exceeds the limit, an eviction keeps 27 of them, so every 4th entry evicts again
+        self.assertEqual(scandir.call_count, 2 * 8)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache_dir, '00'))), [f"00{i:02d}.parquet" for i in range(32, 60)])
+        self.assertEqual(cache.summary()['evictions'], 32)
+
+
+class TestKeysetPagination(unittest.TestCase):
+
+    def setUp(self):
+        # 7 trips per pickup time, so that most page boundaries split a group of equal timestamps
+        self.rows = [row for row in make_rows('2023-01-01', periods=150) for _ in range(7)]
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-31T23:59:59.000'
+
+    def test_no_rows_lost_or_duplicated_at_page_boundaries(self):
+        with SodaStub(self.rows) as stub:
+            for limit in (5, 7, 100, 2000):
+                requests = stub.requests
+                pages = list(iter_pages_by_key(self.start_date, self.end_date, limit, stub.url))
+                ids = [row[':id'] for page in pages for row in page]
+                self.assertEqual(len(ids), len(set(ids)))
+                rows = [{k: v for k, v in row.items() if k != ':id'} for page in pages for row in page]
+                self.assertEqual(rows, self.rows)
+                # one request per page and the empty page after the last one
+                self.assertEqual(stub.requests - requests, -(-len(self.rows) // limit) + 1)
+
+    def test_keyset_pages_start_after_a_key(self):
+        with SodaStub(self.rows) as stub:
+            first = next(iter_pages_by_key(self.start_date, self.end_date, 10, stub.url))
+            after = (first[-1]['tpep_pickup_datetime'], first[-1][':id'])
+            rest = [row for page in iter_pages_by_key(self.start_date, self.end_date, 10, stub.url, after=after) for row in page]
+            self.assertEqual(len(first) + len(rest), len(self.rows))
+            self.assertEqual(first[-1]['tpep_pickup_datetime'], rest[0]['tpep_pickup_datetime'])
+            self.assertLess(first[-1][':id'], rest[0][':id'])
+
+    def test_keyset_pages_match_offset_pages(self):
+        with SodaStub(self.rows) as stub:
+            by_offset = [page_to_record_batch(page) for page in iter_pages(self.start_date, '2023-01-01T01:00:00.000', 50, stub.url)]
+            by_key = [page_to_record_batch(page) for page in iter_pages_by_key(self.start_date, '2023-01-01T01:00:00.000', 50, stub.url)]
+        self.assertEqual(by_key, by_offset)
+        self.assertEqual(sum(batch.num_rows for batch in by_key), 61 * 7)
+
+
+class TestCsvPages(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [row for row in make_rows('2023-01-01', periods=300) for _ in range(3)]
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-31T23:59:59.000'
+
+    def test_decode_csv_page(self):
+        body = (b'"tpep_pickup_datetime","tpep_dropoff_datetime"\n'
+                b'"2023-01-01T00:00:00.000","2023-01-01T00:10:00.500"\n'
+                b'"2023-01-01T00:01:00.000",\n')
+        batch = decode_csv_page(body)
+        self.assertEqual(batch.schema, TRIP_SCHEMA)
+        self.assertEqual(batch.to_pylist(), [
+            {'tpep_pickup_datetime': pd.Timestamp('2023-01-01 00:00:00'), 'tpep_dropoff_datetime': pd.Timestamp('2023-01-01 00:10:00.500')},
+            {'tpep_pickup_datetime': pd.Timestamp('2023-01-01 00:01:00'), 'tpep_dropoff_datetime': None},
+        ])
+        self.assertEqual(decode_csv_page(b'"tpep_pickup_datetime","tpep_dropoff_datetime"\n').num_rows, 0)
+        self.assertEqual(decode_csv_page(b'').num_rows, 0)
+
+    def test_csv_pages_match_json_pages(self):
+        with SodaStub(self.rows) as stub:
+            for workers in (1, 3):
+                by_json = [page_to_record_batch(page) for page in iter_pages(self.start_date, self.end_date, 100, stub.url, workers)]
+                by_csv = [page_to_record_batch(page) for page in iter_pages(self.start_date, self.end_date, 100, stub.url, workers,
+                                                                             client=ApiClient(page_format='csv'))]
+                self.assertEqual(by_csv, by_json)
+                self.assertEqual(sum(batch.num_rows for batch in by_csv), len(self.rows))
+
+    def test_csv_keyset_pages_are_cached(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache = ResponseCache(tmp_dir.name)
+        with SodaStub(self.rows) as stub:
+            fetched = [list(iter_pages_by_key(self.start_date, self.end_date, 70, stub.url, ApiClient(cache=cache, page_format='csv')))
+                       for _ in range(2)]
+        # every page and the empty one after the last page
+        self.assertEqual(cache.summary()['hits'], len(fetched[0]) + 1)
+        self.assertEqual(fetched[1], fetched[0])
+        ids = [row_id for page in fetched[0] for row_id in page.column(':id').to_pylist()]
+        self.assertEqual(len(ids), len(set(ids)))
+        stored = pa.Table.from_batches([page_to_record_batch(page) for page in fetched[0]])
+        self.assertTrue(stored.equals(pa.Table.from_batches([page_to_record_batch(self.rows)])))
+
+    def test_ingest_csv_pages(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        root = os.path.join(tmp_dir.name, 'taxi_trips')
+        with SodaStub(self.rows) as stub:
+            written = ingest_range(self.start_date, self.end_date, 100, stub.url, root, client=ApiClient(page_format='csv'), pagination='keyset')
+        self.assertEqual(written, len(self.rows))
+        pd.testing.assert_frame_equal(read_parquet_file(root), page_to_record_batch(self.rows).to_pandas())
+
+
+class TestStreamingIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = make_rows('2023-01-01', periods=1050)
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-31T23:59:59.000'
+
+    def test_iter_pages_yields_pages_in_order(self):
+        with SodaStub(self.rows) as stub:
+            for workers in (1, 3):
+                pages = list(iter_pages(self.start_date, self.end_date, 100, stub.url, workers))
+                self.assertEqual([len(page) for page in pages], [100] * 10 + [50])
+                self.assertEqual([row for page in pages for row in page], self.rows)
+
+    def test_page_to_record_batch(self):
+        batch = page_to_record_batch(self.rows[:3])
+        self.assertEqual(batch.schema, TRIP_SCHEMA)
+        self.assertEqual(batch.column(0).to_pylist()[2], pd.Timestamp('2023-01-01 00:02:00'))
+        self.assertEqual(batch.column(1).to_pylist()[2], pd.Timestamp('2023-01-01 00:12:00'))
+
+
+class TestServerSideAggregation(unittest.TestCase):
+
+    def setUp(self):
+        # random trips of up to three hours, many of them crossing midnight
+        rng = np.random.default_rng(1)
+        pickups = np.sort(pd.Timestamp('2023-01-01').to_datetime64() + rng.integers(0, 40 * 86_400, 5000).astype('timedelta64[s]'))
+        dropoffs = pickups + rng.integers(0, 3 * 3_600, len(pickups)).astype('timedelta64[s]')
+        fmt = '%Y-%m-%dT%H:%M:%S.000'
+        self.rows = [
+            {'tpep_pickup_datetime': p, 'tpep_dropoff_datetime': d}
+            for p, d in zip(pd.DatetimeIndex(pickups).strftime(fmt), pd.DatetimeIndex(dropoffs).strftime(fmt))
+        ]
+        self.start_date = '2023-01-05T00:00:00.000'
+        self.end_date = '2023-02-05T23:59:59.000'
+
+    def test_aggregate_mode_matches_raw_rows(self):
+        with SodaStub(self.rows) as stub:
+            pages = iter_pages(self.start_date, self.end_date, 1000, stub.url)
+            raw = summarize_daily_trips(page_to_record_batch([row for page in pages for row in page]).to_pandas())
+            raw_requests = stub.requests
+            aggregated = fetch_daily_aggregates(self.start_date, self.end_date, 10, stub.url)
+            requests = stub.requests - raw_requests
+
+        # the API only sums the trip durations, their minimum, maximum and quantiles stay unknown
+        summed = ['tpep_pickup_datetime', 'trip_seconds', 'trip_count']
+        pd.testing.assert_frame_equal(aggregated[summed], raw[summed])
+        self.assertTrue(aggregated['trip_seconds_sketch'].isna().all())
+        self.assertTrue(aggregated['trip_seconds_min'].isna().all())
+        self.assertEqual(len(aggregated), 32)
+        # 32 days with one or two dropoff days each, fetched in pages of 10 groups
+        self.assertLessEqual(requests, 8)
+
+        empty = read_daily_summary('/nonexistent/daily_summary.parquet')
+        columns = ['tpep_pickup_datetime', 'trip_seconds', 'trip_count', 'daily_trip_time (in hours)', 'rolling_average']
+        pd.testing.assert_frame_equal(update_daily_summary(empty, aggregated)[columns], update_daily_summary(empty, raw)[columns])
+
+    def test_aggregate_mode_leaves_out_trips_without_a_dropoff(self):
+        # SODA leaves the null fields out of a record
+        for i in range(0, len(self.rows), 7):
+            del self.rows[i]['tpep_dropoff_datetime']
+        with SodaStub(self.rows) as stub:
+            pages = iter_pages(self.start_date, self.end_date, 1000, stub.url)
+            raw = summarize_daily_trips(page_to_record_batch([row for page in pages for row in page]).to_pandas())
+            aggregated = fetch_daily_aggregates(self.start_date, self.end_date, 10, stub.url)
+            # a group of the trips without a dropoff arrives without the dropoff fields
+            groups = stub.group(self.rows)
+        summed = ['tpep_pickup_datetime', 'trip_seconds', 'trip_count']
+        pd.testing.assert_frame_equal(aggregated[summed], raw[summed])
+        self.assertTrue(any('dropoff_day' not in group for group in groups))
+        with self.assertLogs('utils', 'WARNING'):
+            daily = aggregates_to_daily_trips(groups)
+        self.assertEqual(daily['trip_count'].sum(), sum('tpep_dropoff_datetime' in row for row in self.rows))
+
+    def test_aggregate_mode_without_trips(self):
+        with SodaStub([]) as stub:
+            aggregated = fetch_daily_aggregates(self.start_date, self.end_date, 10, stub.url)
+        self.assertTrue(aggregated.empty)
+        self.assertEqual(list(aggregated.columns), ['tpep_pickup_datetime', 'trip_seconds', 'trip_count', 'trip_seconds_min', 'trip_seconds_max', 'trip_seconds_sketch'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from utils import ApiClient, StageMetrics, measure, write_pages_to_dataset
+from benchmarks.soda_stub import SodaStub, make_rows
+
+# These tests cover the per-stage instrumentation of the pipeline.
+class TestStageMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_runs_of_a_stage_are_added_up(self):
+        metrics = StageMetrics()
+        for rows in (10, 20, 30):
+            with measure(metrics, 'convert') as stage:
+                stage.rows, stage.bytes_written = rows, 2 * rows
+        with self.assertRaises(ValueError):
+            with measure(metrics, 'write_parquet'):
+                raise ValueError
+
+        summary = metrics.summary()
+        self.assertEqual(list(summary), ['convert', 'write_parquet'])
+        self.assertEqual(summary['convert']['calls'], 3)
+        self.assertEqual(summary['convert']['rows'], 60)
+        self.assertEqual(summary['convert']['bytes_written'], 120)
+        self.assertGreaterEqual(summary['convert']['wall_seconds'], 0)
+        self.assertEqual(summary['write_parquet']['calls'], 1)
+        self.assertEqual(metrics._running, 0)
+
+    def test_without_metrics_nothing_is_measured(self):
+        with measure(None, 'convert') as stage:
+            stage.rows = 10
+        self.assertEqual(stage.rows, 10)
+
+    def test_stages_of_fetch_threads(self):
+        metrics = StageMetrics()
+
+        def work():
+            for _ in range(100):
+                with measure(metrics, 'http') as stage:
+                    stage.bytes_read = 1
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.summary()['http']['calls'], 400)
+        self.assertEqual(metrics.summary()['http']['bytes_read'], 400)
+
+    def test_ingest_stages_are_logged_and_exported(self):
+        metrics = StageMetrics({'task': 'task1'})
+        rows = make_rows('2023-01-01', periods=500, freq='5min')
+        client = ApiClient(metrics=metrics)
+        with SodaStub(rows) as stub:
+            pages = (client.get(f"{stub.url}?$limit=100&$offset={offset}") for offset in range(0, 500, 100))
+            write_pages_to_dataset(pages, os.path.join(self.tmp_dir.name, 'taxi_trips'), metrics=metrics)
+        client.close()
+
+        summary = metrics.summary()
+        self.assertEqual(list(summary), ['http', 'decode_json', 'convert', 'write_parquet'])
+        self.assertEqual(summary['http']['calls'], 5)
+        self.assertGreater(summary['http']['bytes_read'], 0)
+        self.assertEqual(summary['decode_json']['rows'], 500)
+        self.assertEqual(summary['write_parquet']['rows'], 500)
+        self.assertGreater(summary['write_parquet']['bytes_written'], 0)
+
+        with self.assertLogs('utils', 'INFO') as logs:
+            metrics.log()
+        logged = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertEqual([entry['stage'] for entry in logged], list(summary))
+        self.assertEqual(logged[2], {'event': 'stage_metrics', 'task': 'task1', 'stage': 'convert', **summary['convert']})
+
+        path = os.path.join(self.tmp_dir.name, 'metrics', 'task1.prom')
+        metrics.write_textfile(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE taxi_rides_stage_rows_total counter', lines)
+        self.assertIn('taxi_rides_stage_rows_total{task="task1",stage="convert"} 500', lines)
+        self.assertIn('# TYPE taxi_rides_stage_peak_rss_bytes gauge', lines)
+        self.assertFalse(os.path.exists(f"{path}.tmp"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+import yaml
+from unittest.mock import patch
+from pipeline import split_range, whole_days, tail_range, load_settings, run_once, main
+from utils import ApiClient, read_checkpoint, read_daily_summary, read_parquet_file, summarize_daily_trips, page_to_record_batch, DAILY_SUMMARY_COLUMNS
+from utils import trip_store_files
+from benchmarks.soda_stub import SodaStub, make_rows
+
+class FailingClient(ApiClient):
+    """
+    Client losing the connection for good after a number of requests.
+    """
+
+    def __init__(self, requests):
+        super().__init__()
+        self.remaining = requests
+
+    def fetch(self, base_url, params, end_date=None, decoder=None):
+        self.remaining -= 1
+        if self.remaining < 0:
+            raise ConnectionError('lost connection')
+        return super().fetch(base_url, params, end_date, decoder)
+
+# These tests cover the pipeline entry point against the local SODA stub in a temporary directory.
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        # one trip every 20 minutes from Jan 1st to Jan 20th
+        self.rows = make_rows('2023-01-01', periods=20 * 72, freq='20min', trip_minutes=15)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.tmp_dir.name, 'config.yaml')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_config(self, base_url, **api):
+        data = os.path.join(self.tmp_dir.name, 'data')
+        config = {
+            'api': {'base_url': base_url, 'limit': 100, 'workers': 2, **api},
+            'cache': {'enabled': False},
+            'validation': {'enabled': True, 'quarantine': False},
+            'metrics': {'enabled': False},
+            'pipeline': {
+                'chunk_days': 7,
+                'trips_path': os.path.join(data, 'taxi_trips'),
+                'store_path': os.path.join(data, 'taxi_trips.arrow'),
+                'summary_path': os.path.join(data, 'daily_summary.parquet'),
+                'rejects_directory': os.path.join(data, 'rejects'),
+            },
+            'date_ranges': {
+                'start_date_1': '2023-01-01T00:00:00.000', 'end_date_1': '2023-01-10T23:59:59.000',
+                'start_date_2': '2023-01-11T00:00:00.000', 'end_date_2': '2023-01-20T23:59:59.000',
+            },
+        }
+        with open(self.config_path, 'w') as f:
+            yaml.safe_dump(config, f)
+        return load_settings(self.config_path)
+
+    def expected_summary(self, rows):
+        return summarize_daily_trips(page_to_record_batch(rows).to_pandas())
+
+    def test_split_range(self):
+        self.assertEqual(split_range('2023-01-03T12:00:00.000', '2023-01-20T23:59:59.000', 7), [
+            ('2023-01-03T12:00:00.000', '2023-01-09T23:59:59.000'),
+            ('2023-01-10T00:00:00.000', '2023-01-16T23:59:59.000'),
+            ('2023-01-17T00:00:00.000', '2023-01-20T23:59:59.000'),
+        ])
+        self.assertEqual(split_range('2023-01-05T00:00:00.000', '2023-01-04T23:59:59.000', 7), [])
+
+    def test_ranges_within_a_day_keep_its_other_trips(self):
+        self.assertEqual(whole_days('2023-01-01T12:00:00.000', '2023-01-03T08:00:00.000'),
+                         ('2023-01-01T00:00:00.000', '2023-01-03T23:59:59.000'))
+        with SodaStub(self.rows) as stub:
+            settings = self.write_config(stub.url)
+            run_once(settings, [('2023-01-01T00:00:00.000', '2023-01-01T23:59:59.000')])
+            run_once(settings, [('2023-01-01T12:00:00.000', '2023-01-01T23:59:59.000')])
+        self.assertEqual(len(read_parquet_file(settings['trips_path'])), 72)
+        self.assertEqual(read_daily_summary(settings['summary_path'])['trip_count'].tolist(), [72])
+
+    def test_tail_range_starts_at_the_last_summarized_day(self):
+        summary = self.expected_summary(self.rows[:3 * 72 + 5])
+        self.assertEqual(tail_range(summary, '2023-01-01T00:00:00.000', '2023-01-10T00:00:00.000'),
+                         ('2023-01-04T00:00:00.000', '2023-01-10T00:00:00.000'))
+        self.assertEqual(tail_range(read_daily_summary('missing.parquet'), '2023-01-01T00:00:00.000')[0], '2023-01-01T00:00:00.000')
+
+    def test_configured_ranges_are_ingested_in_chunks(self):
+        with SodaStub(self.rows) as stub:
+            settings = self.write_config(stub.url, page_format='csv')
+            self.assertEqual(len(settings['date_ranges']), 2)
+            summary = run_once(settings, settings['date_ranges'])
+
+        expected = self.expected_summary(self.rows)
+        pd.testing.assert_frame_equal(summary[expected.columns.drop('trip_seconds_sketch')],
+                                      expected.drop(columns='trip_seconds_sketch'))
+        self.assertEqual(list(summary.columns), DAILY_SUMMARY_COLUMNS)
+        pd.testing.assert_frame_equal(read_daily_summary(settings['summary_path']), summary)
+        self.assertEqual(len(read_parquet_file(settings['trips_path'])), len(self.rows))
+        pd.testing.assert_frame_equal(read_parquet_file(settings['store_path']), read_parquet_file(settings['trips_path']))
+
+    def test_interrupted_runs_resume_in_the_interrupted_chunk(self):
+        with SodaStub(self.rows) as stub:
+            settings = self.write_config(stub.url, workers=1)
+            ranges = [('2023-01-01T00:00:00.000', '2023-01-20T23:59:59.000')]
+            # the first chunk takes a count and 6 pages, the second one fails on its 4th page
+            with patch('pipeline.create_client', return_value=FailingClient(10)):
+                with self.assertRaises(ConnectionError):
+                    run_once(settings, ranges)
+            checkpoint = read_checkpoint(settings['trips_path'])
+            self.assertEqual((checkpoint['query']['start_date'], checkpoint['pages'], checkpoint['offset']),
+                             ('2023-01-08T00:00:00.000', 3, 300))
+            self.assertEqual(read_daily_summary(settings['summary_path'])['trip_count'].tolist(), [72] * 7)
+
+            requests = stub.requests
+            with self.assertLogs('utils', 'INFO') as logs:
+                run_once(settings, ranges)
+            self.assertFalse(any('Discarding' in line for line in logs.output))
+            # the rest of the second chunk, a count and 3 pages, and the third chunk, a count and 5 pages
+            self.assertEqual(stub.requests - requests, 10)
+
+        self.assertIsNone(read_checkpoint(settings['trips_path']))
+        self.assertFalse(os.path.exists(os.path.join(settings['trips_path'], '_pipeline_run.json')))
+        expected = self.expected_summary(self.rows)
+        summary = read_daily_summary(settings['summary_path'])
+        pd.testing.assert_frame_equal(summary[['tpep_pickup_datetime', 'trip_seconds', 'trip_count']],
+                                      expected[['tpep_pickup_datetime', 'trip_seconds', 'trip_count']])
+        self.assertEqual(len(read_parquet_file(settings['trips_path'])), len(self.rows))
+
+    def test_tail_runs_finish_the_interrupted_run_first(self):
+        with SodaStub(self.rows) as stub:
+            settings = self.write_config(stub.url, workers=1)
+            with patch('pipeline.create_client', return_value=FailingClient(10)):
+                with self.assertRaises(ConnectionError):
+                    run_once(settings, [('2023-01-01T00:00:00.000', '2023-01-20T23:59:59.000')])
+            requests = stub.requests
+            main(['--config', self.config_path, '--tail', '--until', '2023-01-20T23:59:59.000'])
+            self.assertEqual(stub.requests - requests, 10)
+
+        summary = read_daily_summary(settings['summary_path'])
+        self.assertEqual(summary['trip_count'].tolist(), [72] * 20)
+        self.assertEqual(len(read_parquet_file(settings['trips_path'])), len(self.rows))
+
+    def test_aggregate_mode(self):
+        with SodaStub(self.rows) as stub:
+            settings = self.write_config(stub.url, mode='aggregate')
+            with self.assertLogs('pipeline', 'WARNING') as logs:
+                summary = run_once(settings, [('2023-01-01T00:00:00.000', '2023-01-20T23:59:59.000')])
+        self.assertTrue(any("doesn't validate" in line for line in logs.output))
+        expected = self.expected_summary(self.rows)
+        pd.testing.assert_frame_equal(summary[['tpep_pickup_datetime', 'trip_seconds', 'trip_count']],
+                                      expected[['tpep_pickup_datetime', 'trip_seconds', 'trip_count']])
+        self.assertFalse(os.path.exists(settings['trips_path']))
+        self.assertFalse(os.path.exists(settings['store_path']))
+
+    def test_tail_runs_only_fetch_the_new_data(self):
+        first = self.rows[:5 * 72 + 30]
+        with SodaStub(list(first)) as stub:
+            self.write_config(stub.url)
+            tail = ['--config', self.config_path, '--tail', '--until', '2023-01-20T23:59:59.000']
+            main(tail)
+            settings = load_settings(self.config_path)
+            summary = read_daily_summary(settings['summary_path'])
+            self.assertEqual(summary['tpep_pickup_datetime'].max(), pd.Timestamp('2023-01-06'))
+            exported = {path: os.stat(path).st_ino for path in trip_store_files(settings['store_path'])}
+
+            # the rest of Jan 6th and the following days arrive
+            stub.rows.extend(self.rows[len(first):])
+            stub.pickups.extend(row['tpep_pickup_datetime'] for row in self.rows[len(first):])
+            requests = stub.requests
+            main(tail)
+            # Jan 6th to 20th in chunks of 7, 7 and 1 days, a count and 6, 6 and 1 pages of 100 trips each
+            self.assertEqual(stub.requests - requests, 16)
+            # only the store files of Jan 6th onwards are rewritten
+            self.assertEqual([os.stat(path).st_ino == exported.get(path) for path in trip_store_files(settings['store_path'])],
+                             [True] * 5 + [False] * 15)
+            pd.testing.assert_frame_equal(read_parquet_file(settings['store_path']), read_parquet_file(settings['trips_path']))
+
+        expected = self.expected_summary(self.rows)
+        summary = read_daily_summary(settings['summary_path'])
+        pd.testing.assert_frame_equal(summary[['tpep_pickup_datetime', 'trip_seconds', 'trip_count']],
+                                      expected[['tpep_pickup_datetime', 'trip_seconds', 'trip_count']])
+
+    def test_polling_needs_tail(self):
+        self.write_config('http://127.0.0.1:9/resource.json')
+        with self.assertRaises(SystemExit):
+            main(['--config', self.config_path, '--interval', '5'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,366 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from unittest.mock import patch
+from requests.exceptions import ConnectionError
+from utils import write_pages_to_dataset, read_parquet_file, page_to_record_batch
+from utils import ApiClient, TripValidator, ingest_range, read_checkpoint
+from utils import DROPOFF_OFFSET, ROW_GROUP_SIZE, write_trip_file, open_trip_dataset, create_trip_filter, summarize_dataset
+from utils import TRIP_SCHEMA, export_trip_store, open_trip_store, read_trip_store, trip_store_files
+from benchmarks.soda_stub import SodaStub, make_rows
+
+# These tests cover the date-partitioned trip dataset in a temporary directory.
+class TestPartitionedDataset(unittest.TestCase):
+
+    def setUp(self):
+        # one trip every 30 minutes from Jan 1st to Jan 4th
+        self.rows = make_rows('2023-01-01', periods=4 * 48, freq='30min')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'taxi_trips')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def pages(self, rows, size=30):
+        return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+    def test_write_pages_to_dataset_partitions_by_day(self):
+        written = write_pages_to_dataset(self.pages(self.rows), self.root)
+        self.assertEqual(written, 192)
+        self.assertEqual(sorted(os.listdir(self.root)), [
+            'pickup_date=2023-01-01', 'pickup_date=2023-01-02', 'pickup_date=2023-01-03', 'pickup_date=2023-01-04'
+        ])
+        expected = page_to_record_batch(self.rows).to_pandas()
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), expected)
+
+    def test_ingest_is_idempotent_and_only_replaces_fetched_days(self):
+        write_pages_to_dataset(self.pages(self.rows[:96]), self.root)
+        untouched = os.listdir(os.path.join(self.root, 'pickup_date=2023-01-01'))
+        # the second ingest re-fetches Jan 2nd and adds Jan 3rd and 4th
+        write_pages_to_dataset(self.pages(self.rows[48:]), self.root)
+        write_pages_to_dataset(self.pages(self.rows[48:]), self.root)
+
+        self.assertEqual(os.listdir(os.path.join(self.root, 'pickup_date=2023-01-01')), untouched)
+        self.assertFalse(os.path.exists(os.path.join(self.root, '_staging')))
+        expected = page_to_record_batch(self.rows).to_pandas()
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), expected)
+
+    def test_read_parquet_file_only_opens_overlapping_partitions(self):
+        write_pages_to_dataset(self.pages(self.rows), self.root)
+        # a broken file outside of the window must not be read
+        with open(os.path.join(self.root, 'pickup_date=2023-01-01', 'part-00000.parquet'), 'wb') as f:
+            f.write(b'not a parquet file')
+
+        df = read_parquet_file(self.root, '2023-01-02T12:00:00.000', '2023-01-03T23:59:59.000')
+        self.assertEqual(len(df), 72)
+        self.assertEqual(df['tpep_pickup_datetime'].min(), pd.Timestamp('2023-01-02 12:00:00'))
+        self.assertEqual(df['tpep_pickup_datetime'].max(), pd.Timestamp('2023-01-03 23:30:00'))
+
+    def test_failed_ingest_keeps_existing_partitions(self):
+        write_pages_to_dataset(self.pages(self.rows[:96]), self.root)
+
+        def failing_pages():
+            yield self.rows[48:96]
+            raise ConnectionError('lost connection')
+
+        with self.assertRaises(ConnectionError):
+            write_pages_to_dataset(failing_pages(), self.root)
+        self.assertEqual(len(read_parquet_file(self.root)), 96)
+        self.assertFalse(os.path.exists(os.path.join(self.root, '_staging')))
+
+class TestStoredLayout(unittest.TestCase):
+
+    def setUp(self):
+        # one trip every 10 seconds on Jan 1st and 2nd, 8640 a day
+        self.rows = make_rows('2023-01-01', periods=2 * 8640, freq='10s', trip_minutes=12)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'taxi_trips')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_trips_without_a_pickup_are_dropped(self):
+        rows = list(self.rows[:10])
+        rows[3] = {'tpep_dropoff_datetime': rows[3]['tpep_dropoff_datetime']}
+        rows[7] = dict(rows[7], tpep_dropoff_datetime=None)
+        with self.assertLogs('utils', 'WARNING'):
+            self.assertEqual(write_pages_to_dataset([rows], self.root), 9)
+        expected = page_to_record_batch(rows[:3] + rows[4:]).to_pandas()
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), expected)
+
+    def test_partitions_are_compacted_into_sorted_files(self):
+        pages = [self.rows[i:i + 1000] for i in range(0, len(self.rows), 1000)]
+        pages[3] = pages[3][::-1]
+        write_pages_to_dataset(pages, self.root)
+        day_dir = os.path.join(self.root, 'pickup_date=2023-01-01')
+        self.assertEqual(os.listdir(day_dir), ['part-00000.parquet'])
+
+        metadata = pq.ParquetFile(os.path.join(day_dir, 'part-00000.parquet')).metadata
+        self.assertEqual(metadata.schema.to_arrow_schema().names, ['tpep_pickup_datetime', DROPOFF_OFFSET])
+        self.assertEqual(metadata.num_rows, 8640)
+        self.assertTrue(all(metadata.row_group(i).num_rows <= ROW_GROUP_SIZE for i in range(metadata.num_row_groups)))
+        pickup = metadata.row_group(0).column(0)
+        self.assertEqual(pickup.compression, 'ZSTD')
+        self.assertIn('DELTA_BINARY_PACKED', pickup.encodings)
+        self.assertTrue(pickup.statistics.has_min_max)
+        trips = pq.read_table(os.path.join(day_dir, 'part-00000.parquet'))
+        self.assertEqual(trips.schema.field('tpep_pickup_datetime').type, pa.timestamp('ms'))
+        self.assertEqual(trips.column(DROPOFF_OFFSET).to_pylist(), [720] * 8640)
+        self.assertTrue(trips.column(0).to_pandas().is_monotonic_increasing)
+
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+
+    def test_filtered_reads_skip_row_groups(self):
+        path = os.path.join(self.tmp_dir.name, 'trips.parquet')
+        with patch('utils.ROW_GROUP_SIZE', 1000):
+            write_trip_file(page_to_record_batch(self.rows), path)
+        dataset = open_trip_dataset(path)
+        condition = create_trip_filter(dataset.schema, '2023-01-01T06:00:00.000', '2023-01-01T08:59:59.000')
+        row_groups = [rg for fragment in dataset.get_fragments() for rg in fragment.split_by_row_group(condition)]
+        # 6am to 9am are the trips 2160 to 3239, in the row groups of 2000 and 3000
+        self.assertEqual([rg.row_groups[0].id for rg in row_groups], [2, 3])
+        self.assertEqual(len(read_parquet_file(path, '2023-01-01T06:00:00.000', '2023-01-01T08:59:59.000')), 3 * 360)
+
+    def test_dropoffs_that_dont_fit_keep_their_timestamp(self):
+        rows = self.rows[:100]
+        rows[10] = dict(rows[10], tpep_dropoff_datetime='2023-01-01T00:13:40.250')
+        rows[20] = {'tpep_dropoff_datetime': '2023-01-01T00:20:00.000'}
+        path = os.path.join(self.tmp_dir.name, 'trips.parquet')
+        write_trip_file(page_to_record_batch(rows), path)
+        self.assertEqual(pq.read_schema(path).names, ['tpep_pickup_datetime', 'tpep_dropoff_datetime'])
+        expected = page_to_record_batch(rows).to_pandas().sort_values('tpep_pickup_datetime', ignore_index=True, na_position='last')
+        pd.testing.assert_frame_equal(read_parquet_file(path), expected)
+
+    def test_files_of_the_previous_layout_are_read(self):
+        write_pages_to_dataset([self.rows[8640:]], self.root)
+        day_dir = os.path.join(self.root, 'pickup_date=2023-01-01')
+        os.makedirs(day_dir)
+        pq.write_table(pa.Table.from_batches([page_to_record_batch(self.rows[:8640])]), os.path.join(day_dir, 'part-00000.parquet'))
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+        self.assertEqual(summarize_dataset(self.root)['trip_count'].tolist(), [8640, 8640])
+
+class TestTripStore(unittest.TestCase):
+
+    def setUp(self):
+        # one trip every 10 minutes from Jan 1st to Jan 5th
+        self.rows = make_rows('2023-01-01', periods=5 * 144, freq='10min', trip_minutes=12)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'taxi_trips')
+        self.store = os.path.join(self.tmp_dir.name, 'taxi_trips.arrow')
+        pages = [self.rows[i:i + 100] for i in range(0, len(self.rows), 100)]
+        pages[2] = pages[2][::-1]
+        write_pages_to_dataset(pages, self.root)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_days_are_exported_as_sorted_batches(self):
+        self.assertEqual(export_trip_store(self.root, self.store), len(self.rows))
+        self.assertEqual(sorted(os.listdir(self.store)), [f"2023-01-0{day}.arrow" for day in range(1, 6)])
+        for path in trip_store_files(self.store):
+            reader = open_trip_store(path)
+            self.assertEqual(reader.schema, TRIP_SCHEMA)
+            self.assertEqual([reader.get_batch(i).num_rows for i in range(reader.num_record_batches)], [144])
+        self.assertTrue(read_trip_store(self.store).equals(pa.Table.from_batches([page_to_record_batch(self.rows)])))
+
+    def test_only_the_given_days_are_rewritten(self):
+        export_trip_store(self.root, self.store)
+        files = {path: os.stat(path).st_ino for path in trip_store_files(self.store)}
+        # Jan 3rd is ingested again with every other trip, Jan 5th has no trips anymore
+        write_pages_to_dataset([self.rows[2 * 144:3 * 144:2]], self.root)
+        shutil.rmtree(os.path.join(self.root, 'pickup_date=2023-01-05'))
+
+        self.assertEqual(export_trip_store(self.root, self.store, ['2023-01-03', '2023-01-05']), 72)
+        self.assertEqual([os.stat(path).st_ino == files[path] for path in trip_store_files(self.store)], [True, True, False, True])
+        pd.testing.assert_frame_equal(read_parquet_file(self.store), read_parquet_file(self.root))
+
+    def test_a_single_file_store_is_replaced(self):
+        with open(self.store, 'wb') as f:
+            f.write(b'ARROW1')
+        self.assertEqual(export_trip_store(self.root, self.store, ['2023-01-03']), len(self.rows))
+        pd.testing.assert_frame_equal(read_parquet_file(self.store), read_parquet_file(self.root))
+
+    def test_ranges_are_read_without_copying(self):
+        export_trip_store(self.root, self.store)
+        allocated = pa.total_allocated_bytes()
+        day = read_parquet_file(self.store, '2023-01-02T06:00:00.000', '2023-01-02T11:59:59.000')
+        self.assertEqual(pa.total_allocated_bytes(), allocated)
+        self.assertFalse(day['tpep_pickup_datetime'].to_numpy().flags.writeable)
+        pd.testing.assert_frame_equal(day, read_parquet_file(self.root, '2023-01-02T06:00:00.000', '2023-01-02T11:59:59.000'))
+
+        for start_date, end_date in [(None, None), ('2023-01-02T00:05:00.000', '2023-01-04T12:00:00.000'),
+                                     ('2023-01-01T00:00:00.000', '2023-01-01T00:00:00.000'), ('2023-02-01T00:00:00.000', None)]:
+            pd.testing.assert_frame_equal(read_parquet_file(self.store, start_date, end_date),
+                                          read_parquet_file(self.root, start_date, end_date))
+            pd.testing.assert_frame_equal(summarize_dataset(self.store, start_date, end_date),
+                                          summarize_dataset(self.root, start_date, end_date))
+
+    def test_missing_store(self):
+        with self.assertRaises(FileNotFoundError):
+            read_parquet_file(self.store)
+
+class FailingClient(ApiClient):
+    """
+    Client losing the connection for good after a number of requests.
+    """
+
+    def __init__(self, requests):
+        super().__init__()
+        self.remaining = requests
+
+    def fetch(self, base_url, params, end_date=None):
+        self.remaining -= 1
+        if self.remaining < 0:
+            raise ConnectionError('lost connection')
+        return super().fetch(base_url, params, end_date)
+
+
+class TestResumableIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = make_rows('2023-01-01', periods=4 * 48, freq='30min')
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-04T23:59:59.000'
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'taxi_trips')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def interrupted_ingest(self, stub, requests, workers=1):
+        with self.assertRaises(ConnectionError):
+            ingest_range(self.start_date, self.end_date, 30, stub.url, self.root, workers, FailingClient(requests))
+
+    def test_resumed_validation_keeps_the_rejects_of_the_interrupted_ingest(self):
+        rows = [dict(row) for row in self.rows]
+        rows[10]['tpep_dropoff_datetime'] = '2023-01-03T05:00:00.000'
+        rows.insert(41, dict(rows[40]))
+        # the last record of the third page is repeated by the first one of the fourth
+        rows.insert(90, dict(rows[89]))
+
+        def validator(name):
+            return TripValidator(self.start_date, self.end_date, rejects_path=os.path.join(self.tmp_dir.name, name))
+
+        with SodaStub(rows) as stub:
+            expected = validator('expected.parquet')
+            ingest_range(self.start_date, self.end_date, 30, stub.url, os.path.join(self.tmp_dir.name, 'expected'), validator=expected)
+            interrupted = validator('rejects.parquet')
+            with self.assertRaises(ConnectionError):
+                ingest_range(self.start_date, self.end_date, 30, stub.url, self.root, 1, FailingClient(3), validator=interrupted)
+            interrupted.close()
+            self.assertEqual(interrupted.summary()['checked'], 90)
+            self.assertEqual(len(pq.read_table(os.path.join(self.tmp_dir.name, 'rejects.parquet'))), 2)
+
+            resumed = validator('rejects.parquet')
+            self.assertEqual(ingest_range(self.start_date, self.end_date, 30, stub.url, self.root, validator=resumed), 191)
+
+        self.assertEqual(resumed.summary(), expected.summary())
+        self.assertEqual(resumed.summary()['rejected'], {'missing_timestamp': 0, 'outside_window': 0, 'too_short': 0, 'too_long': 1, 'duplicate': 2})
+        pd.testing.assert_frame_equal(pq.read_table(os.path.join(self.tmp_dir.name, 'rejects.parquet')).to_pandas(),
+                                      pq.read_table(os.path.join(self.tmp_dir.name, 'expected.parquet')).to_pandas())
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['expected', 'expected.parquet', 'rejects.parquet', 'taxi_trips'])
+
+    def test_resume_only_fetches_the_pages_after_the_checkpoint(self):
+        with SodaStub(self.rows) as stub:
+            self.interrupted_ingest(stub, 3)
+            checkpoint = read_checkpoint(self.root)
+            self.assertEqual((checkpoint['pages'], checkpoint['offset']), (3, 90))
+            self.assertEqual(checkpoint['watermark'], '2023-01-02T20:30:00.000')
+            # nothing is visible before the ingest completes
+            self.assertEqual(len(read_parquet_file(self.root)), 0)
+
+            requests = stub.requests
+            self.assertEqual(ingest_range(self.start_date, self.end_date, 30, stub.url, self.root), 192)
+            # the pages at 90, 120, 150 and 180 and the empty page at 210
+            self.assertEqual(stub.requests - requests, 5)
+
+        self.assertIsNone(read_checkpoint(self.root))
+        self.assertFalse(os.path.exists(os.path.join(self.root, '_staging')))
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+
+    def test_resume_with_concurrent_workers(self):
+        with SodaStub(self.rows) as stub:
+            # the count query and two pages
+            self.interrupted_ingest(stub, 3, workers=3)
+            self.assertEqual(read_checkpoint(self.root)['offset'], 60)
+            ingest_range(self.start_date, self.end_date, 30, stub.url, self.root, workers=3)
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+
+    def test_files_of_uncommitted_pages_are_dropped(self):
+        with SodaStub(self.rows) as stub:
+            self.interrupted_ingest(stub, 2)
+            # a page whose files were written when the run died before committing it
+            stray_file = os.path.join(self.root, '_staging', 'pickup_date=2023-01-03', 'part-00002.parquet')
+            os.makedirs(os.path.dirname(stray_file))
+            with open(stray_file, 'wb') as f:
+                f.write(b'not a parquet file')
+            ingest_range(self.start_date, self.end_date, 30, stub.url, self.root)
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+
+    def interrupted_compaction(self, stub, failing_name):
+        replace = os.replace
+
+        def failing_replace(src, dst):
+            if os.path.basename(src) == failing_name:
+                raise OSError('evicted')
+            replace(src, dst)
+
+        with patch('utils.os.replace', side_effect=failing_replace):
+            with self.assertRaises(OSError):
+                ingest_range(self.start_date, self.end_date, 30, stub.url, self.root)
+        self.assertEqual(read_checkpoint(self.root)['pages'], 7)
+
+    def test_resume_after_an_interrupted_compaction(self):
+        with SodaStub(self.rows) as stub:
+            # the merged file wasn't complete, the pages are still there
+            self.interrupted_compaction(stub, '_compacted.tmp')
+            staged = os.path.join(self.root, '_staging', 'pickup_date=2023-01-01')
+            self.assertIn('_compacted.tmp', os.listdir(staged))
+            self.assertEqual(ingest_range(self.start_date, self.end_date, 30, stub.url, self.root), 192)
+            pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+
+            # the merged file was complete, the pages it merged are gone
+            shutil.rmtree(self.root)
+            self.interrupted_compaction(stub, 'compacted.parquet')
+            self.assertEqual(os.listdir(staged), ['compacted.parquet'])
+            self.assertEqual(ingest_range(self.start_date, self.end_date, 30, stub.url, self.root), 192)
+        self.assertEqual(os.listdir(os.path.join(self.root, 'pickup_date=2023-01-01')), ['part-00000.parquet'])
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(self.rows).to_pandas())
+
+    def test_resume_with_keyset_pagination(self):
+        rows = [row for row in self.rows for _ in range(3)]
+        with SodaStub(rows) as stub:
+            with self.assertRaises(ConnectionError):
+                ingest_range(self.start_date, self.end_date, 40, stub.url, self.root, client=FailingClient(4), pagination='keyset')
+            checkpoint = read_checkpoint(self.root)
+            # the 4 committed pages end inside the group of trips picked up at 02:30 on Jan 2nd
+            self.assertEqual((checkpoint['offset'], checkpoint['watermark']), (160, '2023-01-02T02:30:00.000'))
+            self.assertEqual(checkpoint['last_id'], 'row-00000159')
+
+            requests = stub.requests
+            self.assertEqual(ingest_range(self.start_date, self.end_date, 40, stub.url, self.root, pagination='keyset'), 576)
+            # 416 records left in 11 pages and the empty page
+            self.assertEqual(stub.requests - requests, 12)
+        pd.testing.assert_frame_equal(read_parquet_file(self.root), page_to_record_batch(rows).to_pandas())
+
+    def test_ranges_within_a_day_are_rejected(self):
+        with self.assertRaises(ValueError):
+            ingest_range('2023-01-01T12:00:00.000', self.end_date, 30, 'http://127.0.0.1:9/resource.json', self.root)
+        with self.assertRaises(ValueError):
+            ingest_range(self.start_date, '2023-01-04T12:00:00.000', 30, 'http://127.0.0.1:9/resource.json', self.root)
+        self.assertFalse(os.path.exists(self.root))
+
+    def test_checkpoint_of_another_range_is_discarded(self):
+        with SodaStub(self.rows) as stub:
+            self.interrupted_ingest(stub, 3)
+            end_date = '2023-01-02T23:59:59.000'
+            self.assertEqual(ingest_range(self.start_date, end_date, 30, stub.url, self.root), 96)
+        self.assertIsNone(read_checkpoint(self.root))
+        self.assertEqual(sorted(os.listdir(self.root)), ['pickup_date=2023-01-01', 'pickup_date=2023-01-02'])
+
+if __name__ == '__main__':
+    unittest.main()
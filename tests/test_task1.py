@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import patch, MagicMock
 from utils import make_api_request, create_params, process_response, fetch_all_data, calculate_trip_length, aggregate_daily_trips, calculate_rolling_average, process_taxi_data
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
@@ -65,6 +66,17 @@ class TestTask1(unittest.TestCase):
         })
         assert_frame_equal(result, expected)
     
+    def test_calculate_trip_length_leaves_input_unchanged(self):
+        df = pd.DataFrame({
+            'tpep_pickup_datetime': pd.to_datetime(['2023-01-01 12:00:00', '2023-01-01 23:50:00']),
+            'tpep_dropoff_datetime': pd.to_datetime(['2023-01-01 12:00:45', '2023-01-02 00:20:00'])
+        })
+        result = calculate_trip_length(df)
+        self.assertListEqual(list(df.columns), ['tpep_pickup_datetime', 'tpep_dropoff_datetime'])
+        self.assertListEqual(result['trip_length'].tolist(), [0.75, 30.0])
+        # datetime64 columns are not converted again
+        self.assertTrue(np.shares_memory(result['tpep_pickup_datetime'].to_numpy(), df['tpep_pickup_datetime'].to_numpy()))
+
     def test_aggregate_daily_trips(self):
         df = pd.DataFrame({
             'tpep_pickup_datetime': pd.to_datetime(['2023-01-01 12:00:00', '2023-01-01 13:00:00', '2023-01-02 12:00:00']),
@@ -77,6 +89,20 @@ class TestTask1(unittest.TestCase):
         })
         assert_frame_equal(result, expected)
     
+    def test_missing_timestamps(self):
+        df = pd.DataFrame({
+            'tpep_pickup_datetime': ['2023-01-01 12:00:00', None, '2023-01-02 12:00:00'],
+            'tpep_dropoff_datetime': ['2023-01-01 12:30:00', '2023-01-01 13:00:00', None]
+        })
+        result = calculate_trip_length(df)
+        self.assertEqual(result['trip_length'].tolist()[0], 30.0)
+        self.assertTrue(result['trip_length'][1:].isna().all())
+        expected = pd.DataFrame({
+            'tpep_pickup_datetime': pd.to_datetime(['2023-01-01', '2023-01-02']),
+            'daily_trip_time (in hours)': [0.5, 0.0]
+        })
+        assert_frame_equal(aggregate_daily_trips(result), expected)
+
     def test_calculate_rolling_average(self):
         df = pd.DataFrame({
             'tpep_pickup_datetime': pd.date_range(start='2023-01-01', periods=5),
@@ -90,6 +116,15 @@ class TestTask1(unittest.TestCase):
         })
         assert_frame_equal(result, expected)
 
+    def test_calculate_rolling_average_skips_missing_days(self):
+        df = pd.DataFrame({
+            'tpep_pickup_datetime': pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-05', '2023-01-06']),
+            'daily_trip_time (in hours)': [1.0, 2.0, 3.0, 4.0]
+        })
+        result = calculate_rolling_average(df, 3)
+        # Jan 5th only reaches back to Jan 3rd, the row before it is Jan 2nd
+        self.assertListEqual(result['rolling_average'].tolist(), [1.0, 1.5, 3.0, 3.5])
+
     # The test function below was revised.
     # Since the test data (df) contained only trips from a single day, the rolling average was identical to the daily trip time.
     # That didn't actually test the "rolling" aspect of the average calculation. Therefore, test data was expanded to cover multiple
@@ -112,13 +147,9 @@ class TestTask1(unittest.TestCase):
             ])
         })
 
-        # Test mean calculation (for choice-1. The choice structure should be eliminated though.)
-        _, _, result_mean = process_taxi_data(df, 1)
-        self.assertAlmostEqual(result_mean, 2.6) # Mean of daily trip times: (1.5 + 3.0 + 3.0 + 2.5 + 3.0) / 5 = 2.6
+        _, daily_summary, statistics = process_taxi_data(df)
+        self.assertAlmostEqual(daily_summary['daily_trip_time (in hours)'].mean(), 2.6) # Mean of daily trip times: (1.5 + 3.0 + 3.0 + 2.5 + 3.0) / 5 = 2.6
 
-        # Test rolling average calculation (choice-2. The choice structure should be eliminated though.)
-        _, daily_summary, result_rolling = process_taxi_data(df, 2)
-    
         # The rolling average is calculated with a window of 45 days as per the function
         # However, since we only have 5 days of data, all values will be the same as the cumulative average up to that day
         expected_rolling = pd.DataFrame({
@@ -128,7 +159,9 @@ class TestTask1(unittest.TestCase):
             # to match the original function output requirements
         })
 
-        pd.testing.assert_frame_equal(result_rolling, expected_rolling)
+        pd.testing.assert_frame_equal(daily_summary, expected_rolling)
+        self.assertListEqual(statistics['rolling_mean_45D'].tolist(), expected_rolling['rolling_average'].tolist())
+        self.assertListEqual(statistics['rolling_mean_7D'].tolist(), expected_rolling['rolling_average'].tolist())
 
         # Verify daily_summary
         expected_daily = pd.DataFrame({
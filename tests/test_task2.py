@@ -1,15 +1,22 @@
+import os
+import tempfile
 import unittest
 import pandas as pd
 #import numpy as np
 #from pandas.testing import assert_frame_equal
-from utils import process_taxi_data, read_parquet_file
+from utils import process_taxi_data, read_parquet_file, write_pages_to_dataset
+from benchmarks.soda_stub import make_rows
 
 # It creates sample data to test different scenarios 
 # (normal case, empty case, single-day case).
 class TestTask2(unittest.TestCase):
 
+    # The locally stored data is a date-partitioned dataset, a small one is ingested to a temporary directory.
     def test_read_parquet_file(self):
-        file_path = './data/taxi_trips.parquet'
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        file_path = os.path.join(tmp_dir.name, 'taxi_trips')
+        write_pages_to_dataset([make_rows('2023-01-01', periods=100, freq='h')], file_path)
         df = read_parquet_file(file_path)
         self.assertIsInstance(df, pd.DataFrame)
         # Verifies that the DataFrame is not empty and contains expected columns.
@@ -23,7 +30,7 @@ class TestTask2(unittest.TestCase):
             'tpep_dropoff_datetime': pd.date_range(start='2023-01-01 01:00:00', periods=100, freq='h')
         })
         
-        result = process_taxi_data(df, choice=2)
+        result = process_taxi_data(df)
         trip_lengths, daily_summary, *_ = result
 
         self.assertIsInstance(trip_lengths, pd.DataFrame)
@@ -45,7 +52,7 @@ class TestTask2(unittest.TestCase):
     # Ensures the function handles empty input correctly, returning empty result structures.
     def test_process_taxi_data_empty(self):
         empty_df = pd.DataFrame(columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime'])
-        result = process_taxi_data(empty_df, choice=2)
+        result = process_taxi_data(empty_df)
         trip_lengths, daily_summary, *_ = result
         self.assertTrue(trip_lengths.empty)
         self.assertTrue(daily_summary.empty)
@@ -58,7 +65,7 @@ class TestTask2(unittest.TestCase):
             'tpep_pickup_datetime': pd.date_range(start='2023-01-01', periods=24, freq='h'),
             'tpep_dropoff_datetime': pd.date_range(start='2023-01-01 01:00:00', periods=24, freq='h')
         })
-        result = process_taxi_data(df, choice=2)
+        result = process_taxi_data(df)
         trip_lengths, daily_summary, *_ = result
         self.assertEqual(len(daily_summary), 1)
         self.assertAlmostEqual(daily_summary['daily_trip_time (in hours)'].iloc[0], 24.0)
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from utils import TripValidator, duplicated_pairs, page_to_record_batch, write_pages_to_dataset, read_parquet_file
+from benchmarks.soda_stub import make_rows
+
+# These tests cover the validation of the fetched trips before they are stored.
+class TestTripValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.start_date = '2023-01-01T00:00:00.000'
+        self.end_date = '2023-01-01T23:59:59.000'
+        self.rows = make_rows('2023-01-01', periods=100, freq='min')
+        self.junk = [
+            {'tpep_pickup_datetime': '2022-12-31T23:50:00.000', 'tpep_dropoff_datetime': '2023-01-01T00:05:00.000'},
+            {'tpep_pickup_datetime': '2023-01-01T05:00:00.000', 'tpep_dropoff_datetime': '2023-01-01T04:00:00.000'},
+            {'tpep_pickup_datetime': '2023-01-01T05:00:00.000', 'tpep_dropoff_datetime': '2023-01-03T05:00:00.000'},
+            {'tpep_pickup_datetime': '2023-01-01T06:00:00.000'},
+            dict(self.rows[49]),
+        ]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rejects_path = os.path.join(self.tmp_dir.name, 'rejects', 'rejects.parquet')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_rejects_are_counted_per_rule_and_quarantined(self):
+        validator = TripValidator(self.start_date, self.end_date, rejects_path=self.rejects_path)
+        valid = validator.validate(page_to_record_batch(self.rows + self.junk))
+        validator.close()
+
+        pd.testing.assert_frame_equal(valid.to_pandas(), page_to_record_batch(self.rows).to_pandas())
+        self.assertEqual(validator.summary(), {'checked': 105, 'rejected': {
+            'missing_timestamp': 1, 'outside_window': 1, 'too_short': 1, 'too_long': 1, 'duplicate': 1
+        }})
+        rejects = pq.read_table(self.rejects_path).to_pandas()
+        self.assertEqual(rejects['reject_reason'].astype(str).tolist(),
+                         ['outside_window', 'too_short', 'too_long', 'missing_timestamp', 'duplicate'])
+        self.assertFalse(os.path.exists(f"{self.rejects_path}.tmp"))
+        self.assertEqual(os.listdir(os.path.dirname(self.rejects_path)), ['rejects.parquet'])
+
+    def test_rules_can_be_disabled(self):
+        validator = TripValidator(min_trip_seconds=None, max_trip_seconds=None, deduplicate=False)
+        valid = validator.validate(page_to_record_batch(self.rows + self.junk))
+        self.assertEqual(valid.num_rows, 104)
+        self.assertEqual(validator.summary()['rejected']['missing_timestamp'], 1)
+        validator.close()
+        self.assertFalse(os.path.exists(self.rejects_path))
+
+    def test_duplicates_across_page_boundaries(self):
+        # every pickup time three times, the second trip of each time twice
+        rows = []
+        for row in make_rows('2023-01-01', periods=50):
+            other = dict(row, tpep_dropoff_datetime=row['tpep_dropoff_datetime'].replace(':00.000', ':30.000'))
+            rows.extend([row, other, dict(other)])
+        validator = TripValidator(self.start_date, self.end_date)
+        pages = [rows[i:i + 7] for i in range(0, len(rows), 7)]
+        valid = [validator.validate(page_to_record_batch(page)) for page in pages]
+        self.assertEqual(sum(batch.num_rows for batch in valid), 100)
+        self.assertEqual(validator.rejected['duplicate'], 50)
+
+    def test_duplicated_pairs(self):
+        rng = np.random.default_rng(0)
+        pickup = np.sort(rng.integers(0, 1_000, 5_000)) * 1_000_000_000
+        dropoff = pickup + rng.integers(0, 5, 5_000) * 1_000_000_000
+        expected = pd.DataFrame({'p': pickup, 'd': dropoff}).duplicated().to_numpy()
+        np.testing.assert_array_equal(duplicated_pairs(pickup, dropoff), expected)
+        # durations of years in nanoseconds don't fit into one packed key
+        dropoff[::2] += 3 * 365 * 86_400 * 10**9 + 1
+        expected = pd.DataFrame({'p': pickup, 'd': dropoff}).duplicated().to_numpy()
+        np.testing.assert_array_equal(duplicated_pairs(pickup, dropoff), expected)
+
+    def test_only_valid_trips_are_stored(self):
+        root = os.path.join(self.tmp_dir.name, 'taxi_trips')
+        validator = TripValidator(self.start_date, self.end_date, rejects_path=self.rejects_path)
+        written = write_pages_to_dataset([self.rows[:50], self.junk, self.rows[50:]], root, validator=validator)
+        validator.close()
+        self.assertEqual(written, 100)
+        self.assertEqual(sorted(os.listdir(root)), ['pickup_date=2023-01-01'])
+        pd.testing.assert_frame_equal(read_parquet_file(root), page_to_record_batch(self.rows).to_pandas())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,44 +1,669 @@
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext
+from collections import deque
+from itertools import islice
+from functools import partial
+import multiprocessing
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
 import requests
 import logging
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
 from urllib.parse import urlencode
 from pyarrow.lib import ArrowIOError
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Column types of the stored trips, the API returns both timestamps as ISO strings.
+TRIP_SCHEMA = pa.schema([
+    ('tpep_pickup_datetime', pa.timestamp('ns')),
+    ('tpep_dropoff_datetime', pa.timestamp('ns'))
+])
+
+# Column types of a page of trips in the CSV format of the API, ':id' is only there when it was selected.
+CSV_COLUMN_TYPES = {'tpep_pickup_datetime': pa.timestamp('ns'), 'tpep_dropoff_datetime': pa.timestamp('ns'), ':id': pa.string()}
+
+# The trip store is a Hive-style dataset with one directory per pickup day, e.g. pickup_date=2023-01-31.
+PARTITION_SCHEMA = pa.schema([('pickup_date', pa.date32())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+NS_PER_DAY = 86_400_000_000_000
+
+# Layout of the stored trip files: the pickups sorted, the dropoff as the whole seconds after the pickup.
+# Files written before, or with dropoffs that don't fit, have the dropoff timestamp instead, see trip_columns.
+DROPOFF_OFFSET = 'dropoff_offset_seconds'
+STORED_SCHEMA = pa.schema([
+    ('tpep_pickup_datetime', pa.timestamp('ns')),
+    ('tpep_dropoff_datetime', pa.timestamp('ns')),
+    (DROPOFF_OFFSET, pa.int32()),
+])
+# Trips per row group of the stored files, about 6 hours of a day, the unit the filtered reads can skip.
+ROW_GROUP_SIZE = 32_768
+# Suffix of the trip store and its day files, uncompressed Arrow IPC copies of the dataset that are memory-mapped, see export_trip_store.
+TRIP_STORE_SUFFIX = '.arrow'
+
+# Columns of the persisted daily summary, one row per pickup day.
+DAILY_SUMMARY_COLUMNS = ['tpep_pickup_datetime', 'trip_seconds', 'trip_count', 'daily_trip_time (in hours)', 'rolling_average',
+                         'trip_seconds_min', 'trip_seconds_max', 'trip_seconds_sketch']
+
+# Rules of the TripValidator, a rejected trip is counted for the first one it breaks.
+REJECT_REASONS = ('missing_timestamp', 'outside_window', 'too_short', 'too_long', 'duplicate')
+
+# Trip durations are counted per day in logarithmic buckets of about 1% relative width.
+# Bucket 0 holds the durations of zero or less seconds, the last one everything above a week.
+SKETCH_GAMMA = 1.01 / 0.99
+SKETCH_BUCKETS = int(np.ceil(np.log(7 * 86_400) / np.log(SKETCH_GAMMA))) + 2
+# Bucket of every whole number of seconds up to a week, a lookup is much cheaper than a logarithm per trip.
+SKETCH_TABLE = np.minimum(
+    np.concatenate([[0], np.ceil(np.log(np.arange(1, 7 * 86_400 + 1)) / np.log(SKETCH_GAMMA)).astype('int64') + 1]),
+    SKETCH_BUCKETS - 1,
+).astype('int16')
+
+# Calendar windows of the rolling statistics of the daily trip times.
+ROLLING_WINDOWS = ('7D', '30D', '45D', '90D')
+
+class FetchStats:
+    """
+    Collects the number of requests, the transferred bytes and the latency of every API request.
+
+    The counters are shared by the threads of a concurrent fetch, so every update holds a lock.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, latency, bytes_received, bytes_decoded):
+        """
+        Records one successful request.
+
+        Args:
+            latency (float): Seconds from sending the request to decoding the response
+            bytes_received (int): Bytes of the response body on the wire
+            bytes_decoded (int): Bytes of the response body after decompression
+        """
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += bytes_received
+            self.bytes_decoded += bytes_decoded
+            self.latencies.append(latency)
+
+    def summary(self):
+        """
+        Summarizes the recorded requests.
+
+        Returns:
+            dict: Request count, bytes and median/p95/max latency in milliseconds
+        """
+
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            return {
+                'requests': self.requests,
+                'bytes_received': self.bytes_received,
+                'bytes_decoded': self.bytes_decoded,
+                'latency_ms_p50': round(float(np.percentile(latencies, 50)), 1) if self.requests else None,
+                'latency_ms_p95': round(float(np.percentile(latencies, 95)), 1) if self.requests else None,
+                'latency_ms_max': round(float(latencies.max()), 1) if self.requests else None
+            }
+
+
+def read_memory():
+    """
+    Reads the current and the peak resident set size of this process.
+
+    The peak is the VmHWM line of /proc/self/status, which belongs to the
+    current address space only, while ru_maxrss survives exec on Linux and
+    would report the parent's peak.
+
+    Returns:
+        tuple: (RSS, peak RSS) in bytes, None where /proc isn't available
+    """
+
+    try:
+        with open('/proc/self/status') as f:
+            status = f.read()
+    except OSError:
+        return None, None
+    sizes = {}
+    for line in status.splitlines():
+        if line.startswith(('VmRSS:', 'VmHWM:')):
+            sizes[line[:5]] = int(line.split()[1]) * 1024
+    return sizes.get('VmRSS'), sizes.get('VmHWM')
+
+
+def reset_peak_memory():
+    """
+    Resets the peak resident set size of this process to the current one.
+
+    Returns:
+        bool: Whether the peak could be reset
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageMetrics:
+    """
+    Collects the wall time, CPU time, rows, bytes and peak memory of the stages of a run.
+
+    Stages are measured with measure and may run many times, e.g. once per page,
+    and in the fetch threads; the runs of a stage are added up. The CPU time is
+    the one of the thread running the stage, so stages running in parallel don't
+    count each other's work. The peak RSS of a stage is the high-water mark of
+    the process at its end. The mark is reset whenever a stage starts while no
+    other one runs, so stages run one after the other get a peak of their own.
+
+    Args:
+        labels (dict, optional): Labels of every metric in the Prometheus textfile, e.g. {'task': 'task1'}
+    """
+
+    FIELDS = ('calls', 'wall_seconds', 'cpu_seconds', 'rows', 'bytes_read', 'bytes_written', 'peak_rss_bytes')
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.stages = {}
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._running == 0:
+                reset_peak_memory()
+            self._running += 1
+
+    def record(self, stage, wall_seconds, cpu_seconds):
+        """
+        Adds a finished run of a stage.
+
+        Args:
+            stage (Stage): The finished run with its rows and bytes
+            wall_seconds (float): Elapsed seconds of the run
+            cpu_seconds (float): CPU seconds of the thread during the run
+        """
+
+        peak = read_memory()[1] or 0
+        with self._lock:
+            self._running -= 1
+            totals = self.stages.setdefault(stage.name, dict.fromkeys(self.FIELDS, 0))
+            totals['calls'] += 1
+            totals['wall_seconds'] += wall_seconds
+            totals['cpu_seconds'] += cpu_seconds
+            totals['rows'] += stage.rows
+            totals['bytes_read'] += stage.bytes_read
+            totals['bytes_written'] += stage.bytes_written
+            totals['peak_rss_bytes'] = max(totals['peak_rss_bytes'], peak)
+
+    def summary(self):
+        """
+        Summarizes the recorded stages.
+
+        Returns:
+            dict: Totals of every stage by name in the order the stages first finished
+        """
+
+        with self._lock:
+            return {
+                name: {field: round(value, 4) if isinstance(value, float) else value for field, value in totals.items()}
+                for name, totals in self.stages.items()
+            }
+
+    def log(self):
+        """
+        Logs every stage as one JSON object, e.g. for a log collector.
+        """
+
+        for name, totals in self.summary().items():
+            logger.info(json.dumps({'event': 'stage_metrics', **self.labels, 'stage': name, **totals}))
+
+    def write_textfile(self, path):
+        """
+        Writes the stages in the Prometheus text format, for the textfile collector of the node exporter.
+
+        The file is written next to its destination and moved into place, so the
+        collector never reads a partial file.
+
+        Args:
+            path (str): Path of the .prom file
+        """
+
+        metrics = [
+            ('calls', 'counter', 'Runs of the pipeline stage'),
+            ('wall_seconds', 'counter', 'Elapsed seconds spent in the pipeline stage'),
+            ('cpu_seconds', 'counter', 'CPU seconds of the threads running the pipeline stage'),
+            ('rows', 'counter', 'Records processed by the pipeline stage'),
+            ('bytes_read', 'counter', 'Bytes read by the pipeline stage'),
+            ('bytes_written', 'counter', 'Bytes written by the pipeline stage'),
+            ('peak_rss_bytes', 'gauge', 'Peak resident set size of the process at the end of the pipeline stage'),
+        ]
+        summary = self.summary()
+        lines = []
+        for field, kind, description in metrics:
+            name = f"taxi_rides_stage_{field}" + ('_total' if kind == 'counter' else '')
+            lines += [f"# HELP {name} {description}.", f"# TYPE {name} {kind}"]
+            for stage, totals in summary.items():
+                labels = ','.join(f'{key}="{prometheus_label(value)}"' for key, value in {**self.labels, 'stage': stage}.items())
+                lines.append(f"{name}{{{labels}}} {totals[field]}")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f"{path}.tmp", path)
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Stage:
+    """
+    One run of a pipeline stage, see measure. The code of the stage counts the rows and bytes it processed on it.
+    """
+
+    __slots__ = ('metrics', 'name', 'rows', 'bytes_read', 'bytes_written', 'started', 'cpu_started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.rows = self.bytes_read = self.bytes_written = 0
+
+    def __enter__(self):
+        if self.metrics is not None:
+            self.metrics.start()
+            self.started, self.cpu_started = time.perf_counter(), time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.record(self, time.perf_counter() - self.started, time.thread_time() - self.cpu_started)
+        return False
+
+
+def measure(metrics, name):
+    """
+    Measures a run of a pipeline stage, e.g. 'with measure(metrics, "convert") as stage: ...; stage.rows = n'.
+
+    Args:
+        metrics (StageMetrics, optional): Collects the run, without it nothing is measured
+        name (str): Name of the stage
+
+    Returns:
+        Stage: Context manager of the run
+    """
+
+    return Stage(metrics, name)
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of API responses, stored as small zstd compressed Parquet files.
+
+    A response is addressed by the SHA-256 of the base URL and the canonical query
+    parameters. Only queries of closed date ranges are cached, i.e. ranges ending
+    more than 'closed_after_days' days ago, whose records don't change anymore.
+    Entries older than the TTL are dropped when they are read, and once the cache
+    grows beyond 'max_bytes' the least recently used entries are evicted. The
+    total size is scanned once and then kept up to date by every write, and an
+    eviction frees a tenth of the limit, so the directory is only listed again
+    after about that many bytes were written.
+
+    Args:
+        directory (str): Directory of the cache files
+        ttl_seconds (float, optional): Maximum age of an entry, no limit by default
+        max_bytes (int, optional): Maximum total size of the entries, no limit by default
+        closed_after_days (int): Days after which a date range is considered closed
+    """
+
+    def __init__(self, directory, ttl_seconds=None, max_bytes=None, closed_after_days=7):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.closed_after_days = closed_after_days
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # total size of the entries, scanned by the first write with a size limit
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(base_url, params):
+        """
+        Computes the address of a response.
+
+        Args:
+            base_url (str): Base URL for the API endpoint
+            params (dict): Query parameters, e.g. from create_params
+
+        Returns:
+            str: Hex digest addressing the response
+        """
+
+        canonical = json.dumps({'base_url': base_url, 'params': params}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def covers(self, end_date):
+        """
+        Tells whether the responses of a date range may be cached.
+
+        Args:
+            end_date (str): End date of the queried range
+
+        Returns:
+            bool: True if the range is closed
+        """
+
+        return pd.Timestamp(end_date) < pd.Timestamp.now() - pd.Timedelta(days=self.closed_after_days)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.parquet")
+
+    def get(self, key, as_batch=False):
+        """
+        Reads a cached response.
+
+        Args:
+            key (str): Address from ResponseCache.key
+            as_batch (bool): Return the response as a record batch, e.g. a page decoded from CSV
+
+        Returns:
+            list: The cached records, a pyarrow.RecordBatch with 'as_batch', None on a miss
+        """
+
+        path = self.path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if self.ttl_seconds is not None and age > self.ttl_seconds:
+                size = os.path.getsize(path)
+                os.remove(path)
+                with self._lock:
+                    if self._size is not None:
+                        self._size -= size
+                raise FileNotFoundError(path)
+            table = pq.read_table(path)
+            os.utime(path)  # the modification time doubles as the last use for the eviction
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        if as_batch:
+            return table_to_record_batch(table)
+        # the API leaves out null fields, so do the cached records
+        return [{k: v for k, v in row.items() if v is not None} for row in table.to_pylist()]
+
+    def put(self, key, data):
+        """
+        Stores a response and evicts the least recently used entries beyond the size limit.
+
+        Args:
+            key (str): Address from ResponseCache.key
+            data (list): Records of the response, or a pyarrow.RecordBatch
+        """
+
+        if isinstance(data, pa.RecordBatch):
+            table = pa.Table.from_batches([data])
+        else:
+            names = list(dict.fromkeys(name for record in data for name in record))
+            table = pa.table({name: pa.array([record.get(name) for record in data]) for name in names})
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        pq.write_table(table, tmp_path, compression='zstd')
+        if self.max_bytes is None:
+            os.replace(tmp_path, path)
+            return
+        with self._lock:
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += os.path.getsize(path) - replaced
+            full = self._size > self.max_bytes
+        if full:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def _entries(self):
+        entries = []
+        for sub_dir in os.scandir(self.directory):
+            if sub_dir.is_dir():
+                entries.extend((e.stat().st_mtime, e.stat().st_size, e.path)
+                               for e in os.scandir(sub_dir.path) if e.name.endswith('.parquet'))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used entries until the cache fits into a size.
+
+        Args:
+            max_bytes (int, optional): Size to fit into, the limit of the cache by default
+        """
+
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            self._size = total
+
+    def summary(self):
+        """
+        Summarizes the use of the cache.
+
+        Returns:
+            dict: Hits, misses and evicted entries
+        """
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class ApiClient:
+    """
+    Reusable fetch client sharing one pooled HTTP session across all pages of a run.
+
+    Keep-alive connections save a TCP and TLS handshake per page, gzip is requested
+    explicitly and every request gets a timeout, so a stalled connection fails and
+    is retried instead of hanging the run. With a cache, the responses of closed
+    date ranges are served from disk.
+
+    Args:
+        pool_size (int): Maximum number of kept-alive connections, at least the number of fetch workers
+        timeout (tuple): Connect and read timeout in seconds
+        cache (ResponseCache, optional): Cache of the responses of closed date ranges
+        metrics (StageMetrics, optional): Measures the requests, the decoding and the cache reads
+        page_format (str): 'json' fetches the pages of trips as lists of records, 'csv' from the
+            CSV endpoint of the dataset, decoded straight into record batches, see decode_csv_page
+    """
+
+    def __init__(self, pool_size=10, timeout=(10, 120), cache=None, metrics=None, page_format='json'):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip'
+        self.timeout = timeout
+        self.stats = FetchStats()
+        self.cache = cache
+        self.metrics = metrics
+        self.page_format = page_format
+
+    def get(self, url, decoder=None):
+        """
+        Makes an API request through the shared session, see make_api_request.
+
+        Args:
+            url (str): The URL to make the request to
+            decoder (callable, optional): Decodes the response body, see make_api_request
+
+        Returns:
+            dict: JSON response from the API
+        """
+
+        return make_api_request(url, self.session, self.timeout, self.stats, self.metrics, decoder)
+
+    def fetch(self, base_url, params, end_date=None, decoder=None):
+        """
+        Makes an API request for a query, served from the cache if its date range is closed.
+
+        Args:
+            base_url (str): Base URL for the API endpoint
+            params (dict): Query parameters, e.g. from create_params
+            end_date (str, optional): End date of the queried range, the response isn't cached without it
+            decoder (callable, optional): Decodes the response body into a record batch instead of JSON
+
+        Returns:
+            dict: JSON response from the API, or the record batch of the decoder
+        """
+
+        url = f"{base_url}?{urlencode(params)}"
+        if self.cache is None or end_date is None or not self.cache.covers(end_date):
+            return self.get(url, decoder)
+        key = self.cache.key(base_url, params)
+        with measure(self.metrics, 'read_cache') as stage:
+            data = self.cache.get(key, as_batch=decoder is not None)
+            stage.rows = len(data) if data is not None else 0
+        if data is None:
+            data = self.get(url, decoder)
+            self.cache.put(key, data)
+        return data
+
+    def fetch_page(self, base_url, params, end_date=None):
+        """
+        Fetches a page of trips in the page format of the client.
+
+        Args:
+            base_url (str): Base URL of the JSON endpoint
+            params (dict): Query parameters, e.g. from create_params
+            end_date (str, optional): End date of the queried range, for the cache
+
+        Returns:
+            list: Records of the page, a pyarrow.RecordBatch in the 'csv' page format
+        """
+
+        if self.page_format == 'csv':
+            return self.fetch(csv_url(base_url), params, end_date, decode_csv_page)
+        return self.fetch(base_url, params, end_date)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def client_context(client=None, pool_size=10):
+    """
+    Lends a client to the requests of one call, a new one closed at the end of the call by default.
+
+    Args:
+        client (ApiClient, optional): Client of the caller, which stays open
+        pool_size (int): Maximum number of kept-alive connections of a new client
+
+    Returns:
+        contextlib.AbstractContextManager: Context manager yielding the client
+    """
+
+    return nullcontext(client) if client is not None else ApiClient(pool_size=pool_size)
+
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
     retry=retry_if_exception_type(RequestException)
 )
-def make_api_request(url):
+def make_api_request(url, session=None, timeout=None, stats=None, metrics=None, decoder=None):
     """
     Make an API request with retry logic.
 
     Args:
         url (str): The URL to make the request to
+        session (requests.Session, optional): Session to send the request with, a new connection otherwise
+        timeout (tuple, optional): Connect and read timeout in seconds
+        stats (FetchStats, optional): Collects the bytes and latency of the request
+        metrics (StageMetrics, optional): Measures the request and the decoding as the 'http' and 'decode_json' or 'decode_csv' stages
+        decoder (callable, optional): Decodes the response body instead of the JSON parser, e.g. decode_csv_page
 
     Returns:
-        dict: JSON response from the API
+        dict: JSON response from the API, or the result of the decoder
 
     Raises:
         RequestException: If the API request fails after all retry attempts
     """
     
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        started = time.perf_counter()
+        with measure(metrics, 'http') as stage:
+            response = (session or requests).get(url, timeout=timeout)
+            response.raise_for_status()
+            stage.bytes_read = response.raw.tell()
         logger.debug(f"Successful API request to: {url}")  # Added debug level logging for successful requests
-        return response.json()
+        with measure(metrics, 'decode_json' if decoder is None else 'decode_csv') as stage:
+            data = response.json() if decoder is None else decoder(response.content)
+            stage.rows, stage.bytes_read = len(data), len(response.content)
+        if stats is not None:
+            # tell() counts the bytes read from the socket, i.e. before decompression
+            stats.record(time.perf_counter() - started, response.raw.tell(), len(response.content))
+        return data
     except RequestException as e:
         # what else can be implemented here?
         logger.error(f"API request failed: {str(e)}", exc_info=True) # Included exc_info=True when logging exceptions to capture stack traces
         raise
 
 
+def create_where_clause(start_date, end_date):
+    """
+    Creates the SoQL filter selecting the trips picked up within a date range.
+
+    Args:
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+
+    Returns:
+        str: SoQL '$where' expression
+    """
+
+    return f"tpep_pickup_datetime >= '{start_date}' AND tpep_pickup_datetime <= '{end_date}'"
+
+
 def create_params(start_date, end_date, limit, offset):
     """
     Creates API request parameters for fetching taxi ride data.
@@ -55,162 +680,1901 @@ def create_params(start_date, end_date, limit, offset):
 
     return {
         '$select': 'tpep_pickup_datetime, tpep_dropoff_datetime', # duplications?
-        '$where': f"tpep_pickup_datetime >= '{start_date}' AND tpep_pickup_datetime <= '{end_date}'",
+        '$where': create_where_clause(start_date, end_date),
         '$limit': str(limit),
         '$offset': str(offset),
         '$order': 'tpep_pickup_datetime' # might not need to order
     }
 
 
-def process_response(data, all_data):
+def create_keyset_params(start_date, end_date, limit, after=None):
     """
-    Processes API response data and adds it to the collection.
+    Creates API request parameters for fetching the page of taxi ride data after a key.
+
+    The trips are ordered by pickup time and the row identifier ':id' of the
+    dataset, which breaks the ties of trips picked up at the same time. Each
+    page filters on the last key of the previous one instead of skipping the
+    previous pages with '$offset', so every page costs the service the same.
 
     Args:
-        data (list): New data received from the API
-        all_data (list): Existing collection of all data
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of records to retrieve per request
+        after (tuple, optional): Pickup time and ':id' of the last record already fetched
 
     Returns:
-        bool: False if no data received, True if data was successfully processed
+        dict: Dictionary containing API query parameters
     """
 
-    if not data:
-        return False
-    all_data.extend(data)
-    logger.info(f"Fetched {len(data)} records. Total records: {len(all_data)}")
-    return True
+    where = create_where_clause(start_date, end_date)
+    if after is not None:
+        pickup, row_id = after
+        where += (f" AND (tpep_pickup_datetime > '{pickup}'"
+                  f" OR (tpep_pickup_datetime = '{pickup}' AND :id > '{row_id}'))")
+    return {
+        '$select': 'tpep_pickup_datetime, tpep_dropoff_datetime, :id',
+        '$where': where,
+        '$limit': str(limit),
+        '$order': 'tpep_pickup_datetime, :id',
+    }
 
 
-def fetch_all_data(start_date, end_date, limit, base_url):
+def seconds_of_day(column):
     """
-    Retrieves all taxi ride data for a given date range using pagination.
+    Builds the SoQL expression for the seconds since midnight of a timestamp column.
 
     Args:
-        start_date (str): Start date for the data range
-        end_date (str): End date for the data range
-        limit (int): Maximum number of records per API request
-        base_url (str): Base URL for the API endpoint
+        column (str): Name of the timestamp column
 
     Returns:
-        list: Collection of all retrieved taxi ride data
-    
-    Raises:
-        RequestException: If API requests consistently fail
-        Exception: For other unexpected errors during data fetching
+        str: SoQL expression
     """
 
-    all_data = []
-    offset = 0
-
-    while True:
-        params = create_params(start_date, end_date, limit, offset)
-        url = f"{base_url}?{urlencode(params)}"
-
-        try:
-            data = make_api_request(url)
-            if not process_response(data, all_data):
-                logger.info("No more data to fetch")  # Added info log for normal completion
-                break
-            offset += len(data)
-        except Exception as e:
-            logger.error(f"Error fetching data: {str(e)}", exc_info=True)  # Added exc_info
-            break
-
-    return all_data
+    return f"date_extract_hh({column}) * 3600 + date_extract_mm({column}) * 60 + date_extract_ss({column})"
 
 
-def calculate_trip_length(df):
+def create_aggregate_params(start_date, end_date, limit, offset):
     """
-    Calculates trip duration in minutes for each taxi ride.
+    Creates API request parameters for fetching daily aggregates instead of raw trips.
+
+    SoQL has no function for the difference of two timestamps, so the trips are
+    grouped by pickup day and dropoff day, and the seconds since midnight of both
+    timestamps are summed per group. See aggregates_to_daily_trips for how the
+    summed trip durations are derived from these groups. Trips without a dropoff
+    are left out like in raw mode, count(*) would count them otherwise.
 
     Args:
-        df (pandas.DataFrame): DataFrame containing pickup and dropoff timestamps
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of groups to retrieve per request
+        offset (int): Number of groups to skip
 
     Returns:
-        pandas.DataFrame: DataFrame with added 'trip_length' column in minutes
+        dict: Dictionary containing API query parameters
     """
 
-    df['tpep_pickup_datetime'] = pd.to_datetime(df['tpep_pickup_datetime'])
-    df['tpep_dropoff_datetime'] = pd.to_datetime(df['tpep_dropoff_datetime'])
-    # get length of each trip 
-    df['trip_length'] = (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']).dt.total_seconds() / 60
-    return df
+    group = 'date_trunc_ymd(tpep_pickup_datetime), date_trunc_ymd(tpep_dropoff_datetime)'
+    return {
+        '$select': (
+            'date_trunc_ymd(tpep_pickup_datetime) AS pickup_day, '
+            'date_trunc_ymd(tpep_dropoff_datetime) AS dropoff_day, '
+            'count(*) AS trip_count, '
+            f"sum({seconds_of_day('tpep_pickup_datetime')}) AS pickup_seconds, "
+            f"sum({seconds_of_day('tpep_dropoff_datetime')}) AS dropoff_seconds"
+        ),
+        '$where': f"{create_where_clause(start_date, end_date)} AND tpep_dropoff_datetime IS NOT NULL",
+        '$group': group,
+        '$limit': str(limit),
+        '$offset': str(offset),
+        '$order': group
+    }
 
 
-def aggregate_daily_trips(df):
+def create_count_params(start_date, end_date):
     """
-    Aggregates trip data by date and calculates daily total trip times.
+    Creates API request parameters for counting the taxi rides in a date range.
 
     Args:
-        df (pandas.DataFrame): DataFrame containing trip data
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
 
     Returns:
-        pandas.DataFrame: Daily summary with total trip times in hours
+        dict: Dictionary containing API query parameters
     """
 
-    daily_summary = df.groupby(df['tpep_pickup_datetime'].dt.date)['trip_length'].sum().reset_index()
-    daily_summary['daily_trip_time (in hours)'] = (daily_summary['trip_length'] / 60).round(1)
-    daily_summary.drop('trip_length', axis=1, inplace=True)
-    daily_summary['tpep_pickup_datetime'] = pd.to_datetime(daily_summary['tpep_pickup_datetime'])
-    return daily_summary    
+    return {
+        '$select': 'count(*) AS count',
+        '$where': create_where_clause(start_date, end_date)
+    }
 
 
-def calculate_rolling_average(df, window):
+def count_records(start_date, end_date, base_url, client=None):
     """
-    Calculates rolling average of daily trip times.
+    Counts the taxi rides available for a given date range.
 
     Args:
-        df (pandas.DataFrame): DataFrame containing daily trip summaries
-        window (int): Size of the rolling window in days
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        base_url (str): Base URL for the API endpoint
+        client (ApiClient, optional): Client sending the request
 
     Returns:
-        pandas.DataFrame: DataFrame with added rolling average column
+        int: Number of records matching the date range
+
+    Raises:
+        RequestException: If the API request fails after all retry attempts
     """
 
-    df['rolling_average'] = df['daily_trip_time (in hours)'].rolling(window=window, min_periods=1).mean().round(1)
-    return df    
+    params = create_count_params(start_date, end_date)
+    with client_context(client) as client:
+        data = client.fetch(base_url, params, end_date)
+    return int(data[0]['count']) if data else 0
 
 
-def process_taxi_data(df, choice): # single responsibility might be important
+def process_response(data, all_data):
     """
-    Processes taxi data and calculates statistics based on user choice.
+    Processes API response data and adds it to the collection.
 
     Args:
-        df (pandas.DataFrame): Raw taxi ride data
-        choice (int): Processing option (1 for mean calculation, 2 for rolling average)
+        data (list): New data received from the API
+        all_data (list): Existing collection of all data
 
     Returns:
-        tuple: (trip_lengths DataFrame, daily_summary DataFrame, mean_calculation)
+        bool: False if no data received, True if data was successfully processed
     """
 
-    trip_lengths = calculate_trip_length(df)
-    daily_summary = aggregate_daily_trips(trip_lengths)
-    # this is not preffered (with choices)
-    if choice == 1:
-        mean_calculation = daily_summary['daily_trip_time (in hours)'].mean()
-    if choice == 2:
-        mean_calculation = calculate_rolling_average(daily_summary, 45)
-    return trip_lengths, daily_summary, mean_calculation
+    if not data:
+        return False
+    all_data.extend(data)
+    logger.info(f"Fetched {len(data)} records. Total records: {len(all_data)}")
+    return True
 
 
-def read_parquet_file(file_path):
+def fetch_all_data(start_date, end_date, limit, base_url, workers=1, client=None):
     """
-    Reads a Parquet file into a pandas DataFrame.
+    Retrieves all taxi ride data for a given date range using pagination.
+
+    With more than one worker the rows of the range are counted first and the
+    pages are fetched concurrently, see fetch_all_data_concurrently.
 
     Args:
-        file_path (str): Path to the Parquet file
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of records per API request
+        base_url (str): Base URL for the API endpoint
+        workers (int): Number of pages fetched at the same time
+        client (ApiClient, optional): Client shared by all requests, a new one closed at the end by default
 
     Returns:
-        pandas.DataFrame: DataFrame containing the Parquet file data
-
+        list: Collection of all retrieved taxi ride data
+    
     Raises:
-        FileNotFoundError: If the specified file doesn't exist
-        ArrowIOError: If there's an error reading the Parquet file
-        Exception: For other unexpected errors
+        RequestException: If API requests consistently fail
+        Exception: For other unexpected errors during data fetching
     """
 
-    try:
-        df = pd.read_parquet(file_path, engine='pyarrow')
+    with client_context(client, max(10, workers)) as client:
+        if workers > 1:
+            return fetch_all_data_concurrently(start_date, end_date, limit, base_url, workers, client)
+
+        all_data = []
+        offset = 0
+
+        while True:
+            params = create_params(start_date, end_date, limit, offset)
+
+            try:
+                data = client.fetch(base_url, params, end_date)
+                if not process_response(data, all_data):
+                    logger.info("No more data to fetch")  # Added info log for normal completion
+                    break
+                offset += len(data)
+            except Exception as e:
+                logger.error(f"Error fetching data: {str(e)}", exc_info=True)  # Added exc_info
+                break
+
+        return all_data
+
+
+def fetch_all_data_concurrently(start_date, end_date, limit, base_url, workers, client=None):
+    """
+    Retrieves all taxi ride data for a given date range with a bounded pool of threads.
+
+    Args:
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of records per API request
+        base_url (str): Base URL for the API endpoint
+        workers (int): Maximum number of concurrent requests
+        client (ApiClient, optional): Client shared by all requests
+
+    Returns:
+        list: Collection of all retrieved taxi ride data
+    """
+
+    all_data = []
+    try:
+        for data in iter_pages(start_date, end_date, limit, base_url, workers, client=client):
+            process_response(data, all_data)
+    except Exception as e:
+        # the pages fetched before the failing one are kept, like in the sequential loop
+        logger.error(f"Error fetching data: {str(e)}", exc_info=True)
+
+    return all_data
+
+
+def iter_pages(start_date, end_date, limit, base_url, workers=1, params_builder=create_params, client=None, start_offset=0):
+    """
+    Yields the pages of taxi ride data for a given date range in pickup order.
+
+    With more than one worker the rows of the range are counted up front so that
+    every page offset is known, and at most 'workers' pages are requested at a
+    time. Each page keeps the retry policy of make_api_request. Only the pages in
+    flight are held in memory, so a consumer that writes every page away keeps
+    the memory bounded by a few pages regardless of the size of the range.
+
+    Args:
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of records per API request
+        base_url (str): Base URL for the API endpoint
+        workers (int): Maximum number of concurrent requests
+        params_builder (callable): Builds the query parameters of a page, e.g.
+            create_aggregate_params. Concurrent fetching needs create_params,
+            since the page offsets are derived from the number of trips.
+        client (ApiClient, optional): Client shared by all requests, a new one closed at the end by default
+        start_offset (int): Number of records of the range to skip, e.g. the ones committed by an interrupted run
+
+    Yields:
+        list: Records of one page, a pyarrow.RecordBatch if the client fetches CSV pages
+
+    Raises:
+        RequestException: If a page fails after all retry attempts
+    """
+
+    with client_context(client, max(10, workers)) as client:
+        # the trips come in the page format of the client, the aggregates always as JSON
+        fetch = client.fetch_page if params_builder is create_params else client.fetch
+
+        def fetch_page(offset):
+            params = params_builder(start_date, end_date, limit, offset)
+            return fetch(base_url, params, end_date)
+
+        if workers <= 1 or params_builder is not create_params:
+            offset = start_offset
+            while True:
+                data = fetch_page(offset)
+                if not data:
+                    return
+                yield data
+                offset += len(data)
+
+        total = count_records(start_date, end_date, base_url, client)
+        logger.info(f"Fetching {total} records with {workers} concurrent workers")
+        offsets = iter(range(start_offset, total, limit))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque(executor.submit(fetch_page, offset) for offset in islice(offsets, workers))
+            try:
+                while in_flight:
+                    data = in_flight.popleft().result()
+                    if not data:
+                        break
+                    next_offset = next(offsets, None)
+                    if next_offset is not None:
+                        in_flight.append(executor.submit(fetch_page, next_offset))
+                    yield data
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+
+def iter_pages_by_key(start_date, end_date, limit, base_url, client=None, after=None):
+    """
+    Yields the pages of taxi ride data for a given date range using keyset pagination.
+
+    Every page starts after the pickup time and ':id' of the last record of the
+    previous one, see create_keyset_params. Since a page depends on the one
+    before, the pages are fetched one at a time.
+
+    Args:
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of records per API request
+        base_url (str): Base URL for the API endpoint
+        client (ApiClient, optional): Client shared by all requests, a new one closed at the end by default
+        after (tuple, optional): Key of the last record already fetched, e.g. by an interrupted run
+
+    Yields:
+        list: Records of one page including their ':id', a pyarrow.RecordBatch if the client fetches CSV pages
+
+    Raises:
+        RequestException: If a page fails after all retry attempts
+    """
+
+    with client_context(client) as client:
+        while True:
+            params = create_keyset_params(start_date, end_date, limit, after)
+            data = client.fetch_page(base_url, params, end_date)
+            if not data:
+                return
+            yield data
+            after = page_last_key(data)
+
+
+def csv_url(base_url):
+    """
+    Derives the CSV endpoint of the dataset, e.g. .../4b4i-vvec.csv from .../4b4i-vvec.json.
+
+    Args:
+        base_url (str): Base URL of the JSON endpoint
+
+    Returns:
+        str: Base URL of the CSV endpoint
+    """
+
+    return re.sub(r'\.json$', '', base_url) + '.csv'
+
+
+def decode_csv_page(body):
+    """
+    Parses a page of trips in the CSV format of the API straight into Arrow columns.
+
+    The timestamps are parsed by the Arrow CSV reader into TRIP_SCHEMA types, so
+    no Python object is created per record. Missing timestamps become nulls.
+
+    Args:
+        body (bytes): Response body, a header line and one line per trip
+
+    Returns:
+        pyarrow.RecordBatch: The TRIP_SCHEMA columns, followed by ':id' if it was selected
+    """
+
+    if not body.strip():
+        return page_to_record_batch([])
+    table = pv.read_csv(
+        pa.BufferReader(body),
+        read_options=pv.ReadOptions(use_threads=False),
+        convert_options=pv.ConvertOptions(column_types=CSV_COLUMN_TYPES),
+    )
+    return table_to_record_batch(table)
+
+
+def table_to_record_batch(table):
+    batches = table.combine_chunks().to_batches()
+    return batches[0] if batches else pa.RecordBatch.from_pylist([], schema=table.schema)
+
+
+def page_last_key(data):
+    """
+    Reads the keyset pagination key of the last record of a page.
+
+    Args:
+        data (list): Records of one page, or a pyarrow.RecordBatch
+
+    Returns:
+        tuple: (pickup timestamp formatted like the API, ':id' or None if it wasn't selected)
+    """
+
+    if isinstance(data, pa.RecordBatch):
+        pickup = data.column('tpep_pickup_datetime').slice(len(data) - 1).to_numpy(zero_copy_only=False)[0]
+        row_id = data.column(':id')[-1].as_py() if ':id' in data.schema.names else None
+        return np.datetime_as_string(pickup, unit='ms'), row_id
+    return data[-1]['tpep_pickup_datetime'], data[-1].get(':id')
+
+
+def page_to_record_batch(data):
+    """
+    Converts a page of API records into a typed Arrow record batch.
+
+    Args:
+        data (list): Records of one page, or a record batch from decode_csv_page
+
+    Returns:
+        pyarrow.RecordBatch: Batch following TRIP_SCHEMA
+    """
+
+    if isinstance(data, pa.RecordBatch):
+        return pa.RecordBatch.from_arrays([data.column(field.name) for field in TRIP_SCHEMA], schema=TRIP_SCHEMA)
+    columns = [
+        pa.array([record.get(field.name) for record in data], pa.string()).cast(field.type)
+        for field in TRIP_SCHEMA
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=TRIP_SCHEMA)
+
+
+def duplicated_pairs(pickup, dropoff):
+    """
+    Marks every repetition of a (pickup, dropoff) pair after its first occurrence.
+
+    Pages come in pickup order, so the pairs are usually grouped by pickup time
+    already: the rank of the pickup time and the trip duration are then packed
+    into one int64 key whose stable sort is cheap on nearly sorted input. Pages
+    in any other order fall back to a lexicographic sort.
+
+    Args:
+        pickup (numpy.ndarray): int64 pickup timestamps in nanoseconds
+        dropoff (numpy.ndarray): int64 dropoff timestamps in nanoseconds
+
+    Returns:
+        numpy.ndarray: Boolean mask of the repeated pairs
+    """
+
+    duplicated = np.zeros(len(pickup), dtype=bool)
+    if len(pickup) < 2:
+        return duplicated
+    order = None
+    if (pickup[1:] >= pickup[:-1]).all():
+        new_pickup = pickup[1:] != pickup[:-1]
+        if new_pickup.all():
+            return duplicated
+        rank = np.concatenate([[0], np.cumsum(new_pickup)])
+        duration = dropoff - pickup
+        duration -= duration.min()
+        shift = int(duration.max()).bit_length()
+        if int(rank[-1]).bit_length() + shift < 63:
+            order = np.argsort((rank << shift) | duration, kind='stable')
+    if order is None:
+        order = np.lexsort((dropoff, pickup))
+    pickup, dropoff = pickup[order], dropoff[order]
+    repeated = (pickup[1:] == pickup[:-1]) & (dropoff[1:] == dropoff[:-1])
+    duplicated[order[1:][repeated]] = True
+    return duplicated
+
+
+class TripValidator:
+    """
+    Vectorized validation of the fetched trips before they are stored.
+
+    Every record batch is checked against the rules in one pass of array
+    comparisons, each rejected trip is counted for the first rule it breaks:
+    'missing_timestamp', 'outside_window' (pickup outside the requested range),
+    'too_short' and 'too_long' (duration bounds) and 'duplicate' (a repeated
+    pickup and dropoff pair). Duplicates are found within a batch and across
+    the boundaries of consecutive batches, as the pages come in pickup order.
+    With a rejects path the rejected trips are quarantined there together with
+    their reason, otherwise they are only counted and dropped. The rejects of
+    every batch are staged as a file of their own until close, so that an
+    interrupted ingest can keep the ones of its committed pages, see resume.
+
+    Args:
+        start_date (str, optional): First pickup timestamp of the requested range
+        end_date (str, optional): Last pickup timestamp of the requested range
+        min_trip_seconds (float, optional): Shortest valid trip, 0 rejects dropoffs before the pickup
+        max_trip_seconds (float, optional): Longest valid trip, e.g. a day to reject multi-day trips
+        deduplicate (bool): Reject repeated (pickup, dropoff) pairs
+        rejects_path (str, optional): Parquet file of the quarantined trips
+    """
+
+    def __init__(self, start_date=None, end_date=None, min_trip_seconds=0, max_trip_seconds=86_400,
+                 deduplicate=True, rejects_path=None):
+        self.start = None if start_date is None else pd.Timestamp(start_date).value
+        self.end = None if end_date is None else pd.Timestamp(end_date).value
+        self.min_duration = None if min_trip_seconds is None else int(min_trip_seconds * 1_000_000_000)
+        self.max_duration = None if max_trip_seconds is None else int(max_trip_seconds * 1_000_000_000)
+        self.deduplicate = deduplicate
+        self.rejects_path = rejects_path
+        self.checked = 0
+        self.rejected = dict.fromkeys(REJECT_REASONS, 0)
+        # number of validated batches, the staged rejects are numbered by batch
+        self.batches = 0
+        self._staging = None if rejects_path is None else f"{rejects_path}.pages"
+        self._owns_staging = True
+        self._closed = False
+        # the pairs picked up at the latest pickup time so far, which the next batch may repeat
+        self._last_pickup = None
+        self._last_pairs = set()
+
+    def validate(self, batch):
+        """
+        Checks a record batch of trips and quarantines the rejected ones.
+
+        Args:
+            batch (pyarrow.RecordBatch): Trips following TRIP_SCHEMA
+
+        Returns:
+            pyarrow.RecordBatch: The valid trips
+        """
+
+        pickup = batch.column(0).to_numpy(zero_copy_only=False).view('int64')
+        dropoff = batch.column(1).to_numpy(zero_copy_only=False).view('int64')
+        reasons = np.zeros(len(pickup), dtype='int8')
+
+        def reject(mask, reason):
+            reasons[mask & (reasons == 0)] = REJECT_REASONS.index(reason) + 1
+
+        nat = np.iinfo('int64').min
+        reject((pickup == nat) | (dropoff == nat), 'missing_timestamp')
+        if self.start is not None:
+            reject(pickup < self.start, 'outside_window')
+        if self.end is not None:
+            reject(pickup > self.end, 'outside_window')
+        duration = dropoff - pickup
+        if self.min_duration is not None:
+            reject(duration < self.min_duration, 'too_short')
+        if self.max_duration is not None:
+            reject(duration > self.max_duration, 'too_long')
+        if self.deduplicate:
+            self._reject_duplicates(pickup, dropoff, reasons)
+
+        self.checked += batch.num_rows
+        self.batches += 1
+        if not reasons.any():
+            return batch
+        counts = np.bincount(reasons, minlength=len(REJECT_REASONS) + 1)
+        for reason, count in zip(REJECT_REASONS, counts[1:]):
+            self.rejected[reason] += int(count)
+        if self.rejects_path is not None:
+            rejected = reasons > 0
+            names = pa.array(np.array(REJECT_REASONS)[reasons[rejected] - 1]).dictionary_encode()
+            rejects = batch.filter(pa.array(rejected)).append_column('reject_reason', names)
+            os.makedirs(self._staging, exist_ok=True)
+            pq.write_table(pa.Table.from_batches([rejects]), self._staged_path(self.batches - 1))
+        return batch.filter(pa.array(reasons == 0))
+
+    def _staged_path(self, number):
+        return os.path.join(self._staging, f"part-{number:05d}.parquet")
+
+    def state(self):
+        """
+        Captures the counts and the deduplication state, to be stored with the checkpoint of a page.
+
+        Returns:
+            dict: JSON serializable state, see resume
+        """
+
+        return {
+            'checked': self.checked,
+            'rejected': dict(self.rejected),
+            'batches': self.batches,
+            'last_pickup': None if self._last_pickup is None else int(self._last_pickup),
+            'last_pairs': sorted(self._last_pairs),
+        }
+
+    def resume(self, staging, state=None):
+        """
+        Stages the rejects in the directory of an ingest and continues the validation of an interrupted one.
+
+        The rejects of the batches validated before the interruption stay
+        staged, the ones of batches after the last committed state are dropped,
+        and the counts and the pairs of the deduplication carry over. Without a
+        state the staged rejects of an earlier ingest are dropped.
+
+        Args:
+            staging (str): Directory of the staged rejects, removed by the ingest once it completes
+            state (dict, optional): Result of state when the last page was committed
+        """
+
+        self._staging, self._owns_staging = staging, False
+        if state is None:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.checked, self.rejected, self.batches = state['checked'], dict(state['rejected']), state['batches']
+        self._last_pickup = state['last_pickup']
+        self._last_pairs = {tuple(pair) for pair in state['last_pairs']}
+        for name in os.listdir(staging) if os.path.isdir(staging) else []:
+            number = re.fullmatch(r'part-(\d+)\.parquet', name)
+            if number is None or int(number.group(1)) >= self.batches:
+                os.remove(os.path.join(staging, name))
+
+    def _reject_duplicates(self, pickup, dropoff, reasons):
+        candidates = np.flatnonzero(reasons == 0)
+        if not len(candidates):
+            return
+        pickup, dropoff = pickup[candidates], dropoff[candidates]
+        duplicated = duplicated_pairs(pickup, dropoff)
+        if self._last_pickup is not None:
+            for i in np.flatnonzero(pickup == self._last_pickup):
+                duplicated[i] |= (int(pickup[i]), int(dropoff[i])) in self._last_pairs
+        reasons[candidates[duplicated]] = REJECT_REASONS.index('duplicate') + 1
+
+        latest = pickup.max()
+        pairs = {(int(latest), int(d)) for d in dropoff[pickup == latest]}
+        if latest == self._last_pickup:
+            self._last_pairs |= pairs
+        elif self._last_pickup is None or latest > self._last_pickup:
+            self._last_pickup, self._last_pairs = latest, pairs
+
+    def close(self):
+        """
+        Writes the staged rejects to the rejects file, which replaces the one of a previous run atomically.
+
+        Only the first call writes it. After a failed ingest it holds the
+        rejects validated so far, which stay staged for the resumed ingest.
+        """
+
+        if self._closed or self.rejects_path is None:
+            return
+        self._closed = True
+        paths = [self._staged_path(number) for number in range(self.batches)]
+        tables = [pq.read_table(path) for path in paths if os.path.exists(path)]
+        if tables:
+            os.makedirs(os.path.dirname(self.rejects_path) or '.', exist_ok=True)
+            pq.write_table(pa.concat_tables(tables), f"{self.rejects_path}.tmp")
+            os.replace(f"{self.rejects_path}.tmp", self.rejects_path)
+        elif os.path.exists(self.rejects_path):
+            # nothing was rejected this time
+            os.remove(self.rejects_path)
+        if self._owns_staging:
+            shutil.rmtree(self._staging, ignore_errors=True)
+
+    def summary(self):
+        """
+        Summarizes the validation.
+
+        Returns:
+            dict: Number of checked trips and the rejected ones per rule
+        """
+
+        return {'checked': self.checked, 'rejected': dict(self.rejected)}
+
+
+def partition_path(root, day):
+    """
+    Builds the directory of the partition holding the trips of a pickup day.
+
+    Args:
+        root (str): Root directory of the dataset
+        day (numpy.datetime64): Pickup day
+
+    Returns:
+        str: Path of the partition directory
+    """
+
+    return os.path.join(root, f"pickup_date={np.datetime_as_string(day, unit='D')}")
+
+
+def sort_by_pickup(table):
+    """
+    Sorts trips by their pickup time, missing ones last, unless they already are sorted.
+
+    Args:
+        table (pyarrow.Table): Trips following TRIP_SCHEMA in a single chunk
+
+    Returns:
+        pyarrow.Table: The table itself or its sorted copy
+    """
+
+    pickup = table.column(0).cast(pa.int64())
+    if pickup.null_count or (len(table) > 1 and not pc.all(pc.greater_equal(pickup[1:], pickup[:-1])).as_py()):
+        return table.take(pc.sort_indices(table, [('tpep_pickup_datetime', 'ascending')], null_placement='at_end'))
+    return table
+
+
+def to_stored_table(trips):
+    """
+    Converts trips to the layout of the stored files, see STORED_SCHEMA.
+
+    The trips are sorted by pickup time, so the min/max statistics of the row
+    groups are tight, and the dropoff becomes the whole seconds after the
+    pickup. Trips whose dropoff doesn't fit that, e.g. a fraction of a second
+    or a missing pickup, keep the dropoff timestamp for the whole table.
+
+    Args:
+        trips (pyarrow.Table): Trips following TRIP_SCHEMA, or a record batch
+
+    Returns:
+        pyarrow.Table: Pickup and dropoff offset, or pickup and dropoff timestamp
+    """
+
+    table = pa.Table.from_batches([trips]) if isinstance(trips, pa.RecordBatch) else trips
+    table = sort_by_pickup(table.select(TRIP_SCHEMA.names).combine_chunks())
+    pickup = table.column(0).cast(pa.int64())
+    dropoff = table.column(1).cast(pa.int64())
+    nanoseconds = pc.subtract(dropoff, pickup)
+    valid = pc.is_valid(nanoseconds).to_numpy(zero_copy_only=False)
+    values = pc.fill_null(nanoseconds, 0).to_numpy()
+    seconds = values // 1_000_000_000
+    fits = (pc.count(dropoff).as_py() == valid.sum() and not (values % 1_000_000_000).any()
+            and (seconds.min(initial=0) >= -2**31) and (seconds.max(initial=0) < 2**31))
+    if not fits:
+        return table
+    offset = pa.array(seconds.astype('int32'), mask=~valid)
+    return pa.table([table.column(0), offset], names=['tpep_pickup_datetime', DROPOFF_OFFSET])
+
+
+def write_trip_file(trips, path):
+    """
+    Writes trips as a file of the trip dataset, see to_stored_table.
+
+    The row groups hold ROW_GROUP_SIZE trips with min/max statistics, so filtered
+    reads skip the ones outside the range. The sorted pickups are delta encoded,
+    stored in milliseconds like the API timestamps when that doesn't lose
+    anything, the dropoff offsets are dictionary encoded and all of it is zstd
+    compressed.
+
+    Args:
+        trips (pyarrow.Table): Trips following TRIP_SCHEMA, or a record batch
+        path (str): Path of the Parquet file
+    """
+
+    table = to_stored_table(trips)
+    timestamps = [name for name in table.column_names if name != DROPOFF_OFFSET]
+    sub_millisecond = any(
+        (pc.fill_null(table.column(name).cast(pa.int64()), 0).to_numpy() % 1_000_000).any() for name in timestamps
+    )
+    pq.write_table(
+        table, path,
+        row_group_size=ROW_GROUP_SIZE,
+        compression='zstd',
+        coerce_timestamps=None if sub_millisecond else 'ms',
+        use_dictionary=[DROPOFF_OFFSET] if DROPOFF_OFFSET in table.column_names else False,
+        column_encoding={name: 'DELTA_BINARY_PACKED' for name in timestamps},
+        write_statistics=True,
+    )
+
+
+def staged_days(staging):
+    """
+    Lists the day directories in the staging directory of the dataset, without the staged rejects.
+
+    Args:
+        staging (str): Staging directory below the root of the dataset
+
+    Returns:
+        list: Names of the day directories in order
+    """
+
+    return sorted(name for name in os.listdir(staging) if not name.startswith('_'))
+
+
+def compact_partition(day_dir):
+    """
+    Rewrites the files of a partition as one file sorted by pickup time.
+
+    A day with several files has them merged: the merged file is written under
+    a temporary name and renamed to compacted.parquet before the files it
+    merges are removed, so the day always holds either its original files or
+    the merged one, see recover_staged_day. The merged file is then renamed to
+    part-00000.parquet.
+
+    A day with a single file keeps it unchanged under its page name, e.g.
+    part-00003.parquet, since write_trip_file already sorted it. Only if that
+    file is the compacted.parquet of an interrupted compaction is it renamed to
+    part-00000.parquet.
+
+    Args:
+        day_dir (str): Directory of the partition
+    """
+
+    names = sorted(name for name in os.listdir(day_dir) if name.endswith('.parquet'))
+    compacted_path = os.path.join(day_dir, 'compacted.parquet')
+    if len(names) > 1:
+        paths = [os.path.join(day_dir, name) for name in names]
+        trips = ds.dataset(paths, schema=STORED_SCHEMA, format='parquet').to_table(columns=trip_columns())
+        tmp_path = os.path.join(day_dir, '_compacted.tmp')
+        write_trip_file(trips, tmp_path)
+        os.replace(tmp_path, compacted_path)
+        for path in paths:
+            if path != compacted_path:
+                os.remove(path)
+    if os.path.exists(compacted_path):
+        os.replace(compacted_path, os.path.join(day_dir, 'part-00000.parquet'))
+
+
+def recover_staged_day(day_dir, first_page):
+    """
+    Drops the files of a staged day that an interrupted ingest left behind.
+
+    Those are the files of the pages after the last committed one, a merged
+    file that was still being written and, once the merged file of a
+    compaction was complete, the files it merged, see compact_partition.
+
+    Args:
+        day_dir (str): Staged directory of the day
+        first_page (int): Number of the first page that wasn't committed
+    """
+
+    names = os.listdir(day_dir)
+    compacted = 'compacted.parquet' in names
+    for name in names:
+        page = re.fullmatch(r'part-(\d+)\.parquet', name)
+        if name != 'compacted.parquet' and (page is None or compacted or int(page.group(1)) >= first_page):
+            os.remove(os.path.join(day_dir, name))
+
+
+def trip_columns():
+    """
+    Projects the stored files of either layout onto TRIP_SCHEMA, for the scans of the trip dataset.
+
+    Returns:
+        dict: Column expressions by name
+    """
+
+    pickup = ds.field('tpep_pickup_datetime')
+    offset = ds.field(DROPOFF_OFFSET).cast(pa.int64()).cast(pa.duration('s'))
+    return {'tpep_pickup_datetime': pickup, 'tpep_dropoff_datetime': pc.coalesce(ds.field('tpep_dropoff_datetime'), pickup + offset)}
+
+
+def checkpoint_path(root):
+    """
+    Builds the path of the ingest checkpoint of a dataset.
+
+    Args:
+        root (str): Root directory of the dataset
+
+    Returns:
+        str: Path of the checkpoint file, ignored by the dataset discovery
+    """
+
+    return os.path.join(root, '_checkpoint.json')
+
+
+def read_checkpoint(root):
+    """
+    Reads the checkpoint of an interrupted ingest.
+
+    Args:
+        root (str): Root directory of the dataset
+
+    Returns:
+        dict: The checkpoint, None if no ingest was interrupted
+    """
+
+    try:
+        with open(checkpoint_path(root)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(root, checkpoint):
+    """
+    Atomically replaces the checkpoint of the ingest in progress.
+
+    Args:
+        root (str): Root directory of the dataset
+        checkpoint (dict): Query of the ingest and the progress committed so far
+    """
+
+    path = checkpoint_path(root)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+def write_pages_to_dataset(pages, root, checkpoint=None, validator=None, metrics=None, publish_lock=None):
+    """
+    Streams pages of API records into the date-partitioned trip dataset.
+
+    Every page is split by pickup day and written as one file per day into a
+    staging directory below the root, which the dataset discovery ignores. Once
+    all pages were written, each staged day replaces the partition of the same
+    day, so re-fetching a range is idempotent and the partitions of other days
+    are never read or rewritten. The pages have to hold whole days, since a
+    replaced partition only contains the trips of the latest fetch, which is
+    why ingest_range rejects other date ranges. Trips without a pickup time
+    have no day and are dropped with a warning.
+
+    With a checkpoint, a page is committed by recording the records written so
+    far and the key of its last record (the watermark) in the checkpoint file after
+    its files were written. A failed ingest then keeps the staged pages, and an
+    ingest resumed from the checkpoint drops the files of uncommitted pages and
+    continues the page numbering, see ingest_range. The rejects of the
+    validator are staged next to the pages and its state is committed with
+    them, so the resumed ingest keeps the rejects and counts of the
+    interrupted one, see TripValidator.resume.
+
+    Args:
+        pages (iterable): Pages of API records, e.g. from iter_pages
+        root (str): Root directory of the dataset
+        checkpoint (dict, optional): Progress of the ingest, from read_checkpoint
+            when resuming, it is updated and persisted after every page
+        validator (TripValidator, optional): Drops or quarantines invalid trips before they are written
+        metrics (StageMetrics, optional): Measures the 'convert', 'validate' and 'write_parquet' stages of every page
+        publish_lock (threading.Lock, optional): Held while the staged days replace the partitions, so
+            that scans of the dataset holding it in another thread never list a partition being replaced
+
+    Returns:
+        int: Number of rows written from the pages
+    """
+
+    staging = os.path.join(root, '_staging')
+    first_page = checkpoint['pages'] if checkpoint else 0
+    if first_page:
+        for day_dir in staged_days(staging):
+            day_dir = os.path.join(staging, day_dir)
+            recover_staged_day(day_dir, first_page)
+            if not os.listdir(day_dir):
+                os.rmdir(day_dir)
+    else:
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+    if validator is not None:
+        validator.resume(os.path.join(staging, '_rejects'), checkpoint.get('validation') if first_page else None)
+    rows = 0
+    try:
+        for page_number, data in enumerate(pages, first_page):
+            with measure(metrics, 'convert') as stage:
+                batch = page_to_record_batch(data)
+                stage.rows = fetched = batch.num_rows
+            if validator is not None:
+                with measure(metrics, 'validate') as stage:
+                    batch = validator.validate(batch)
+                    stage.rows = fetched
+            if batch.column(0).null_count:
+                # without a pickup a trip has no partition, the validator quarantines them instead when it is enabled
+                logger.warning(f"Dropping {batch.column(0).null_count} records without a pickup time from page {page_number}")
+                batch = batch.filter(pc.is_valid(batch.column(0)))
+            with measure(metrics, 'write_parquet') as stage:
+                days = batch.column(0).to_numpy(zero_copy_only=False).astype('datetime64[D]')
+                for day in np.unique(days):
+                    day_dir = partition_path(staging, day)
+                    os.makedirs(day_dir, exist_ok=True)
+                    part = pa.Table.from_batches([batch.filter(pa.array(days == day))])
+                    part_path = os.path.join(day_dir, f"part-{page_number:05d}.parquet")
+                    write_trip_file(part, part_path)
+                    stage.bytes_written += os.path.getsize(part_path)
+                stage.rows = batch.num_rows
+            rows += batch.num_rows
+            if checkpoint is not None:
+                watermark, last_id = page_last_key(data)
+                checkpoint.update(
+                    pages=page_number + 1,
+                    offset=checkpoint['offset'] + fetched,
+                    rows=checkpoint['rows'] + batch.num_rows,
+                    watermark=watermark,
+                    last_id=last_id,
+                )
+                if validator is not None:
+                    checkpoint['validation'] = validator.state()
+                write_checkpoint(root, checkpoint)
+            logger.info(f"Wrote {batch.num_rows} records. Total records: {rows}")
+    except Exception:
+        if checkpoint is not None:
+            logger.error(f"Writing to {root} failed after {checkpoint['offset']} records, the next run resumes from there", exc_info=True)
+        else:
+            logger.error(f"Writing to {root} failed, the existing partitions were left untouched", exc_info=True)
+            shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    day_dirs = staged_days(staging)
+    for day_dir in day_dirs:
+        compact_partition(os.path.join(staging, day_dir))
+    with publish_lock or nullcontext():
+        for day_dir in day_dirs:
+            live_dir = os.path.join(root, day_dir)
+            if os.path.exists(live_dir):
+                logger.info(f"Replacing partition {day_dir}")
+                shutil.rmtree(live_dir)
+            os.replace(os.path.join(staging, day_dir), live_dir)
+    if validator is not None:
+        validator.close()
+    if checkpoint is not None:
+        os.remove(checkpoint_path(root))
+    shutil.rmtree(staging)
+    return rows
+
+
+def covers_whole_days(start_date, end_date):
+    """
+    Checks that a date range starts at midnight and ends with the last second of a day.
+
+    Args:
+        start_date (str): Start date of the range
+        end_date (str): End date of the range, inclusive
+
+    Returns:
+        bool: Whether the range only holds whole days
+    """
+
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    return start == start.normalize() and end.floor('s') == end.normalize() + pd.Timedelta(days=1, seconds=-1)
+
+
+def ingest_range(start_date, end_date, limit, base_url, root, workers=1, client=None, pagination='offset', validator=None, metrics=None,
+                 publish_lock=None):
+    """
+    Fetches the trips of a date range into the dataset, resuming an interrupted ingest of the same range.
+
+    The progress is checkpointed after every page, so when a run fails, e.g.
+    because the API stays unreachable or the pod is evicted, the next run of
+    the same range only fetches the records after the last committed page
+    instead of the whole range. The checkpoint of a different range is
+    discarded together with its staged pages. With keyset pagination the run
+    resumes after the key of the last committed record, otherwise after the
+    number of committed records.
+
+    Args:
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of records per API request
+        base_url (str): Base URL for the API endpoint
+        root (str): Root directory of the dataset
+        workers (int): Number of pages fetched at the same time
+        client (ApiClient, optional): Client shared by all requests
+        pagination (str): 'offset' pages with '$offset', 'keyset' with iter_pages_by_key
+        validator (TripValidator, optional): Drops or quarantines invalid trips before they are written
+        metrics (StageMetrics, optional): Measures the stages of writing the pages, see write_pages_to_dataset
+        publish_lock (threading.Lock, optional): Held while the fetched days are published, see write_pages_to_dataset
+
+    Returns:
+        int: Number of records of the range written to the dataset, including the ones of the interrupted run
+
+    Raises:
+        ValueError: If the range doesn't cover whole days, see write_pages_to_dataset
+    """
+
+    if not covers_whole_days(start_date, end_date):
+        raise ValueError(f"The range {start_date} - {end_date} doesn't cover whole days, ingesting it would "
+                         f"replace the partitions of its first and last day with a part of their trips")
+    query = {'base_url': base_url, 'start_date': start_date, 'end_date': end_date, 'pagination': pagination}
+    checkpoint = read_checkpoint(root)
+    resumable = checkpoint is not None and checkpoint['query'] == query
+    if resumable and checkpoint['pages'] and not os.path.isdir(os.path.join(root, '_staging')):
+        resumable = False
+    if resumable:
+        logger.info(f"Resuming the ingest after {checkpoint['offset']} records, up to {checkpoint['watermark']}")
+    else:
+        if checkpoint is not None:
+            logger.info(f"Discarding the interrupted ingest of {checkpoint['query']}")
+        checkpoint = {'query': query, 'offset': 0, 'rows': 0, 'pages': 0, 'watermark': None, 'last_id': None}
+        os.makedirs(root, exist_ok=True)
+        write_checkpoint(root, checkpoint)
+
+    committed = checkpoint['offset']
+    written = checkpoint['rows']
+    if pagination == 'keyset':
+        after = (checkpoint['watermark'], checkpoint['last_id']) if committed else None
+        pages = iter_pages_by_key(start_date, end_date, limit, base_url, client, after)
+    else:
+        pages = iter_pages(start_date, end_date, limit, base_url, workers, client=client, start_offset=committed)
+    return written + write_pages_to_dataset(pages, root, checkpoint, validator, metrics, publish_lock)
+
+
+def as_datetime(column):
+    """
+    Converts a timestamp column to datetime64, unless it already is one.
+
+    Args:
+        column (pandas.Series): Timestamps as strings or datetime64
+
+    Returns:
+        pandas.Series: The column itself or its converted copy
+    """
+
+    if pd.api.types.is_datetime64_dtype(column):
+        return column
+    return pd.to_datetime(column)
+
+
+def complete_trips(pickup, dropoff):
+    """
+    Drops the trips with a missing (NaT) timestamp before the int64 arithmetic.
+
+    NaT is the smallest int64 on the nanosecond views, so it would turn into
+    durations of centuries and days far outside the data.
+
+    Args:
+        pickup (array-like): Pickup timestamps as datetime64
+        dropoff (array-like): Dropoff timestamps as datetime64
+
+    Returns:
+        tuple: (pickup, dropoff) as datetime64[ns] arrays, not copied if no timestamp is missing
+    """
+
+    pickup = np.asarray(pickup, dtype='datetime64[ns]')
+    dropoff = np.asarray(dropoff, dtype='datetime64[ns]')
+    complete = ~(np.isnat(pickup) | np.isnat(dropoff))
+    if complete.all():
+        return pickup, dropoff
+    return pickup[complete], dropoff[complete]
+
+
+def trip_seconds(pickup, dropoff):
+    """
+    Calculates trip durations in whole seconds on the int64 nanosecond views of the timestamps.
+
+    The timestamps must not be NaT, see complete_trips.
+
+    Args:
+        pickup (array-like): Pickup timestamps as datetime64
+        dropoff (array-like): Dropoff timestamps as datetime64
+
+    Returns:
+        numpy.ndarray: Trip durations as int32 seconds
+    """
+
+    pickup_ns = np.asarray(pickup, dtype='datetime64[ns]').view('int64')
+    dropoff_ns = np.asarray(dropoff, dtype='datetime64[ns]').view('int64')
+    return ((dropoff_ns - pickup_ns) // 1_000_000_000).astype(np.int32)
+
+
+def day_keys(pickup):
+    """
+    Floors pickup timestamps to their day as the number of days since 1970-01-01.
+
+    The timestamps must not be NaT, see complete_trips.
+
+    Args:
+        pickup (array-like): Pickup timestamps as datetime64
+
+    Returns:
+        numpy.ndarray: int64 day numbers
+    """
+
+    return np.asarray(pickup, dtype='datetime64[ns]').view('int64') // NS_PER_DAY
+
+
+def sum_by_day(keys, values):
+    """
+    Sums values per day with bincount, which is linear in the number of rows.
+
+    NaN values are left out of the sums and counts like in pandas, their day is kept.
+
+    Args:
+        keys (numpy.ndarray): int64 day numbers, see day_keys
+        values (numpy.ndarray): Values to sum
+
+    Returns:
+        tuple: (day numbers with at least one row, sums as float64, counts of the values that aren't NaN)
+    """
+
+    if not len(keys):
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='float64'), np.empty(0, dtype='int64')
+    first = keys.min()
+    offsets = keys - first
+    rows = np.bincount(offsets)
+    known = ~np.isnan(values)
+    if known.all():
+        counts, sums = rows, np.bincount(offsets, weights=values)
+    else:
+        counts = np.bincount(offsets[known], minlength=len(rows))
+        sums = np.bincount(offsets[known], weights=values[known], minlength=len(rows))
+    present = np.flatnonzero(rows)
+    return present + first, sums[present], counts[present]
+
+
+def sketch_buckets(seconds):
+    """
+    Maps trip durations to the buckets of the quantile sketch.
+
+    Args:
+        seconds (numpy.ndarray): Trip durations in whole seconds
+
+    Returns:
+        numpy.ndarray: Bucket numbers below SKETCH_BUCKETS
+    """
+
+    return SKETCH_TABLE[np.clip(seconds, 0, len(SKETCH_TABLE) - 1)]
+
+
+def sketch_quantile(sketch, q):
+    """
+    Estimates a quantile of the trip durations counted in a sketch.
+
+    The estimate is the center of the bucket holding the quantile, within about
+    1% of the exact quantile for durations between a second and a week.
+
+    Args:
+        sketch (numpy.ndarray): Trip count per bucket, see sketch_buckets
+        q (float): Quantile between 0 and 1
+
+    Returns:
+        float: Trip duration in seconds, NaN if the sketch is empty
+    """
+
+    return float(sketch_quantiles(np.asarray(sketch)[np.newaxis], q)[0])
+
+
+def sketch_quantiles(sketches, q):
+    """
+    Estimates a quantile of every sketch of a stack, see sketch_quantile.
+
+    Args:
+        sketches (numpy.ndarray): One sketch per row
+        q (float): Quantile between 0 and 1
+
+    Returns:
+        numpy.ndarray: Trip duration in seconds per sketch, NaN for the empty ones
+    """
+
+    counts = np.cumsum(sketches, axis=1)
+    total = counts[:, -1]
+    bucket = (counts <= (q * (total - 1))[:, np.newaxis]).sum(axis=1)
+    seconds = np.where(bucket == 0, 0.0, 2 * SKETCH_GAMMA ** (bucket - 1.0) / (SKETCH_GAMMA + 1))
+    return np.where(total > 0, seconds, np.nan)
+
+
+def accumulate_by_day(keys, seconds):
+    """
+    Reduces trip durations to their per-day sum, count, minimum, maximum and quantile sketch.
+
+    The trips are grouped by day in one pass, the sums, counts and extremes are
+    reduced per group and the sketch is counted with bincount. All of them can be
+    merged, see merge_daily_partials.
+
+    Args:
+        keys (numpy.ndarray): int64 day numbers, see day_keys
+        seconds (numpy.ndarray): Trip durations in seconds
+
+    Returns:
+        pandas.DataFrame: Per-day partials, see daily_partials_frame
+    """
+
+    if not len(keys):
+        empty = np.empty(0, dtype='int64')
+        return daily_partials_frame(empty, empty, empty, empty, empty, np.empty((0, SKETCH_BUCKETS), dtype='int64'))
+    first = keys.min()
+    offsets = keys - first
+    days = int(offsets.max()) + 1
+    if np.any(offsets[1:] < offsets[:-1]):
+        # pages usually come in pickup order, otherwise a radix sort on the small day offsets groups them
+        order = np.argsort(offsets.astype(np.min_scalar_type(days)), kind='stable')
+        offsets, seconds = offsets[order], seconds[order]
+    starts = np.flatnonzero(np.concatenate([[True], offsets[1:] != offsets[:-1]]))
+    sketches = np.bincount(offsets * SKETCH_BUCKETS + sketch_buckets(seconds), minlength=days * SKETCH_BUCKETS)
+    return daily_partials_frame(
+        offsets[starts] + first,
+        np.add.reduceat(seconds, starts, dtype='int64'),
+        np.diff(np.append(starts, len(offsets))),
+        np.minimum.reduceat(seconds, starts),
+        np.maximum.reduceat(seconds, starts),
+        sketches.reshape(days, SKETCH_BUCKETS)[offsets[starts]],
+    )
+
+
+def calculate_trip_length(df):
+    """
+    Calculates trip duration in minutes for each taxi ride.
+
+    The timestamps are only converted if they aren't datetime64 yet, and the
+    caller's DataFrame is left unchanged: the result is a shallow copy sharing
+    the timestamp columns with it.
+
+    Args:
+        df (pandas.DataFrame): DataFrame containing pickup and dropoff timestamps
+
+    Returns:
+        pandas.DataFrame: DataFrame with added 'trip_length' column in minutes
+    """
+
+    trips = df.copy(deep=False)
+    pickup = as_datetime(df['tpep_pickup_datetime'])
+    dropoff = as_datetime(df['tpep_dropoff_datetime'])
+    if pickup is not df['tpep_pickup_datetime']:
+        trips['tpep_pickup_datetime'] = pickup
+    if dropoff is not df['tpep_dropoff_datetime']:
+        trips['tpep_dropoff_datetime'] = dropoff
+    # get length of each trip, NaN if a timestamp is missing
+    pickup_ns, dropoff_ns = pickup.to_numpy(dtype='datetime64[ns]'), dropoff.to_numpy(dtype='datetime64[ns]')
+    missing = np.isnat(pickup_ns) | np.isnat(dropoff_ns)
+    if missing.any():
+        trip_length = np.full(len(trips), np.nan)
+        trip_length[~missing] = trip_seconds(pickup_ns[~missing], dropoff_ns[~missing]) / 60
+    else:
+        trip_length = trip_seconds(pickup_ns, dropoff_ns) / 60
+    trips['trip_length'] = trip_length
+    return trips
+
+
+def aggregate_daily_trips(df):
+    """
+    Aggregates trip data by date and calculates daily total trip times.
+
+    Args:
+        df (pandas.DataFrame): DataFrame containing trip data
+
+    Returns:
+        pandas.DataFrame: Daily summary with total trip times in hours
+    """
+
+    pickup = df['tpep_pickup_datetime'].to_numpy(dtype='datetime64[ns]')
+    minutes = df['trip_length'].to_numpy(dtype='float64')
+    # trips without a pickup have no day
+    picked_up = ~np.isnat(pickup)
+    if not picked_up.all():
+        pickup, minutes = pickup[picked_up], minutes[picked_up]
+    days, minutes, _ = sum_by_day(day_keys(pickup), minutes)
+    return pd.DataFrame({
+        'tpep_pickup_datetime': days.astype('datetime64[D]').astype('datetime64[ns]'),
+        'daily_trip_time (in hours)': np.round(minutes / 60, 1)
+    })
+
+
+def calculate_rolling_average(df, window):
+    """
+    Calculates rolling average of daily trip times.
+
+    The window spans calendar days, a day without any trips doesn't pull an
+    older day into the window.
+
+    Args:
+        df (pandas.DataFrame): DataFrame containing daily trip summaries
+        window (int): Size of the rolling window in days
+
+    Returns:
+        pandas.DataFrame: DataFrame with added rolling average column
+    """
+
+    rolling = df.rolling(f"{window}D", on='tpep_pickup_datetime')['daily_trip_time (in hours)']
+    df['rolling_average'] = rolling.mean().round(1).to_numpy()
+    return df
+
+
+def rolling_statistics(daily, windows=ROLLING_WINDOWS, closed='right'):
+    """
+    Calculates rolling statistics of the daily trip times over several calendar windows.
+
+    Every window is a time offset like '45D', with the default 'closed' of
+    'right' it ends with the day of the row and reaches back to the day after
+    (day - window). The mean of the daily trip time and the trip count are
+    pandas rolling sums, updated incrementally as days enter and leave the
+    window. The median and the 95th percentile are the ones of the trip
+    durations in the window: the quantile sketches of the days are summed over
+    the window, as the difference of two cumulative sums of the sketches, and
+    read like in trip_length_statistics. They are NaN if a day of the window
+    was only summed by the API. With one row per day this stays in the
+    milliseconds for years of history.
+
+    Args:
+        daily (pandas.DataFrame): One row per day with 'tpep_pickup_datetime' and
+            'daily_trip_time (in hours)', e.g. from aggregate_daily_trips or the daily
+            summary. Rolling trip counts are added if it has a 'trip_count' column
+            and the trip duration quantiles if it has a 'trip_seconds_sketch' column.
+        windows (sequence): Pandas time offsets of the windows
+        closed (str): Which window endpoints are included, see pandas.DataFrame.rolling
+
+    Returns:
+        pandas.DataFrame: The pickup days and, for every window, the mean of the daily
+            trip time (in hours), e.g. 'rolling_mean_45D', the median and 95th
+            percentile trip duration in minutes, e.g. 'rolling_median_trip_minutes_45D',
+            and the trip count
+    """
+
+    days = daily.sort_values('tpep_pickup_datetime').set_index('tpep_pickup_datetime')
+    # whole tenths of an hour keep the incremental sums exact, like update_daily_summary
+    tenths = np.rint(days['daily_trip_time (in hours)'].astype('float64') * 10)
+    sketched = 'trip_seconds_sketch' in days
+    if sketched:
+        missing = days['trip_seconds_sketch'].isna().to_numpy()
+        sketches = np.zeros((len(days) + 1, SKETCH_BUCKETS), dtype='int64')
+        if not missing.all():
+            sketches[1:][~missing] = np.stack(days['trip_seconds_sketch'][~missing].tolist())
+        sketches = np.cumsum(sketches, axis=0)
+        positions = pd.Series(np.arange(len(days), dtype='float64'), index=days.index)
+    statistics = {}
+    for window in windows:
+        rolling = tenths.rolling(window, closed=closed)
+        statistics[f"rolling_mean_{window}"] = np.round(rolling.mean()) / 10
+        if sketched:
+            # the first and the last day of every window, NaN for an empty one
+            first = positions.rolling(window, closed=closed).min().fillna(0).to_numpy('int64')
+            last = positions.rolling(window, closed=closed).max().fillna(-1).to_numpy('int64') + 1
+            in_window = sketches[last] - sketches[first]
+            unknown = (pd.Series(missing, index=days.index, dtype='float64').rolling(window, closed=closed).sum() > 0).to_numpy()
+            for name, q in (('median', 0.5), ('p95', 0.95)):
+                minutes = np.round(sketch_quantiles(in_window, q) / 6) / 10
+                statistics[f"rolling_{name}_trip_minutes_{window}"] = np.where(unknown, np.nan, minutes)
+        if 'trip_count' in days:
+            trip_counts = days['trip_count'].rolling(window, closed=closed).sum()
+            statistics[f"rolling_trip_count_{window}"] = trip_counts.fillna(0).astype('int64')
+    return pd.DataFrame(statistics, index=days.index).reset_index()
+
+
+def process_taxi_data(df, windows=ROLLING_WINDOWS):
+    """
+    Processes taxi data into daily trip times and their rolling statistics.
+
+    Args:
+        df (pandas.DataFrame): Raw taxi ride data
+        windows (sequence): Pandas time offsets of the rolling windows, see rolling_statistics
+
+    Returns:
+        tuple: (trip_lengths DataFrame, daily_summary DataFrame with the 45 day rolling
+            average, rolling statistics DataFrame)
+    """
+
+    trip_lengths = calculate_trip_length(df)
+    daily_summary = calculate_rolling_average(aggregate_daily_trips(trip_lengths), 45)
+    return trip_lengths, daily_summary, rolling_statistics(daily_summary, windows)
+
+
+def daily_partials_frame(days, sums, counts, mins=None, maxs=None, sketches=None):
+    """
+    Builds the per-day partials DataFrame from the arrays returned by sum_by_day or accumulate_by_day.
+
+    The minimum, maximum and sketch are unknown (NaN and None) for days that were
+    only summed, e.g. by the API in aggregate mode.
+
+    Args:
+        days (numpy.ndarray): int64 day numbers
+        sums (numpy.ndarray): Summed trip seconds per day
+        counts (numpy.ndarray): Trip count per day
+        mins (numpy.ndarray, optional): Shortest trip per day in seconds
+        maxs (numpy.ndarray, optional): Longest trip per day in seconds
+        sketches (numpy.ndarray, optional): Trip count per day and sketch bucket
+
+    Returns:
+        pandas.DataFrame: One row per pickup day with 'trip_seconds', 'trip_count',
+            'trip_seconds_min', 'trip_seconds_max' and 'trip_seconds_sketch'
+    """
+
+    unknown = np.full(len(days), np.nan)
+    return pd.DataFrame({
+        'tpep_pickup_datetime': days.astype('datetime64[D]').astype('datetime64[ns]'),
+        'trip_seconds': sums.astype('int64'),
+        'trip_count': counts.astype('int64'),
+        'trip_seconds_min': unknown if mins is None else mins.astype('float64'),
+        'trip_seconds_max': unknown if maxs is None else maxs.astype('float64'),
+        'trip_seconds_sketch': pd.Series([None] * len(days) if sketches is None else list(sketches), dtype='object')
+    })
+
+
+def summarize_daily_trips(df):
+    """
+    Reduces trips to their per-day partials, see accumulate_by_day.
+
+    Trips with a missing timestamp have no duration and aren't counted.
+
+    Args:
+        df (pandas.DataFrame): DataFrame containing pickup and dropoff timestamps
+
+    Returns:
+        pandas.DataFrame: Per-day partials, see daily_partials_frame
+    """
+
+    pickup, dropoff = complete_trips(as_datetime(df['tpep_pickup_datetime']), as_datetime(df['tpep_dropoff_datetime']))
+    return accumulate_by_day(day_keys(pickup), trip_seconds(pickup, dropoff))
+
+
+def aggregates_to_daily_trips(data):
+    """
+    Reduces the groups returned for create_aggregate_params to per-day partials.
+
+    The duration of a trip is its dropoff seconds since midnight minus its pickup
+    seconds since midnight plus one day per midnight in between, so the summed
+    duration of a group is derived from its summed seconds and its day difference.
+    The API leaves null fields out, a group without a dropoff day is dropped.
+
+    Args:
+        data (list): Groups of all pages, see create_aggregate_params
+
+    Returns:
+        pandas.DataFrame: Same shape as the result of summarize_daily_trips
+    """
+
+    groups = pd.DataFrame(data, columns=['pickup_day', 'dropoff_day', 'trip_count', 'pickup_seconds', 'dropoff_seconds'])
+    incomplete = groups['pickup_day'].isna() | groups['dropoff_day'].isna()
+    if incomplete.any():
+        logger.warning(f"Dropping {int(incomplete.sum())} daily groups without a pickup or dropoff day")
+        groups = groups[~incomplete]
+    pickup_day = pd.to_datetime(groups['pickup_day'])
+    trip_count = groups['trip_count'].astype('int64')
+    days_between = (pd.to_datetime(groups['dropoff_day']) - pickup_day) // pd.Timedelta(days=1)
+    trip_seconds = (trip_count * days_between.astype('int64') * 86_400
+                    + groups['dropoff_seconds'].astype('int64') - groups['pickup_seconds'].astype('int64'))
+    daily = pd.DataFrame({'tpep_pickup_datetime': pickup_day, 'trip_seconds': trip_seconds, 'trip_count': trip_count})
+    daily = daily.groupby('tpep_pickup_datetime').sum()
+    days = daily.index.to_numpy().astype('datetime64[D]').astype('int64')
+    return daily_partials_frame(days, daily['trip_seconds'].to_numpy(), daily['trip_count'].to_numpy())
+
+
+def fetch_daily_aggregates(start_date, end_date, limit, base_url, client=None):
+    """
+    Retrieves the per-day trip counts and summed trip durations computed by the API.
+
+    Only a few groups per day are transferred instead of every trip, the result
+    can be folded into the daily summary directly.
+
+    Args:
+        start_date (str): Start date for the data range
+        end_date (str): End date for the data range
+        limit (int): Maximum number of groups per API request
+        base_url (str): Base URL for the API endpoint
+        client (ApiClient, optional): Client shared by all requests
+
+    Returns:
+        pandas.DataFrame: Same shape as the result of summarize_daily_trips
+
+    Raises:
+        RequestException: If a page fails after all retry attempts
+    """
+
+    data = []
+    for page in iter_pages(start_date, end_date, limit, base_url, params_builder=create_aggregate_params, client=client):
+        data.extend(page)
+    logger.info(f"Fetched {len(data)} daily groups")
+    return aggregates_to_daily_trips(data)
+
+
+def trip_length_statistics(daily, start_date=None, end_date=None):
+    """
+    Reports the trip length statistics of a date range straight from the per-day partials.
+
+    The mean is the mean over all trips, i.e. the summed trip seconds divided by
+    the number of trips, not the mean of the daily totals. The median and the
+    95th percentile are read from the merged sketches of the days, they are NaN
+    like the minimum and the maximum if a day of the range was only summed by
+    the API.
+
+    Args:
+        daily (pandas.DataFrame): Per-day partials or the daily summary
+        start_date (str, optional): First pickup day of the range
+        end_date (str, optional): Last pickup day of the range
+
+    Returns:
+        dict: Number of trips and the mean, median, 95th percentile, minimum and
+            maximum trip length in minutes
+    """
+
+    days = daily['tpep_pickup_datetime']
+    in_range = pd.Series(True, index=daily.index)
+    if start_date is not None:
+        in_range &= days >= pd.Timestamp(start_date).normalize()
+    if end_date is not None:
+        in_range &= days <= pd.Timestamp(end_date)
+    selected = daily[in_range]
+    trip_count = int(selected['trip_count'].sum())
+    sketches = selected['trip_seconds_sketch']
+    median = p95 = np.nan
+    if trip_count and sketches.notna().all():
+        sketch = np.sum(np.stack(sketches.tolist()), axis=0)
+        median, p95 = sketch_quantile(sketch, 0.5), sketch_quantile(sketch, 0.95)
+    return {
+        'trip_count': trip_count,
+        'mean_minutes': selected['trip_seconds'].sum() / trip_count / 60 if trip_count else np.nan,
+        'median_minutes': median / 60,
+        'p95_minutes': p95 / 60,
+        'min_minutes': selected['trip_seconds_min'].min(skipna=False) / 60,
+        'max_minutes': selected['trip_seconds_max'].max(skipna=False) / 60,
+    }
+
+
+def update_daily_summary(summary, new_days, window=45):
+    """
+    Folds per-day partials of newly ingested trips into the daily summary.
+
+    The days in 'new_days' replace the same days in the summary, matching the
+    partition replacement of the trip dataset, so folding a re-fetched day twice
+    doesn't count its trips twice. The rolling average is only recomputed for
+    the new days and the window - 1 days after them. Windows are calendar based
+    and the daily trip times are summed as whole tenths of an hour, so the result
+    is exactly the same no matter in which portions the days were folded in.
+
+    Args:
+        summary (pandas.DataFrame): Daily summary, e.g. from read_daily_summary
+        new_days (pandas.DataFrame): Per-day partials from summarize_daily_trips
+        window (int): Size of the rolling window in days
+
+    Returns:
+        pandas.DataFrame: Updated daily summary with DAILY_SUMMARY_COLUMNS
+    """
+
+    if new_days.empty:
+        return summary[DAILY_SUMMARY_COLUMNS]
+    new_days = new_days[['tpep_pickup_datetime', 'trip_seconds', 'trip_count',
+                         'trip_seconds_min', 'trip_seconds_max', 'trip_seconds_sketch']].copy()
+    new_days['daily_trip_time (in hours)'] = np.rint(new_days['trip_seconds'].to_numpy() / 360) / 10
+    kept = summary[~summary['tpep_pickup_datetime'].isin(new_days['tpep_pickup_datetime'])]
+    merged = pd.concat([kept, new_days], ignore_index=True) if len(kept) else new_days
+    merged = merged.sort_values('tpep_pickup_datetime', ignore_index=True)
+    rolling = merged['rolling_average'].to_numpy(dtype='float64', copy=True) if len(kept) else np.full(len(merged), np.nan)
+
+    day_numbers = merged['tpep_pickup_datetime'].to_numpy().astype('datetime64[D]').astype('int64')
+    new_numbers = new_days['tpep_pickup_datetime'].to_numpy().astype('datetime64[D]').astype('int64')
+    first, stop = np.searchsorted(day_numbers, [new_numbers.min(), new_numbers.max() + window])
+    context = np.searchsorted(day_numbers, new_numbers.min() - window + 1)
+    tenths = np.rint(merged['daily_trip_time (in hours)'].to_numpy()[context:stop] * 10).astype('int64')
+    cumulative = np.concatenate([[0], np.cumsum(tenths)])
+    # every target row averages the rows of the window - 1 calendar days before it and itself
+    targets = np.arange(first, stop)
+    lower = np.searchsorted(day_numbers, day_numbers[targets] - window + 1)
+    sums = cumulative[targets - context + 1] - cumulative[lower - context]
+    rolling[targets] = np.round(sums / (targets + 1 - lower) / 10, 1)
+
+    merged['rolling_average'] = rolling
+    return merged[DAILY_SUMMARY_COLUMNS]
+
+
+def read_daily_summary(file_path):
+    """
+    Reads the persisted daily summary, an empty one if it wasn't written yet.
+
+    Args:
+        file_path (str): Path to the Parquet file of the daily summary
+
+    Returns:
+        pandas.DataFrame: Daily summary with DAILY_SUMMARY_COLUMNS
+    """
+
+    if not os.path.exists(file_path):
+        logger.info(f"No daily summary at {file_path}, starting an empty one")
+        return pd.DataFrame({
+            'tpep_pickup_datetime': pd.Series(dtype='datetime64[ns]'),
+            'trip_seconds': pd.Series(dtype='int64'),
+            'trip_count': pd.Series(dtype='int64'),
+            'daily_trip_time (in hours)': pd.Series(dtype='float64'),
+            'rolling_average': pd.Series(dtype='float64'),
+            'trip_seconds_min': pd.Series(dtype='float64'),
+            'trip_seconds_max': pd.Series(dtype='float64'),
+            'trip_seconds_sketch': pd.Series(dtype='object')
+        })
+    summary = pd.read_parquet(file_path, engine='pyarrow')
+    # summaries written before the trip durations were sketched don't know them for their days
+    if 'trip_seconds_sketch' not in summary:
+        summary = summary.assign(trip_seconds_min=np.nan, trip_seconds_max=np.nan,
+                                 trip_seconds_sketch=pd.Series([None] * len(summary), dtype='object'))
+    return summary[DAILY_SUMMARY_COLUMNS]
+
+
+def write_daily_summary(summary, file_path):
+    """
+    Persists the daily summary, replacing the previous file atomically.
+
+    Args:
+        summary (pandas.DataFrame): Daily summary with DAILY_SUMMARY_COLUMNS
+        file_path (str): Path to the Parquet file of the daily summary
+    """
+
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    summary.to_parquet(tmp_path, engine='pyarrow', index=False)
+    os.replace(tmp_path, file_path)
+
+
+def open_trip_dataset(file_path):
+    """
+    Opens a Parquet file or the date-partitioned trip dataset without reading any data.
+
+    Args:
+        file_path (str): Path to the Parquet file or the root of the dataset
+
+    Returns:
+        pyarrow.dataset.Dataset: Dataset of the trips
+
+    Raises:
+        FileNotFoundError: If the specified file doesn't exist
+    """
+
+    if os.path.isdir(file_path):
+        return ds.dataset(file_path, schema=pa.unify_schemas([STORED_SCHEMA, PARTITION_SCHEMA]),
+                          format='parquet', partitioning=PARTITIONING)
+    return ds.dataset(file_path, schema=STORED_SCHEMA, format='parquet')
+
+
+def create_trip_filter(schema, start_date=None, end_date=None):
+    """
+    Creates the dataset filter selecting the trips picked up within a date range.
+
+    For the date-partitioned dataset the filter includes the partition key, so
+    only the partitions overlapping the range are opened.
+
+    Args:
+        schema (pyarrow.Schema): Schema of the dataset, see open_trip_dataset
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+
+    Returns:
+        pyarrow.dataset.Expression: Filter expression, None for the whole dataset
+    """
+
+    pickup = ds.field('tpep_pickup_datetime')
+    conditions = []
+    if start_date is not None:
+        start = pd.Timestamp(start_date)
+        conditions.append(pickup >= start)
+        if 'pickup_date' in schema.names:
+            conditions.append(ds.field('pickup_date') >= start.date())
+    if end_date is not None:
+        end = pd.Timestamp(end_date)
+        conditions.append(pickup <= end)
+        if 'pickup_date' in schema.names:
+            conditions.append(ds.field('pickup_date') <= end.date())
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return condition
+
+
+def summarize_trip_batch(batch):
+    """
+    Reduces one Arrow record batch of trips to its per-day partials.
+
+    Args:
+        batch (pyarrow.RecordBatch): Trips following TRIP_SCHEMA
+
+    Returns:
+        pandas.DataFrame: Same shape as the result of summarize_daily_trips
+    """
+
+    # nulls become NaT and the trips without a duration aren't counted, the other columns stay zero-copy views
+    pickup, dropoff = complete_trips(batch.column(0).to_numpy(zero_copy_only=False), batch.column(1).to_numpy(zero_copy_only=False))
+    return accumulate_by_day(day_keys(pickup), trip_seconds(pickup, dropoff))
+
+
+def merge_daily_partials(partials):
+    """
+    Combines per-day partials computed over separate portions of the trips.
+
+    Args:
+        partials (list): DataFrames shaped like the result of summarize_daily_trips
+
+    Returns:
+        pandas.DataFrame: One row per pickup day with the summed partials
+    """
+
+    partials = [p for p in partials if len(p)]
+    if not partials:
+        return summarize_trip_batch(pa.RecordBatch.from_pylist([], schema=TRIP_SCHEMA))
+    merged = pd.concat(partials, ignore_index=True).sort_values('tpep_pickup_datetime', kind='stable', ignore_index=True)
+    days = merged['tpep_pickup_datetime'].to_numpy()
+    starts = np.flatnonzero(np.concatenate([[True], days[1:] != days[:-1]]))
+    # a day stays unknown if any of its partials didn't sketch the durations
+    known = merged['trip_seconds_sketch'].notna().to_numpy()
+    sketches = np.zeros((len(merged), SKETCH_BUCKETS), dtype='int64')
+    if known.any():
+        sketches[known] = np.stack(merged['trip_seconds_sketch'][known].tolist())
+    sketches = np.add.reduceat(sketches, starts)
+    unknown = np.add.reduceat(~known, starts) > 0
+    result = daily_partials_frame(
+        days[starts].astype('datetime64[D]').astype('int64'),
+        np.add.reduceat(merged['trip_seconds'].to_numpy(), starts),
+        np.add.reduceat(merged['trip_count'].to_numpy(), starts),
+        np.minimum.reduceat(merged['trip_seconds_min'].to_numpy(), starts),
+        np.maximum.reduceat(merged['trip_seconds_max'].to_numpy(), starts),
+        sketches,
+    )
+    result.loc[unknown, 'trip_seconds_sketch'] = None
+    return result
+
+
+def summarize_batches(batches):
+    """
+    Reduces record batches of trips to per-day partials one batch at a time.
+
+    Args:
+        batches (iterable): Record batches following TRIP_SCHEMA
+
+    Returns:
+        tuple: (per-day partials like summarize_daily_trips, number of trips)
+    """
+
+    partials = []
+    rows = 0
+    for batch in batches:
+        partials.append(summarize_trip_batch(batch))
+        rows += batch.num_rows
+        # merge now and then so the number of partials stays small for long histories
+        if len(partials) >= 64:
+            partials = [merge_daily_partials(partials)]
+    return merge_daily_partials(partials), rows
+
+
+def summarize_dataset(file_path, start_date=None, end_date=None, batch_size=1_000_000, workers=1):
+    """
+    Computes the per-day partials of the stored trips batch by batch.
+
+    The trips are never loaded as a whole: every record batch is reduced to its
+    per-day sums and counts right away, so the peak memory depends on the batch
+    size and the number of days, not on the number of stored trips. The result
+    is the same as summarize_daily_trips over read_parquet_file. With more than
+    one worker the row groups are summarized in parallel processes, see
+    summarize_dataset_in_parallel.
+
+    Args:
+        file_path (str): Path to the Parquet file, the root of the dataset or the trip store
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+        batch_size (int): Maximum number of trips per record batch
+        workers (int): Number of worker processes, the trip store is always summarized in this one
+
+    Returns:
+        pandas.DataFrame: Same shape as the result of summarize_daily_trips
+    """
+
+    if is_trip_store(file_path):
+        partials, rows = summarize_batches(iter_trip_store(file_path, start_date, end_date))
+        logger.info(f"Summarized {rows} records of the memory-mapped trip store")
+        return partials
+    if workers > 1:
+        return summarize_dataset_in_parallel(file_path, start_date, end_date, batch_size, workers)
+
+    dataset = open_trip_dataset(file_path)
+    batches = dataset.to_batches(columns=trip_columns(), filter=create_trip_filter(dataset.schema, start_date, end_date),
+                                 batch_size=batch_size, batch_readahead=2, fragment_readahead=1)
+    partials, rows = summarize_batches(batches)
+    logger.info(f"Summarized {rows} records batch by batch")
+    return partials
+
+
+def summarize_row_groups(row_groups, start_date=None, end_date=None, batch_size=1_000_000):
+    """
+    Computes the per-day partials of some row groups, runs in the worker processes.
+
+    Args:
+        row_groups (list): (file path, row group ids) tuples
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+        batch_size (int): Maximum number of trips per record batch
+
+    Returns:
+        pandas.DataFrame: Same shape as the result of summarize_daily_trips
+    """
+
+    parquet_format = ds.ParquetFileFormat()
+    local = fs.LocalFileSystem()
+    condition = create_trip_filter(TRIP_SCHEMA, start_date, end_date)
+
+    def batches():
+        for path, ids in row_groups:
+            fragment = parquet_format.make_fragment(path, filesystem=local, row_groups=ids)
+            yield from fragment.to_batches(schema=STORED_SCHEMA, columns=trip_columns(), filter=condition, batch_size=batch_size)
+
+    return summarize_batches(batches())[0]
+
+
+def summarize_dataset_in_parallel(file_path, start_date=None, end_date=None, batch_size=1_000_000, workers=None):
+    """
+    Computes the per-day partials of the stored trips in a pool of processes.
+
+    The row groups of the partitions overlapping the date range are dealt out to
+    the workers in contiguous slices. Every worker only returns its small per-day
+    partials, which are merged here, so the result is the same as the one of the
+    sequential summarize_dataset.
+
+    Args:
+        file_path (str): Path to the Parquet file or the root of the dataset
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+        batch_size (int): Maximum number of trips per record batch
+        workers (int, optional): Number of worker processes, the CPU count by default
+
+    Returns:
+        pandas.DataFrame: Same shape as the result of summarize_daily_trips
+    """
+
+    workers = workers or os.cpu_count()
+    dataset = open_trip_dataset(file_path)
+    # partitions are pruned by their key, row groups by the statistics of the pickup column
+    row_groups = [
+        (fragment.path, [row_group.id for row_group in row_group_fragment.row_groups])
+        for fragment in dataset.get_fragments(filter=create_trip_filter(dataset.schema, start_date, end_date))
+        for row_group_fragment in fragment.split_by_row_group(create_trip_filter(TRIP_SCHEMA, start_date, end_date))
+    ]
+    # a few tasks per worker balance the load without sending every row group on its own
+    tasks = max(1, min(len(row_groups), workers * 4))
+    slices = [row_groups[i * len(row_groups) // tasks:(i + 1) * len(row_groups) // tasks] for i in range(tasks)]
+    # spawned workers don't inherit the Arrow thread pools of this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        partials = list(executor.map(
+            partial(summarize_row_groups, start_date=start_date, end_date=end_date, batch_size=batch_size), slices
+        ))
+    logger.info(f"Summarized {len(row_groups)} row groups with {workers} worker processes")
+    return merge_daily_partials(partials)
+
+
+def read_parquet_file(file_path, start_date=None, end_date=None):
+    """
+    Reads a Parquet file, the date-partitioned trip dataset or the trip store into a pandas DataFrame.
+
+    When a date range is given, only the partitions of the pickup days that overlap
+    the range are opened and the trips are filtered to the range. The trip store
+    is memory-mapped instead, see read_trip_store, and a range within one day
+    becomes a DataFrame on the mapped buffers without copying them.
+
+    Args:
+        file_path (str): Path to the Parquet file, the root of the dataset or the trip store (*.arrow)
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+
+    Returns:
+        pandas.DataFrame: DataFrame containing the Parquet file data
+
+    Raises:
+        FileNotFoundError: If the specified file doesn't exist
+        ArrowIOError: If there's an error reading the Parquet file
+        Exception: For other unexpected errors
+    """
+
+    try:
+        if is_trip_store(file_path):
+            # split blocks keep every single-chunk column on its buffer, several days are concatenated
+            return read_trip_store(file_path, start_date, end_date).to_pandas(split_blocks=True)
+        dataset = open_trip_dataset(file_path)
+        table = dataset.to_table(columns=trip_columns(), filter=create_trip_filter(dataset.schema, start_date, end_date))
+        df = table.to_pandas()
         return df
     except FileNotFoundError:
         logger.error(f"File not found: {file_path}")
@@ -220,4 +2584,180 @@ def read_parquet_file(file_path):
         raise
     except Exception as e:
         logger.error(f"Unexpected error reading file: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+
+def is_trip_store(file_path):
+    return str(file_path).endswith(TRIP_STORE_SUFFIX)
+
+
+def trip_store_path(store_path, day):
+    return os.path.join(store_path, f"{day}{TRIP_STORE_SUFFIX}")
+
+
+def trip_store_files(store_path):
+    """
+    Lists the day files of the trip store in the order of the days.
+
+    Args:
+        store_path (str): Path of the trip store, see export_trip_store
+
+    Returns:
+        list: Paths of the day files
+
+    Raises:
+        FileNotFoundError: If the trip store doesn't exist
+    """
+
+    return [os.path.join(store_path, name) for name in sorted(os.listdir(store_path)) if name.endswith(TRIP_STORE_SUFFIX)]
+
+
+def split_by_day(table):
+    """
+    Splits trips sorted by pickup, all with a pickup, into the trips of every pickup day.
+
+    Args:
+        table (pyarrow.Table): Trips following TRIP_SCHEMA in one chunk
+
+    Yields:
+        tuple: (day as YYYY-MM-DD, pyarrow.Table slice of the trips of the day)
+    """
+
+    days = table.column(0).to_numpy().astype('datetime64[D]')
+    firsts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.array([], dtype=np.int64)
+    for first, stop in zip(firsts, np.r_[firsts[1:], len(days)]):
+        yield str(days[first]), table.slice(int(first), int(stop - first))
+
+
+def export_trip_store(dataset_path, store_path, days=None, metrics=None):
+    """
+    Writes the stored trips of some or all days to the trip store, a directory of uncompressed Arrow IPC files.
+
+    Every pickup day is one file, named after the day, with one record batch of
+    TRIP_SCHEMA sorted by pickup, so the store is sorted as a whole. Its buffers
+    are laid out like the arrays in memory, which lets read_trip_store
+    memory-map them instead of decoding anything. Only the files of the given
+    days are rewritten, which keeps the export of a run proportional to the
+    days it ingested; the files of days without trips anymore are removed. A
+    file is written next to its day and moved over it, so readers mapping the
+    previous one keep it. Trips without a pickup are left out, the partitions
+    of the dataset hold none.
+
+    A store that doesn't exist yet, or is a single file of an earlier version,
+    gets every day of the dataset.
+
+    Args:
+        dataset_path (str): Path to the Parquet file or the root of the dataset
+        store_path (str): Path of the trip store
+        days (list, optional): Days to export as YYYY-MM-DD, every day by default
+        metrics (StageMetrics, optional): Measures the export
+
+    Returns:
+        int: Number of trips exported
+    """
+
+    if os.path.isfile(store_path):
+        os.remove(store_path)
+    if not os.path.isdir(store_path):
+        days = None
+    days = None if days is None else set(days)
+    dataset = open_trip_dataset(dataset_path)
+    partitions = {}
+    for fragment in dataset.get_fragments():
+        day = ds.get_partition_keys(fragment.partition_expression).get('pickup_date')
+        if days is None or day is None or day.isoformat() in days:
+            partitions.setdefault(day, []).append(fragment)
+    os.makedirs(store_path, exist_ok=True)
+    exported = set()
+    with measure(metrics, 'export_store') as stage:
+        for day in sorted(partitions, key=lambda d: (d is None, d)):
+            parts = [fragment.to_table(schema=dataset.schema, columns=trip_columns()) for fragment in partitions[day]]
+            table = sort_by_pickup(pa.concat_tables(parts).combine_chunks())
+            table = table.slice(0, len(table) - table.column(0).null_count)
+            for trip_day, trips in split_by_day(table):
+                if days is not None and trip_day not in days:
+                    continue
+                path = trip_store_path(store_path, trip_day)
+                with pa.ipc.new_file(f"{path}.tmp", TRIP_SCHEMA) as writer:
+                    writer.write_table(trips)
+                os.replace(f"{path}.tmp", path)
+                exported.add(trip_day)
+                stage.rows += len(trips)
+                stage.bytes_written += os.path.getsize(path)
+        for path in trip_store_files(store_path):
+            day = os.path.basename(path)[:-len(TRIP_STORE_SUFFIX)]
+            if day not in exported and (days is None or day in days):
+                os.remove(path)
+    logger.info(f"Exported {stage.rows} trips of {len(exported)} days to the trip store at: {store_path}")
+    return stage.rows
+
+
+def open_trip_store(path):
+    """
+    Memory-maps a day file of the trip store without reading any trips.
+
+    Args:
+        path (str): Path of the day file, see trip_store_files
+
+    Returns:
+        pyarrow.ipc.RecordBatchFileReader: Reader of the day batch
+    """
+
+    return pa.ipc.open_file(pa.memory_map(path, 'r'))
+
+
+def iter_trip_store(store_path, start_date=None, end_date=None):
+    """
+    Yields the trips of the trip store picked up within a date range, without copying them.
+
+    The batches are views on the mapped files. The files of the days outside
+    the range aren't opened and, since the pickups are sorted, the range is
+    found by binary search on the mapped pickup column, so only the pages of
+    the requested trips and a few of the search are read from disk.
+
+    Args:
+        store_path (str): Path of the trip store, see export_trip_store
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+
+    Yields:
+        pyarrow.RecordBatch: Trips of one day following TRIP_SCHEMA
+
+    Raises:
+        FileNotFoundError: If the trip store doesn't exist
+    """
+
+    start = None if start_date is None else np.datetime64(pd.Timestamp(start_date).value, 'ns')
+    end = None if end_date is None else np.datetime64(pd.Timestamp(end_date).value, 'ns')
+    for path in trip_store_files(store_path):
+        day = np.datetime64(os.path.basename(path)[:-len(TRIP_STORE_SUFFIX)], 'D')
+        if start is not None and day < start.astype('datetime64[D]'):
+            continue
+        if end is not None and day > end.astype('datetime64[D]'):
+            break
+        reader = open_trip_store(path)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if not batch.num_rows:
+                continue
+            pickup = batch.column(0).to_numpy()
+            first = 0 if start is None else int(np.searchsorted(pickup, start, 'left'))
+            last = len(pickup) if end is None else int(np.searchsorted(pickup, end, 'right'))
+            if first < last:
+                yield batch.slice(first, last - first)
+
+
+def read_trip_store(store_path, start_date=None, end_date=None):
+    """
+    Reads the trips of the trip store picked up within a date range as a table on the mapped files.
+
+    Args:
+        store_path (str): Path of the trip store, see export_trip_store
+        start_date (str, optional): First pickup timestamp to read
+        end_date (str, optional): Last pickup timestamp to read
+
+    Returns:
+        pyarrow.Table: Trips following TRIP_SCHEMA, one chunk per day
+    """
+
+    return pa.Table.from_batches(list(iter_trip_store(store_path, start_date, end_date)), schema=TRIP_SCHEMA)